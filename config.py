@@ -20,6 +20,14 @@ database
         The name of your account for the database.
     * passwd
         The password to your database account.
+    * pool_size
+        The max number of connections open at once. Only needs to be more than 1 when several threads share the database.
+    * retries
+        The number of times to retry a query when the connection to the database is lost.
+    * backoff
+        The seconds to wait before the first retry. Each retry waits about twice as long as the one before.
+    * max_backoff
+        The max seconds to wait between retries.
 
 table
     **No values in table can be None**
@@ -55,6 +63,8 @@ table
             A list of column names in tables for storing Codeforces submission
             samples.
 
+    If content_hash is enabled a content_hash column is added after these columns.
+
 extensions
     **You must set these for the language you are collecting for. Otherwise no files will be collected.**
 
@@ -93,6 +103,20 @@ limits
             The first record to process when running a script. It is best to leave this as None and give it when running the scripts.
         - count
             The number of records to process before stopping. Useful if you don't want the scrip to run for too long or you only need a certain number of records to be processed.
+    * git_commits (only)
+        - max_commit_files
+            The maximum number of files to add from a single commit. Once it is reached no more pages of the commit's files are requested. None for no limit.
+        - page_workers
+            The number of pages of a large commit's files to request at the same time.
+        - page_min_rate
+            Pages are only requested at the same time while more than this many GitHub API requests are left before the rate limit.
+    * git_projects (only)
+        - blob_threshold
+            Projects with at most this many candidate source files have their files downloaded directly instead of cloning the repository. Set to 0 to always clone.
+        - blob_workers
+            The number of files to download at the same time when a project is not cloned.
+        - clone_ahead
+            The number of valid projects to queue before cloning them. Queued projects are cloned while waiting for the GitHub API rate limit to reset instead of sleeping. Set to 0 to clone each project right away.
     * codeforces (only)
         - subs_start
             The first submission to collect when processing a user. Should most likely be left at 1 unless you have modified the script to collect from a submission page other than the first.
@@ -103,6 +127,105 @@ limits
         - max_no_source
             The maximum number of samples to try to collect that have no source before moving onto the next user. Don't change unless you are not using selenium.
 
+repo_cache
+    * enabled
+        - Whether to keep mirrors of cloned GitHub projects between runs. Collecting the same projects for several languages will then only clone them once.
+    * dir
+        - The directory to store the mirrors in. If None they are stored in slrg/git/repo_cache.
+    * max_size
+        - The maximum size of the cache in bytes. The least recently used mirrors are removed when it is exceeded, except ones with a checkout still in use.
+
+temp_repos
+    * dir
+        - The directory projects are cloned into while they are processed. If None slrg/git/projects/temp_repos is used. A tmpfs directory like /dev/shm/slrg_repos avoids disk writes.
+    * backlog
+        - The maximum number of cloned projects waiting to be deleted in the background. Set to 0 to delete them before moving on.
+    * min_free
+        - The number of free bytes needed in dir before another project is cloned. Cloning waits for pending deletions while there is less.
+
+skip_index
+    * enabled
+        - Whether to load the keys already in the collection tables (commit_sha and file_sha, project_id and file_hash, or submission_id) when a collection starts. Files and submissions that are already in the table for their language are then skipped before they are downloaded or read.
+    * error_rate
+        - The false positive rate of the index. A new record falsely reported as collected will be skipped.
+    * max_bytes
+        - The max memory used by the index. If the table is too large for the error rate the error rate will go up instead.
+    * extra
+        - The number of new keys to leave room for in the index.
+
+near_dup
+    * enabled
+        - Whether to check each new sample against an index of the samples already collected for near duplicates, like the same template with a different solve function. Needs numpy.
+    * action
+        - 'skip' to not store near duplicates or 'flag' to store them and log what they are near duplicates of. Samples are identified by their table and key columns, ie) c_projects:<project_id>/<file_hash>.
+    * dir
+        - The directory for the index files. If None slrg/neardup is used. Each script has its own index.
+    * num_perm
+        - The number of MinHash values in a sample's signature.
+    * bands
+        - The number of LSH bands. Must divide num_perm. More bands find samples that are less alike.
+    * threshold
+        - The min estimated similarity (0.0 to 1.0) for a sample to be a near duplicate.
+    * shingle
+        - The number of tokens in each shingle.
+    * batch_size
+        - The number of samples to add to the index before committing them to its file. Samples are added once they are stored in the database.
+
+storage
+    * backend
+        - 'mysql' to store collected samples in the database above or 'sqlite' to store them in a local SQLite file. SQLite files can be pushed to the database later with slrg-sync-sqlite. Gender lookups are also stored in the SQLite file.
+    * path
+        - The SQLite file. If None slrg/sqlite/<script>.db is used, ie) slrg/sqlite/git_projects.db.
+    * batch_size
+        - The number of inserts to commit to the SQLite file at a time.
+    * seed_genders
+        - Whether to copy the names in the database's gender table into the SQLite file when a collection starts, so names that are already known are not looked up with genderize.io again. Needs the database to be reachable. If it is not a warning is printed and collection goes on without it.
+
+content_hash
+    * enabled
+        - Whether the collection scripts store a content_hash column with a hash of each sample's normalised source. Its unique key means samples with the same content are only stored once. The column must be in the tables. slrg-init-db adds it to new tables when this is enabled, and slrg-init-db --check prints the ALTER TABLE statement for older ones. Duplicates within a run are skipped either way.
+
+compression
+    * enabled
+        - Whether the collection scripts compress the source code columns before storing them. The columns must be a binary type, ie) MEDIUMBLOB. slrg-init-db creates them that way when this is enabled. slrg-select decompresses them whether or not this is enabled.
+    * codec
+        - 'zlib', 'bz2', 'lzma' or 'zstd'. zstd needs the zstandard package. Each value records its codec, so it can be changed at any time.
+    * level
+        - The compression level for the codec.
+    * columns
+        - The columns to compress.
+    * threads
+        - The number of threads slrg-select uses to decompress results.
+
+features
+    * enabled
+        - Whether the collection scripts compute lexical features of each sample and store them in columns with the same names. The columns must be in the tables. slrg-init-db adds them, with an index on each, when this is enabled.
+    * names
+        - The features to compute. Any of 'char_count', 'line_count', 'token_count', 'blank_ratio', 'comment_ratio', 'avg_line_length' and 'max_line_length'.
+    * columns
+        - The columns the source of a sample can be in.
+    * batch_size
+        - The number of samples to compute features for and insert at a time.
+
+compressed_files
+    * threads
+        - The number of threads used to compress output files whose names end in .gz, .bz2, .xz or .zst. More than 1 compresses blocks of the file in parallel. Input files with these extensions are always read transparently.
+    * level
+        - The compression level. If None each codec's default is used.
+
+bulk_load
+    * enabled
+        - Whether the collection scripts stage the samples they collect in files and bulk load them with LOAD DATA LOCAL INFILE instead of inserting them one at a time. The MySQL server must allow local_infile. Samples are only in the database once their chunk is loaded. Not used with the sqlite storage backend.
+    * dir
+        - The directory to stage files in. If None slrg/bulk is used. Chunks that fail to load are left here.
+    * chunk_rows
+        - The number of samples to load at a time.
+    * duplicates
+        - 'ignore' to skip samples that are already in the table or 'replace' to replace them.
+
+predicate_costs
+    * The relative cost of each check made on a GitHub project before it is cloned: 'name' and 'contributors' use the GitHub API, 'gender' uses the smaller genderize.io quota. The projects collection runs the checks in the order with the lowest expected cost, based on how often each check has rejected projects. Those counts are kept in slrg/git/projects/predicate_stats.json.
+
 max_logs
     * The maximum number of logs to keep. **Cannot be None**
 
@@ -123,7 +246,11 @@ database = {
     'host': 'mysql-8-p.uleth.ca',
     'login': None,
     'name': 'sfa-slrg_data',
-    'passwd': None
+    'passwd': None,
+    'pool_size': 4,
+    'retries': 10,
+    'backoff': 1,
+    'max_backoff': 60
 }
 
 # Table information for each script
@@ -251,11 +378,17 @@ git_acct = {
 limits = {
     'git_projects': {
         'start': None,
-        'count': 10000
+        'count': 10000,
+        'blob_threshold': 20,
+        'blob_workers': 8,
+        'clone_ahead': 20
     },
     'git_commits': {
         'start': None,
-        'count': 10000
+        'count': 10000,
+        'max_commit_files': None,
+        'page_workers': 3,
+        'page_min_rate': 1000
     },
     'codeforces': {
         'start': None,
@@ -267,6 +400,94 @@ limits = {
     }
 }
 
+# Persistent cache of mirrored GitHub repositories used by the projects
+# collection
+repo_cache = {
+    'enabled': True,
+    'dir': None,
+    'max_size': 20 * 2**30  # 20GB
+}
+
+# Where and how projects are temporarily cloned during the projects
+# collection
+temp_repos = {
+    'dir': None,
+    'backlog': 4,
+    'min_free': 2**30  # 1GB
+}
+
+# Index of work that is already in the database so it can be skipped
+skip_index = {
+    'enabled': True,
+    'error_rate': 0.001,
+    'max_bytes': 64 * 2**20,  # 64MB
+    'extra': 100000
+}
+
+# Detecting near duplicate samples with MinHash
+near_dup = {
+    'enabled': False,
+    'action': 'flag',
+    'dir': None,
+    'num_perm': 128,
+    'bands': 16,
+    'threshold': 0.8,
+    'shingle': 5,
+    'batch_size': 500
+}
+
+# Where collected samples are stored
+storage = {
+    'backend': 'mysql',
+    'path': None,
+    'batch_size': 500,
+    'seed_genders': True
+}
+
+# Storing a hash of each sample's content
+content_hash = {
+    'enabled': False
+}
+
+# Compressing source code columns
+compression = {
+    'enabled': False,
+    'codec': 'zlib',
+    'level': 6,
+    'columns': ['file_contents', 'source_code'],
+    'threads': 4
+}
+
+# Lexical features stored with each sample
+features = {
+    'enabled': False,
+    'names': ['char_count', 'line_count', 'token_count', 'blank_ratio',
+              'comment_ratio'],
+    'columns': ['file_contents', 'source_code'],
+    'batch_size': 100
+}
+
+# Compressing record and export files
+compressed_files = {
+    'threads': 1,
+    'level': None
+}
+
+# Staging samples in files and loading them in bulk
+bulk_load = {
+    'enabled': False,
+    'dir': None,
+    'chunk_rows': 50000,
+    'duplicates': 'ignore'
+}
+
+# Relative cost of the checks made on GitHub projects before cloning
+predicate_costs = {
+    'name': 1,
+    'gender': 5,
+    'contributors': 1
+}
+
 # Maximum logs to keep per file
 max_logs_to_keep = 10
 
@@ -286,4 +507,15 @@ config = {
     'limits': limits,
     'cf_languages': cf_languages,
     'save_missing': save_missing,
+    'repo_cache': repo_cache,
+    'temp_repos': temp_repos,
+    'skip_index': skip_index,
+    'near_dup': near_dup,
+    'storage': storage,
+    'compression': compression,
+    'content_hash': content_hash,
+    'features': features,
+    'compressed_files': compressed_files,
+    'bulk_load': bulk_load,
+    'predicate_costs': predicate_costs,
 }
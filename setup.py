@@ -6,6 +6,11 @@ setup(
     packages=['slrg_data', 'slrg_data.collection'],
     install_requires=['requests', 'beautifulsoup4',
                       'pymysql', 'gitpython', 'selenium'],
+    extras_require={
+        'neardup': ['numpy'],
+        'columnar': ['numpy'],
+        'zstd': ['zstandard']
+    },
     python_requires='>=3',
     entry_points={
         'console_scripts': [
@@ -16,11 +21,17 @@ setup(
             'slrg-git-commits=slrg_data.collect_git_commits:_entry',
             'slrg-gender-codeforces=slrg_data.gender_codeforces:_entry',
             'slrg-filter-codeforces=slrg_data.filter_codeforces:_entry',
-            'slrg-cf-users=slrg_data.get_codeforces_user_list:_entry'
+            'slrg-cf-users=slrg_data.get_codeforces_user_list:_entry',
+            'slrg-sync-sqlite=slrg_data.sync_sqlite:_entry',
+            'slrg-init-db=slrg_data.init_db:_entry',
+            'slrg-near-dups=slrg_data.near_dups:_entry'
         ]
     },
     data_files=[
         ('slrg', ['config.py']),
+        ('slrg/bulk', []),
+        ('slrg/sqlite', []),
+        ('slrg/neardup', []),
         ('slrg/codeforces', []),
         ('slrg/codeforces/logs', []),
         ('slrg/git', []),
@@ -28,8 +39,10 @@ setup(
         ('slrg/git/projects/logs', []),
         ('slrg/git/projects/missing', []),
         ('slrg/git/projects/temp_repos', []),
+        ('slrg/git/repo_cache', []),
         ('slrg/git/commits', []),
         ('slrg/git/commits/logs', []),
-        ('slrg/git/commits/missing', [])
+        ('slrg/git/commits/missing', []),
+        ('slrg/git/commits/temp_repos', [])
     ],
     zip_safe=False)
@@ -8,3 +8,6 @@ from . import combine_json
 from . import gender_codeforces
 from . import filter_codeforces
 from . import get_codeforces_user_list
+from . import sync_sqlite
+from . import init_db
+from . import near_dups
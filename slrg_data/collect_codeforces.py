@@ -129,6 +129,11 @@ def main(file=None, start=None, count=None, db_login=None, db_passwd=None):
         info = collection.script.make_cf_info(
             file, limits, script_name, config.config)
 
+        database = collection.script.make_storage(
+            database, script_name, info, config.config)
+        database = collection.script.make_bulk_loader(
+            database, config.bulk_load, info)
+
         log_dir = os.path.join(
             collection.common.SLRG_DIR, 'codeforces', 'logs')
         log = collection.common.Log(log_dir, script_name)
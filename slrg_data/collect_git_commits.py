@@ -12,7 +12,7 @@ Run::
         [-i <input data file>] [-s <start index>]
         [-c <records to process>] [-u <database username>]
         [-p <database password>] [--git=<github username>]
-        [--gitpass=<github password>]
+        [--gitpass=<github password>] [--clone]
 
 Options
 ~~~~~~~
@@ -26,7 +26,9 @@ input values.
 **-l <programming language>**
     The programming language that source is being collected from.
     Determines the table to use and the file extensions. See config.py
-    for more info.
+    for more info. Several languages can be given separated by commas,
+    ie) 'c++,python,java'. Each project or commit is then processed once
+    and files are added to the table for their language.
     * Default is to ask for it.
 
 **-i <input data file>**
@@ -50,6 +52,11 @@ input values.
 
 **--gitpass=<github password>**
     The password for the github account.
+
+**--clone**
+    Clone each project once and read the files added by its commits
+    from the clone instead of requesting every commit from the GitHub
+    API. Records are processed grouped by project.
 """
 # Standard python modules
 import os
@@ -97,10 +104,12 @@ def _script(argv):
     db_passwd = None
     git_login = None
     git_passwd = None
+    clone = False
 
     # Parse command line arguments
     try:
-        opts, _ = getopt.getopt(argv, "l:i:s:c:u:p:h", ['git=', 'gitpass='])
+        opts, _ = getopt.getopt(argv, "l:i:s:c:u:p:h", ['git=', 'gitpass=',
+                                                          'clone'])
     except getopt.GetoptError:
         print(HELP_TEXT)
         sys.exit()
@@ -122,20 +131,24 @@ def _script(argv):
             git_login = arg
         elif opt == '--gitpass':
             git_passwd = arg
+        elif opt == '--clone':
+            clone = True
         elif opt == '-h':
             print(HELP_TEXT)
             return
 
     main(lang=lang, file=file, start=start, count=count, db_login=db_login,
-         db_passwd=db_passwd, git_login=git_login, git_passwd=git_passwd)
+         db_passwd=db_passwd, git_login=git_login, git_passwd=git_passwd,
+         clone=clone)
 
 
 def main(lang=None, file=None, start=None, count=None, db_login=None,
-         db_passwd=None, git_login=None, git_passwd=None):
+         db_passwd=None, git_login=None, git_passwd=None, clone=False):
     """Collects source code from GitHub commits.
 
     Args:
-        lang (str): The programming language to collect source code for.
+        lang (str): The programming language(s) to collect source code
+            for. Separate multiple languages with commas.
         file (str): The name of the file containing GitHub commit
             records obtained from Ghtorrent.
         start (int): The index of the first user record to process.
@@ -144,6 +157,8 @@ def main(lang=None, file=None, start=None, count=None, db_login=None,
         db_passwd (str): The password for the database.
         git_login (str): A GitHub username.
         git_passwd (str): The password for the GitHub username.
+        clone (bool): If True commits are read from local clones of
+            their projects instead of the GitHub API.
 
     Returns:
         int: The index of the next project to process from the file of
@@ -156,21 +171,34 @@ def main(lang=None, file=None, start=None, count=None, db_login=None,
         database = collection.script.make_database(config.database,
                                                    login=db_login,
                                                    passwd=db_passwd)
-        limits = collection.script.make_limits(
+        limits = collection.script.make_commits_limits(
             start, count, config.limits[script_name])
         git_data = collection.script.make_git_data(git_login, git_passwd,
                                                    config.git_acct)
         info = collection.script.make_git_info(lang, file, git_data, limits,
                                                script_name, config.config)
 
+        database = collection.script.make_storage(
+            database, script_name, info, config.config)
+        database = collection.script.make_bulk_loader(
+            database, config.bulk_load, info)
+
         log_dir = os.path.join(collection.common.SLRG_DIR,
                                'git', 'commits', 'logs')
         log = collection.common.Log(log_dir, script_name)
         collection.script.remove_old_logs(log_dir, config.max_logs_to_keep)
 
         # Create and run collector
-        collector = collection.github.CommitsCollector(
-            database, info, log)
+        if clone:
+            collector = collection.github.CloneCommitsCollector(
+                database, info, log,
+                repo_cache=collection.script.make_repo_cache(
+                    config.repo_cache),
+                temp_repos=collection.script.make_temp_repos(
+                    config.temp_repos, 'commits'))
+        else:
+            collector = collection.github.CommitsCollector(
+                database, info, log)
         collector.main()
 
     except collection.script.ScriptInputError as err:
@@ -26,7 +26,9 @@ input values.
 **-l <programming language>**
     The programming language that source is being collected from.
     Determines the table to use and the file extensions. See config.py
-    for more info.
+    for more info. Several languages can be given separated by commas,
+    ie) 'c++,python,java'. Each project or commit is then processed once
+    and files are added to the table for their language.
     * Default is to ask for it.
 
 **-i <input data file>**
@@ -135,7 +137,8 @@ def main(lang=None, file=None, start=None, count=None, db_login=None,
     """Collects source code from GitHub projects.
 
     Args:
-        lang (str): The programming language to collect source code for.
+        lang (str): The programming language(s) to collect source code
+            for. Separate multiple languages with commas.
         file (str): The name of the file containing GitHub project
             records obtained from Ghtorrent.
         start (int): The index of the first user record to process.
@@ -156,21 +159,30 @@ def main(lang=None, file=None, start=None, count=None, db_login=None,
         database = collection.script.make_database(config.database,
                                                    login=db_login,
                                                    passwd=db_passwd)
-        limits = collection.script.make_limits(
+        limits = collection.script.make_projects_limits(
             start, count, config.limits[script_name])
         git_data = collection.script.make_git_data(git_login, git_passwd,
                                                    config.git_acct)
         info = collection.script.make_git_info(lang, file, git_data, limits,
                                                script_name, config.config)
 
+        database = collection.script.make_storage(
+            database, script_name, info, config.config)
+        database = collection.script.make_bulk_loader(
+            database, config.bulk_load, info)
+
         log_dir = os.path.join(collection.common.SLRG_DIR,
                                'git', 'projects', 'logs')
         log = collection.common.Log(log_dir, script_name)
         collection.script.remove_old_logs(log_dir, config.max_logs_to_keep)
 
+        repo_cache = collection.script.make_repo_cache(config.repo_cache)
+        temp_repos = collection.script.make_temp_repos(config.temp_repos)
+
         # Create and run collector
         collector = collection.github.ProjectsCollector(
-            database, info, log)
+            database, info, log, repo_cache=repo_cache,
+            temp_repos=temp_repos, predicate_costs=config.predicate_costs)
         collector.main()
 
     except collection.script.ScriptInputError as err:
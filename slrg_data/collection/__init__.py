@@ -2,3 +2,7 @@ from . import script
 from . import common
 from . import codeforces
 from . import github
+from . import schema
+from . import neardup
+from . import features
+from . import columnar
@@ -31,6 +31,9 @@ class CfSubmissionsCollector(common.Collector):
     on the process.
     """
 
+    skip_columns = ['submission_id']
+    record_keys = ['handle', 'country']
+
     def __init__(self, database, collection_info, log):
         common.Collector.__init__(self, database, collection_info, log)
         self.totals.update({
@@ -118,6 +121,9 @@ class CfSubmissionsCollector(common.Collector):
                 break
 
             self.totals['subs'] += 1
+            if self.is_known(self.collection_info.table.name, sub_data['id']):
+                continue
+
             if self.is_valid(sub_data, problems):
                 print("Processing submission:",
                       sub_data['id'], sub_data['problem']['name'])
@@ -135,11 +141,12 @@ class CfSubmissionsCollector(common.Collector):
                 database for the Codeforces user.
         """
         columns = ['problem_name']
-        where = ['handle=' + "'" + entry['handle'] + "'"]
+        where = ['handle=' + self.database.PLACEHOLDER]
 
         try:
             results = self.database.select(
-                columns, self.collection_info.table.name, where)
+                columns, self.collection_info.table.name, where,
+                [entry['handle']])
             names = []
             for tup in results:
                 names.append(tup[0])
@@ -190,6 +197,7 @@ class CfSubmissionsCollector(common.Collector):
             return
 
         if self.add_sub_to_db(sub_data, source, entry):
+            self.add_known(self.collection_info.table.name, sub_data['id'])
             self.totals['added'] += 1
             self.totals['user_subs'] += 1
             print("--", self.totals['user_subs'], "-- Added:",
@@ -322,13 +330,17 @@ class CfSubmissionsCollector(common.Collector):
             bool: True if the information was successfully added to
                 the database, otherwise False.
         """
+        digest = self.check_content(source)
+        if digest is None:
+            return False
+
         values = self.get_sub_values(sub_data, source)
         values.extend(self.get_entry_values(entry))
+        if self.collection_info.content_hash:
+            values.append(digest)
 
-        if self.database.insert(self.collection_info.table.columns,
-                                self.collection_info.table.name, values):
-            return True
-        return False
+        return self.insert_sample(self.collection_info.table, values,
+                                  digest)
 
     def get_sub_values(self, sub_data, source):
         """Gets the submission values needed to add it to the database.
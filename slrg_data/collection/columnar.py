@@ -0,0 +1,521 @@
+"""A columnar format for exported samples that can be read without
+parsing or loading the whole export.
+
+A dataset is a directory. Each metadata column (ids, gender,
+probability, language, year, line counts ...) is a NumPy .npy file with
+one value per sample. Columns of strings hold numbers that index a list
+of their distinct values. The source code of every sample is appended to a
+single blob file per source column, with an offsets array giving where
+each sample starts and ends. Every file is opened with mmap, so opening
+a dataset reads almost nothing, filtering only reads the columns it
+uses and any sample's source can be read without reading the others.
+
+Layout::
+
+    <dataset>/meta.json              columns, their kinds and row count
+    <dataset>/<column>.npy           numeric values or category codes
+    <dataset>/<column>.nulls.npy     True where the value was NULL
+    <dataset>/<column>.categories.json   the values the codes index
+    <dataset>/<column>.blob          UTF-8 source of every sample
+    <dataset>/<column>.offsets.npy   start of each sample in the blob
+
+Example::
+
+    from slrg_data.collection.columnar import Dataset
+
+    with Dataset('export') as data:
+        recent = data.filter(gender='female', year=[2019, 2020])
+        for i in range(len(recent)):
+            code = recent.text('source_code', i)
+
+Requires NumPy. Install it with ``pip install slrg_data[columnar]``.
+"""
+from array import array
+import decimal
+import json
+import mmap
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Constants ############################################################
+
+# Version of the layout written to meta.json
+FORMAT_VERSION = 1
+
+# Columns written as source blobs by default
+TEXT_COLUMNS = ('file_contents', 'source_code')
+
+# Rows read at a time when iterating
+_ITER_ROWS = 1024
+
+
+# Classes ##############################################################
+
+class ColumnarWriter:
+    """Writes rows to a columnar dataset one at a time.
+
+    Source columns are written to their blob files as rows are added.
+    The other columns are kept in compact arrays and written when the
+    writer is closed, so memory use grows by a few bytes per value, not
+    with the size of the source.
+
+    A column's kind is chosen from its values: 'int', 'float' or
+    'category' for text. A column of ints that gets a float becomes
+    'float', and a numeric column that gets text becomes 'category'.
+
+    meta.json is written last, so a directory without it is not a
+    dataset. Used as a context manager, meta.json is not written if the
+    block raises.
+
+    Attributes:
+        path (str): The dataset directory.
+        text_columns (list): The columns written as source blobs.
+        rows (int): The number of rows added.
+
+    Raises:
+        FileExistsError: If the directory exists and is not empty.
+    """
+
+    def __init__(self, path, text_columns=TEXT_COLUMNS):
+        if np is None:
+            raise ImportError("Columnar export needs numpy. "
+                              "Install it with: pip install numpy")
+        if os.path.isdir(path) and os.listdir(path):
+            raise FileExistsError("Dataset directory is not empty: " + path)
+        self.path = path
+        self.text_columns = list(text_columns)
+        self.rows = 0
+        self._columns = None
+        os.makedirs(path, exist_ok=True)
+
+    def add(self, row):
+        """Adds a row.
+
+        Args:
+            row (dict): The row. The first row sets the columns. Columns
+                missing from later rows are NULL.
+        """
+        if self._columns is None:
+            self._columns = {}
+            for name in row:
+                if name in self.text_columns:
+                    self._columns[name] = _TextColumn(self.path, name)
+                else:
+                    self._columns[name] = _Column(name)
+
+        for name, column in self._columns.items():
+            column.add(row.get(name))
+        self.rows += 1
+
+    def close(self):
+        """Writes the metadata columns and meta.json and closes the
+        blob files."""
+        columns = {}
+        for name, column in (self._columns or {}).items():
+            columns[name] = column.finish(self.path, self.rows)
+
+        meta = {'version': FORMAT_VERSION, 'rows': self.rows,
+                'columns': columns, 'order': list(columns)}
+        temp = os.path.join(self.path, 'meta.json.tmp')
+        with open(temp, 'w') as file:
+            json.dump(meta, file, indent=2)
+        os.replace(temp, os.path.join(self.path, 'meta.json'))
+
+    def abort(self):
+        """Closes the blob files without writing meta.json, so the
+        partly written directory does not open as a dataset."""
+        for column in (self._columns or {}).values():
+            if isinstance(column, _TextColumn):
+                column.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class Dataset:
+    """Reads a columnar dataset with mmap.
+
+    A Dataset can be a view of some of the rows of another one, made by
+    slicing or filtering it. Views share the open files.
+
+    Attributes:
+        path (str): The dataset directory.
+        columns (list): The column names in export order.
+    """
+
+    def __init__(self, path, _files=None, _index=None):
+        if np is None:
+            raise ImportError("Columnar datasets need numpy. "
+                              "Install it with: pip install numpy")
+        self.path = path
+        if _files is None:
+            _files = _DatasetFiles(path)
+        self._files = _files
+        self._index = _index
+        self.columns = list(_files.meta['order'])
+
+    def __len__(self):
+        if self._index is None:
+            return self._files.meta['rows']
+        return len(self._index)
+
+    def kind(self, name):
+        """Returns the kind of a column: 'int', 'float', 'category',
+        'text' or 'null' if it only had NULLs."""
+        return self._files.info(name)['kind']
+
+    def values(self, name):
+        """Returns the values of a metadata column for the rows in the
+        view.
+
+        Args:
+            name (str): The column.
+
+        Returns:
+            numpy.ndarray: Numbers for numeric columns, read straight
+            from the file when the view is the whole dataset. Objects
+            for category columns. NULL numbers are 0, see
+            :meth:`nulls`.
+
+        Raises:
+            ValueError: If the column is a text column.
+        """
+        kind = self.kind(name)
+        if kind == 'text':
+            raise ValueError(name + " is a text column. Use text().")
+        if kind == 'null':
+            return np.full(len(self), None, dtype=object)
+
+        data = self._select(self._files.array(name))
+        if kind == 'category':
+            categories = np.array(self._files.categories(name) + [None],
+                                  dtype=object)
+            return categories[np.where(data < 0, len(categories) - 1, data)]
+        return data
+
+    def nulls(self, name):
+        """Returns a bool array that is True for the rows where a column
+        is NULL."""
+        if self.kind(name) == 'null':
+            return np.ones(len(self), dtype=bool)
+        mask = self._files.nulls(name)
+        if mask is None:
+            return np.zeros(len(self), dtype=bool)
+        return self._select(mask)
+
+    def text(self, name, i):
+        """Returns the source in a text column for a row of the view, or
+        None if it is NULL."""
+        data = self.text_bytes(name, i)
+        return None if data is None else str(data, 'utf-8')
+
+    def text_bytes(self, name, i):
+        """Returns a zero copy memoryview of the UTF-8 source in a text
+        column for a row of the view, or None if it is NULL. It must be
+        released before the dataset is closed."""
+        row = self._row(i)
+        mask = self._files.nulls(name)
+        if mask is not None and mask[row]:
+            return None
+        offsets = self._files.array(name + '.offsets')
+        blob = self._files.blob(name)
+        return memoryview(blob)[int(offsets[row]):int(offsets[row + 1])]
+
+    def where(self, mask):
+        """Returns a view of the rows where a bool array is True."""
+        positions = np.flatnonzero(np.asarray(mask, dtype=bool))
+        return self._view(positions)
+
+    def filter(self, **conditions):
+        """Returns a view of the rows that match every condition.
+
+        Args:
+            conditions: A column name and the value it must have, or a
+                list of values it can have. ie) gender='female' or
+                year=[2019, 2020]. None matches NULL.
+
+        Returns:
+            Dataset: A view of the matching rows.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for name, wanted in conditions.items():
+            if not isinstance(wanted, (list, tuple, set, frozenset)):
+                wanted = [wanted]
+            wanted = list(wanted)
+
+            if self.kind(name) == 'category':
+                lookup = {value: code for code, value
+                          in enumerate(self._files.categories(name))}
+                codes = [lookup[v] for v in wanted if v in lookup]
+                if None in wanted:
+                    codes.append(-1)
+                match = np.isin(self._select(self._files.array(name)), codes)
+            elif self.kind(name) == 'null':
+                match = np.full(len(self), None in wanted)
+            else:
+                values = [v for v in wanted if v is not None]
+                nulls = self.nulls(name)
+                match = np.isin(self.values(name), values) & ~nulls
+                if None in wanted:
+                    match |= nulls
+            mask &= match
+        return self.where(mask)
+
+    def row(self, i):
+        """Returns a row of the view as a dict."""
+        return next(self._rows(i, i + 1))
+
+    def close(self):
+        """Closes the files of the dataset and all of its views."""
+        self._files.close()
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.values(key)
+        if isinstance(key, (int, np.integer)):
+            return self.row(key)
+        if isinstance(key, slice):
+            return self._view(np.arange(len(self))[key])
+        key = np.asarray(key)
+        if key.dtype == bool:
+            return self.where(key)
+        return self._view(key)
+
+    def __iter__(self):
+        for start in range(0, len(self), _ITER_ROWS):
+            yield from self._rows(start, min(start + _ITER_ROWS, len(self)))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _rows(self, start, end):
+        """Yields the rows from start to end of the view as dicts."""
+        if start < 0:
+            start += len(self)
+            end += len(self)
+        if not 0 <= start < end <= len(self):
+            raise IndexError("row out of range")
+
+        part = self._view(np.arange(start, end))
+        columns = {}
+        for name in self.columns:
+            if self.kind(name) == 'text':
+                continue
+            values = part.values(name).tolist()
+            for i in np.flatnonzero(part.nulls(name)):
+                values[i] = None
+            columns[name] = values
+
+        for i in range(end - start):
+            yield {name: (part.text(name, i) if name not in columns
+                          else columns[name][i])
+                   for name in self.columns}
+
+    def _row(self, i):
+        """Returns the row in the files for a row of the view."""
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("row out of range")
+        return i if self._index is None else int(self._index[i])
+
+    def _select(self, data):
+        """Returns the rows of a whole column array that are in the
+        view."""
+        return data if self._index is None else data[self._index]
+
+    def _view(self, positions):
+        """Makes a view of some rows of this view."""
+        if self._index is not None:
+            positions = self._index[positions]
+        return Dataset(self.path, self._files, np.asarray(positions,
+                                                         dtype=np.int64))
+
+
+class _DatasetFiles:
+    """The open files of a dataset, shared by its views."""
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, 'meta.json')) as file:
+            self.meta = json.load(file)
+        if self.meta.get('version') != FORMAT_VERSION:
+            raise ValueError("Not a supported columnar dataset: " + path)
+        self._arrays = {}
+        self._categories = {}
+        self._blobs = {}
+
+    def info(self, name):
+        try:
+            return self.meta['columns'][name]
+        except KeyError:
+            raise KeyError("No column: " + name) from None
+
+    def array(self, name):
+        if name not in self._arrays:
+            self._arrays[name] = np.load(
+                os.path.join(self.path, name + '.npy'), mmap_mode='r')
+        return self._arrays[name]
+
+    def nulls(self, name):
+        if not self.info(name).get('nulls'):
+            return None
+        return self.array(name + '.nulls')
+
+    def categories(self, name):
+        if name not in self._categories:
+            with open(os.path.join(self.path,
+                                   name + '.categories.json')) as file:
+                self._categories[name] = json.load(file)
+        return self._categories[name]
+
+    def blob(self, name):
+        if name not in self._blobs:
+            path = os.path.join(self.path, name + '.blob')
+            with open(path, 'rb') as file:
+                if os.path.getsize(path) == 0:
+                    self._blobs[name] = b''
+                else:
+                    self._blobs[name] = mmap.mmap(file.fileno(), 0,
+                                                  access=mmap.ACCESS_READ)
+        return self._blobs[name]
+
+    def close(self):
+        for blob in self._blobs.values():
+            if isinstance(blob, mmap.mmap):
+                blob.close()
+        self._blobs = {}
+        self._arrays = {}
+
+
+class _Column:
+    """The values of a metadata column while it is being written."""
+
+    def __init__(self, name):
+        self.name = name
+        self.kind = 'null'
+        self.values = None
+        self.nulls = bytearray()
+        self.codes = None
+
+    def add(self, value):
+        if isinstance(value, decimal.Decimal):
+            value = float(value)
+        if value is None:
+            self.nulls.append(1)
+            self._append_null()
+            return
+        self.nulls.append(0)
+
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, int):
+            kind = 'int'
+        elif isinstance(value, float):
+            kind = 'float'
+        else:
+            kind = 'category'
+            value = str(value)
+
+        if kind != self.kind:
+            self._change_kind(kind)
+        if self.kind == 'category':
+            self.values.append(self.codes.setdefault(str(value),
+                                                     len(self.codes)))
+        else:
+            self.values.append(value)
+
+    def finish(self, path, rows):
+        info = {'kind': self.kind, 'nulls': any(self.nulls)}
+        if self.kind == 'null':
+            return info
+
+        dtype = {'int': np.int64, 'float': np.float64,
+                 'category': np.int32}[self.kind]
+        np.save(os.path.join(path, self.name + '.npy'),
+                np.frombuffer(self.values, dtype=dtype))
+        if info['nulls']:
+            np.save(os.path.join(path, self.name + '.nulls.npy'),
+                    np.frombuffer(self.nulls, dtype=np.uint8).astype(bool))
+        if self.kind == 'category':
+            with open(os.path.join(path, self.name + '.categories.json'),
+                      'w') as file:
+                json.dump(list(self.codes), file)
+        return info
+
+    def _append_null(self):
+        if self.kind == 'category':
+            self.values.append(-1)
+        elif self.kind != 'null':
+            self.values.append(0)
+
+    def _change_kind(self, kind):
+        """Converts the values so far to a new kind. Only widens: null
+        to anything, int to float and numbers to category."""
+        old = self.kind
+        if old == 'null':
+            typecode = {'int': 'q', 'float': 'd', 'category': 'i'}[kind]
+            fill = -1 if kind == 'category' else 0
+            self.values = array(typecode, [fill]) * (len(self.nulls) - 1)
+        elif old == 'int' and kind == 'float':
+            self.values = array('d', self.values)
+        elif old == 'float' and kind == 'int':
+            return
+        elif old == 'category':
+            return
+        else:
+            # Numbers become the text of the numbers
+            self.codes = {}
+            codes = array('i')
+            for value, null in zip(self.values, self.nulls):
+                if null:
+                    codes.append(-1)
+                else:
+                    codes.append(self.codes.setdefault(str(value),
+                                                       len(self.codes)))
+            self.values = codes
+        self.kind = kind
+        if kind == 'category' and self.codes is None:
+            self.codes = {}
+
+
+class _TextColumn:
+    """A source column while it is being written to its blob file."""
+
+    def __init__(self, path, name):
+        self.name = name
+        self.file = open(os.path.join(path, name + '.blob'), 'wb')
+        self.offsets = array('Q', [0])
+        self.nulls = bytearray()
+
+    def add(self, value):
+        self.nulls.append(value is None)
+        if value is not None:
+            if isinstance(value, str):
+                value = value.encode('utf-8')
+            self.file.write(value)
+        self.offsets.append(self.file.tell())
+
+    def finish(self, path, rows):
+        self.file.close()
+        np.save(os.path.join(path, self.name + '.offsets.npy'),
+                np.frombuffer(self.offsets, dtype=np.uint64))
+        info = {'kind': 'text', 'nulls': any(self.nulls)}
+        if info['nulls']:
+            np.save(os.path.join(path, self.name + '.nulls.npy'),
+                    np.frombuffer(self.nulls, dtype=np.uint8).astype(bool))
+        return info
@@ -4,18 +4,40 @@ the internet.
 from datetime import datetime
 import time
 import sys
+import bz2
+import collections
 import getpass
+import gzip
+import hashlib
+import io
+import itertools
 import json
 import logging
+import lzma
+import math
 import os
+import queue
+import random
 import site
+import sqlite3
+import threading
+import zlib
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
 
 # 3rd party libraries
 import requests
 import pymysql
 
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
 # My modules
 from . import script
+from . import neardup
+from . import features
 
 
 # Constants ############################################################
@@ -24,6 +46,36 @@ from . import script
 site.getuserbase()
 SLRG_DIR = os.path.join(site.USER_BASE, 'slrg')
 
+# Placeholder for fields that are not in a Record
+_MISSING = object()
+
+# Characters that must be escaped in files for LOAD DATA
+_TSV_ESCAPES = str.maketrans({'\\': '\\\\', '\t': '\\t', '\n': '\\n',
+                              '\r': '\\r', '\0': '\\0'})
+_TSV_BYTE_ESCAPES = [(b'\\', b'\\\\'), (b'\t', b'\\t'), (b'\n', b'\\n'),
+                     (b'\r', b'\\r'), (b'\0', b'\\0')]
+
+# Key for content hashes. Changing it changes every hash.
+CONTENT_HASH_KEY = b'slrg_data'
+
+# First byte of a compressed value. It never starts valid UTF-8, so
+# values without it are plain text.
+COMPRESSED_MARKER = b'\xff'
+
+# The byte after the marker that names the codec of a compressed value
+CODECS = {'zlib': b'z', 'bz2': b'b', 'lzma': b'x', 'zstd': b's'}
+
+# Extensions of compressed files that are read and written transparently
+COMPRESSED_EXTENSIONS = ('.gz', '.bz2', '.xz', '.zst')
+
+# Size of the blocks compressed by each thread when writing compressed
+# files with more than one thread
+COMPRESS_BLOCK_SIZE = 2**20
+
+# MySQL error codes for lost or refused connections that are retried
+# with a new connection
+RECONNECT_CODES = (2003, 2006, 2013)
+
 
 # Classes ##############################################################
 
@@ -42,17 +94,56 @@ class Collector:
             'start' is the time the script was started.
         totals (dict): Totals for processed data. 'entry' is the total
             number of records processed during the running of
-            the script.
+            the script. 'skipped' is the number of records or samples
+            skipped because they were already in the database.
+            'samples' is the number of samples checked for duplicate
+            content, 'duplicates' the number with content already seen
+            this run, 'near_duplicates' the number found by the near
+            duplicate index and 'db_duplicates' the number rejected by
+            the database as duplicates.
         idx (int): The current index in the list of records.
+        skip_columns (list): The columns of the table that identify
+            work that has already been done. Used to build the skip
+            index. None if the collector does not use one.
+        skip_index (BloomFilter): Keys already in the table. None if
+            not loaded.
+        record_keys (list): Keys of the input records used by the
+            collector that are not in collection_info.records.fields.
+            Only these and the fields are kept when records are loaded.
+        seen_content (set): The content hashes of the samples seen
+            this run.
+        near_dup (NearDupIndex): The near duplicate index. None if it
+            is not used.
+        signatures (dict): The near duplicate signatures of checked
+            samples by content hash. A sample is only added to the index
+            once the database has stored it.
+        near_matches (dict): The (key, similarity) of the best match of
+            checked samples that are near duplicates, by content hash.
+            Only used when near duplicates are flagged. They are logged
+            once the sample is stored.
+        pending (list): Samples waiting for their features to be
+            computed and to be inserted. Only used if features are set
+            in collection_info.
     """
 
+    skip_columns = None
+    record_keys = []
+
     def __init__(self, database, collection_info, log):
         self.database = database
         self.collection_info = collection_info
         self.log = log
         self.times = {'start': time.time()}
-        self.totals = {'entry': 0}
+        self.totals = {'entry': 0, 'skipped': 0, 'samples': 0,
+                       'duplicates': 0, 'near_duplicates': 0,
+                       'db_duplicates': 0}
         self.idx = self.collection_info.limits.start
+        self.skip_index = None
+        self.seen_content = set()
+        self.near_dup = None
+        self.signatures = {}
+        self.near_matches = {}
+        self.pending = []
 
     def main(self):
         """Starts and runs the source collection.
@@ -66,7 +157,8 @@ class Collector:
         """
         try:
             self.set_up()
-            data = get_json_data(self.collection_info.records.filename)
+            data = get_json_data(self.collection_info.records.filename,
+                                 fields=self.get_record_fields())
             self.process_data(data)
 
         except DatabaseError as error:
@@ -76,12 +168,205 @@ class Collector:
         finally:
             self.clean_up()
 
+    def get_record_fields(self):
+        """Returns the list of record keys to keep when loading the
+        input records."""
+        fields = list(self.collection_info.records.fields)
+        for key in self.record_keys:
+            if key not in fields:
+                fields.append(key)
+        return fields
+
     def set_up(self):
         """Does any setup that must happen before the data collection
         starts."""
         self.log.info("File: " + self.collection_info.records.filename)
         self.database.connect()
 
+        skip = self.collection_info.skip
+        if skip is not None and self.skip_columns is not None:
+            self.load_skip_index(skip)
+
+        if self.collection_info.near_dup is not None:
+            self.near_dup = self.collection_info.near_dup.make_index()
+
+    def load_skip_index(self, skip):
+        """Builds the skip index from the keys already in the tables
+        being collected into.
+
+        Each key starts with the name of its table, so a sample is only
+        known for the table it was stored in.
+
+        Args:
+            skip (SkipData): The size and error rate of the index.
+        """
+        start = time.time()
+        tables = [table.name for table in self.collection_info.get_tables()]
+        count = sum(self.database.count(table) for table in tables)
+
+        self.skip_index = BloomFilter(count + skip.extra, skip.error_rate,
+                                      skip.max_bytes)
+        for table in tables:
+            for row in self.database.stream(self.skip_columns, table):
+                self.skip_index.add(make_key(table, *row))
+
+        self.log.info("Skip index: {} keys, {:.1f}MB, {:.4f}% false "
+                      "positives, {}".format(
+                          count, self.skip_index.size_bytes() / 2**20,
+                          self.skip_index.error_rate(count) * 100,
+                          find_time(time.time() - start)))
+
+    def is_known(self, *values):
+        """Checks the skip index for a key.
+
+        False positives are possible at the index's error rate, so a
+        small number of new keys will be reported as known.
+
+        Args:
+            values: The table name followed by the values of the
+                skip_columns for the key.
+
+        Returns:
+            bool: True if the key is probably already in the database.
+        """
+        if self.skip_index is not None and make_key(*values) in self.skip_index:
+            self.totals['skipped'] += 1
+            return True
+        return False
+
+    def add_known(self, *values):
+        """Adds a key to the skip index if there is one.
+
+        Args:
+            values: The table name followed by the values of the
+                skip_columns for the key.
+        """
+        if self.skip_index is not None:
+            self.skip_index.add(make_key(*values))
+
+    def check_content(self, source):
+        """Hashes a sample's source and checks if the same content has
+        already been seen this run.
+
+        Args:
+            source (str): The source code of the sample.
+
+        Returns:
+            str: The content hash of the source, or None if it is a
+            duplicate and should be skipped.
+        """
+        digest = content_hash(source)
+        self.totals['samples'] += 1
+        if digest in self.seen_content:
+            self.totals['duplicates'] += 1
+            print("-- Duplicate content")
+            return None
+        self.seen_content.add(digest)
+
+        if self.near_dup is not None:
+            matches, signature = self.near_dup.find(source)
+            if not matches:
+                self.signatures[digest] = signature
+            else:
+                self.totals['near_duplicates'] += 1
+                key, similarity = matches[0]
+                print("-- Near duplicate of {} ({:.2f})".format(key,
+                                                               similarity))
+                if self.collection_info.near_dup.action == 'skip':
+                    return None
+                self.near_matches[digest] = matches[0]
+        return digest
+
+    def insert_sample(self, table, values, digest=None):
+        """Inserts a sample into a table and counts it if the database
+        rejects it as a duplicate.
+
+        Once the sample is stored it is added to the near duplicate
+        index under its :meth:`sample_key`, if it was checked with
+        :meth:`check_content` and is not a near duplicate.
+
+        If features are set in collection_info the sample is held until
+        there is a batch of them, then the batch's features are
+        computed and the samples inserted. See :meth:`flush_samples`.
+        The source columns are compressed last if compression is set.
+
+        Args:
+            table (TableData): The table to insert into.
+            values (list): The values for each of the table's columns.
+            digest (str): The content hash from :meth:`check_content`.
+
+        Returns:
+            bool: True if the sample was added. Held samples always
+            return True and duplicates are only counted when they are
+            inserted.
+        """
+        feature_data = self.collection_info.features
+        if feature_data is None:
+            return self._insert_values(table, table.columns, values, digest)
+
+        self.pending.append((table, values, digest))
+        if len(self.pending) >= feature_data.batch_size:
+            self.flush_samples()
+        return True
+
+    def flush_samples(self):
+        """Computes the features of the held samples and inserts them."""
+        if not self.pending:
+            return
+        pending = self.pending
+        self.pending = []
+
+        feature_data = self.collection_info.features
+        sources = [feature_data.get_source(table.columns, values)
+                   for table, values, _ in pending]
+        languages = [feature_data.get_language(table, values)
+                     for table, values, _ in pending]
+        found = features.extract(sources, feature_data.names, languages)
+        for (table, values, digest), feature_values in zip(pending, found):
+            self._insert_values(table,
+                                self.collection_info.sample_columns(table),
+                                list(values) + feature_values, digest)
+
+    def sample_key(self, table, columns, values):
+        """Returns the key that identifies a stored sample in the near
+        duplicate index.
+
+        Args:
+            table (TableData): The table the sample is stored in.
+            columns (list): The names of the sample's columns.
+            values (list): The values for each of the columns.
+
+        Returns:
+            str: The table name and the values of the skip_columns, ie)
+            'c_projects:123/ab12'. Just the table name if the collector
+            has no skip_columns.
+        """
+        if self.skip_columns is None:
+            return table.name
+        return "{}:{}".format(table.name, "/".join(
+            str(values[columns.index(column)])
+            for column in self.skip_columns))
+
+    def _insert_values(self, table, columns, values, digest=None):
+        """Compresses and inserts the values of one sample, then adds it
+        to the near duplicate index if it was stored."""
+        signature = self.signatures.pop(digest, None)
+        match = self.near_matches.pop(digest, None)
+        key = self.sample_key(table, columns, values)
+        compression = self.collection_info.compression
+        if compression is not None:
+            values = compression.compress_values(columns, values)
+
+        if self.database.insert(columns, table.name, values):
+            if signature is not None:
+                self.near_dup.add(key, signature)
+            if match is not None:
+                self.log.info("Near duplicate: {} of {} ({:.2f})".format(
+                    key, *match))
+            return True
+        self.totals['db_duplicates'] += 1
+        return False
+
     def process_data(self, data):
         """Processes each record in the given list of records within the
         limits in the collection_info attribute.
@@ -97,10 +382,10 @@ class Collector:
                 break
 
             # Process the entry as a derived class needs
+            self.idx = idx
             self.process(entry)
 
             self.totals['entry'] += 1
-            self.idx = idx
 
     # Override
     def process(self, entry):
@@ -147,7 +432,12 @@ class Collector:
 
         Will be called even if the script exits due to an error.
         """
-        self.database.close()
+        try:
+            self.flush_samples()
+        finally:
+            self.database.close()
+        if self.near_dup is not None:
+            self.near_dup.close()
 
         self.log.info('------------------------------------------------------')
         self.log.info("File: " + self.collection_info.records.filename)
@@ -157,31 +447,77 @@ class Collector:
             self.collection_info.limits.start, self.collection_info.limits.count))
         self.log.info('Total Entries Processed: {}'.format(
             self.totals['entry']))
+        if self.skip_index is not None:
+            self.log.info('Skipped as already collected: {}'.format(
+                self.totals['skipped']))
+
+        samples = self.totals['samples']
+        duplicates = self.totals['duplicates'] + self.totals['db_duplicates']
+        if samples:
+            self.log.info(
+                'Duplicate content: {} of {} samples ({:.1f}%), {} seen '
+                'this run, {} already in the database'.format(
+                    duplicates, samples, 100 * duplicates / samples,
+                    self.totals['duplicates'], self.totals['db_duplicates']))
+        if self.near_dup is not None:
+            self.log.info('Near duplicates: {} ({})'.format(
+                self.totals['near_duplicates'],
+                self.collection_info.near_dup.action))
 
 
 class Database:
     """Wrapper for a database.
 
+    Keeps a thread-safe pool of connections. Each query checks a
+    connection out of the pool, pings it and returns it when done, so
+    the same Database can be shared by several threads. Lost
+    connections are replaced and the query retried with exponential
+    backoff.
+
     Attributes:
         host (str): The database host.
         user (str): The database username.
         name (str): The name of the database.
         passwd (str): The password of the database user. Default is
             None. If None the user will be asked to input it when
-            connecting to the datbase and will not be saved by the
-            Database class.
+            connecting to the datbase. It is then only kept in memory
+            to reconnect.
+        pool_size (int): The max number of open connections.
+        retries (int): The number of times to try a query when the
+            connection is lost.
+        backoff (float): Seconds to wait before the first retry. Each
+            retry waits twice as long as the last, plus some random
+            jitter.
+        max_backoff (float): The max seconds to wait between retries.
+        local_infile (bool): Wether to allow LOAD DATA LOCAL INFILE on
+            new connections. Needed for :meth:`load_file`.
     """
 
-    def __init__(self, host, user, name, passwd=None):
+    # The placeholder for values passed as args
+    PLACEHOLDER = '%s'
+
+    def __init__(self, host, user, name, passwd=None, pool_size=1,
+                 retries=10, backoff=1, max_backoff=60, local_infile=False):
         self.host = host
         self.user = user
         self.name = name
         self.passwd = passwd
-        self.database = None
+        self.pool_size = pool_size
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.local_infile = local_infile
+        self._format = None
+        self._passwd = passwd
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(pool_size)
 
     def connect(self, _format=None):
         """Connect to the database.
 
+        Asks for any missing credentials and opens the first connection
+        of the pool. Other connections are opened as they are needed.
+
         Args:
             format (str): The format of the records to be returned.
                 'j' for dict results, otherwise tuples will be used.
@@ -194,18 +530,11 @@ class Database:
         self._format = _format
         if self.user is None:
             self.user = input("Database username: ")
-        if self.passwd is None:
-            passwd = getpass.getpass(prompt="Database Password: ")
-        else:
-            passwd = self.passwd
-
-        cursor = pymysql.cursors.Cursor
-        if _format == 'j':
-            cursor = pymysql.cursors.DictCursor
+        if self._passwd is None:
+            self._passwd = getpass.getpass(prompt="Database Password: ")
 
         try:
-            self.database = pymysql.connect(
-                self.host, self.user, passwd, self.name, cursorclass=cursor)
+            self._idle.put(self._open())
 
         except pymysql.err.OperationalError as err:
             code, _ = err.args
@@ -239,35 +568,34 @@ class Database:
             values (list): A list of values to insert into the table.
                 Should be in the same order as the columns list.
 
+        Returns:
+            bool: False if the values were a duplicate entry, otherwise
+            True.
+
         Raises:
             DatabaseError: If there is a problem with the INSERT that cannot be handled.
         """
         sql = "INSERT INTO {} ({}) VALUES({});".format(
             table, ", ".join(columns), self._vals(len(columns)))
-        for i in range(10):
+
+        def work(conn):
             try:
-                with self.database.cursor() as cursor:
+                with conn.cursor() as cursor:
                     cursor.execute(sql, values)
-                self.database.commit()
+                conn.commit()
                 return True
 
             except pymysql.err.MySQLError as error:
-                if self.database.open:
-                    self.database.rollback()
-                code, _ = error.args
-                if code == 2013:
-                    print(
-                        "*** Database Connection Error: Retrying (" + str(i+1) + ")", str(error))
-                    time.sleep(30)
-                    self.close()
-                    self.connect(self._format)
-                elif code == 1062:
+                if conn.open:
+                    conn.rollback()
+                if error.args[0] == 1062:
                     print("*** Tried to add duplicate entry ***")
                     return False
-                else:
-                    raise DatabaseError(str(error))
+                raise
+
+        return self._run(work)
 
-    def select(self, columns, table, where):
+    def select(self, columns, table, where, args=None):
         """Selects values from the given columns from the given table.
 
         This is a helper for basic SQL SELECT queries. The values of
@@ -279,6 +607,9 @@ class Database:
             table (str): The table to select from.
             where (list): A list of WHERE clauses. Ie) handle='steve'
                 or gender is not null
+            args (list): Values for PLACEHOLDER marks in the where
+                clauses. Ie) handle=%s with ['steve']. Use these for
+                values that come from users.
 
         Returns:
             list: A list of results in a dict or tuple depending on the
@@ -287,26 +618,9 @@ class Database:
         Raises:
             DatabaseError: If there is a problem with the SELECT.
         """
-        sep = ", "
-        sql = "SELECT {} FROM {} WHERE {};".format(sep.join(columns),
-                                                   table, sep.join(where))
-        for i in range(10):
-            try:
-                with self.database.cursor() as cursor:
-                    cursor.execute(sql)
-                    results = cursor.fetchall()
-                return results
-
-            except pymysql.err.MySQLError as error:
-                code, _ = error.args
-                if code == 2013:
-                    print(
-                        "*** Database Connection Error: Retrying (" + str(i+1) + ")", str(error))
-                    time.sleep(30)
-                    self.close()
-                    self.connect(self._format)
-                else:
-                    raise DatabaseError(str(error))
+        sql = "SELECT {} FROM {} WHERE {};".format(
+            ", ".join(columns), table, " AND ".join(where))
+        return self._run(lambda conn: self._fetch_all(conn, sql, args))
 
     def query(self, sql):
         """Run an SQL query on the database and return the results.
@@ -323,6 +637,279 @@ class Database:
             DatabaseError: If there is a problem with the query or if
                 certain statements other than select are used.
         """
+        self._check_select(sql)
+        return self._run(lambda conn: self._fetch_all(conn, sql))
+
+    def count(self, table):
+        """Returns the number of rows in a table.
+
+        Raises:
+            DatabaseError: If there is a problem with the query.
+        """
+        sql = "SELECT COUNT(*) FROM {};".format(table)
+
+        def work(conn):
+            with conn.cursor(pymysql.cursors.Cursor) as cursor:
+                cursor.execute(sql)
+                return cursor.fetchone()[0]
+
+        return self._run(work)
+
+    def stream(self, columns, table, size=10000):
+        """Selects the given columns from every row in a table without
+        holding all of the results in memory.
+
+        See :meth:`stream_query`.
+
+        Args:
+            columns (list): The column names to select.
+            table (str): The table to select from.
+            size (int): The number of rows to fetch at a time.
+
+        Yields:
+            tuple: The values of the columns for each row.
+
+        Raises:
+            DatabaseError: If there is a problem with the SELECT.
+        """
+        sql = "SELECT {} FROM {};".format(", ".join(columns), table)
+        yield from self.stream_query(sql, size, pymysql.cursors.SSCursor)
+
+    def stream_query(self, sql, size=10000, cursor_class=None, args=None):
+        """Run an SQL SELECT query and yield the results one at a time
+        without holding all of them in memory.
+
+        Uses an unbuffered server side cursor on a connection from the
+        pool. The connection is not returned to the pool until the
+        results are used up.
+
+        Args:
+            sql (str): A full SQL query for SELECT.
+            size (int): The number of rows to fetch at a time.
+            cursor_class (type): The pymysql cursor to use. Must be
+                unbuffered. Default is SSDictCursor if the format
+                passed to Database.connect was 'j', otherwise SSCursor.
+            args (list): Values for %s placeholders in the sql. Any
+                literal % in the sql must then be written as %%.
+
+        Yields:
+            The results as dicts or tuples.
+
+        Raises:
+            DatabaseError: If there is a problem with the query or if
+                certain statements other than select are used.
+        """
+        self._check_select(sql)
+        if cursor_class is None:
+            cursor_class = pymysql.cursors.SSCursor
+            if self._format == 'j':
+                cursor_class = pymysql.cursors.SSDictCursor
+
+        conn = None
+        try:
+            conn = self._checkout()
+            with conn.cursor(cursor_class) as cursor:
+                cursor.execute(sql, args)
+                while True:
+                    rows = cursor.fetchmany(size)
+                    if not rows:
+                        break
+                    yield from rows
+
+        except pymysql.err.MySQLError as error:
+            if conn is not None:
+                self._discard(conn)
+                conn = None
+            raise DatabaseError(str(error))
+
+        finally:
+            if conn is not None:
+                self._checkin(conn)
+
+    def execute(self, sql, args=None):
+        """Runs any SQL statement and commits it.
+
+        Unlike :meth:`query` any statement can be run, so it is only
+        used for managing tables. See slrg-init-db.
+
+        Args:
+            sql (str): A full SQL statement.
+            args (list): Values for %s placeholders in the sql.
+
+        Returns:
+            list: The results of the statement as tuples, if it has any.
+
+        Raises:
+            DatabaseError: If there is a problem with the statement.
+        """
+        def work(conn):
+            with conn.cursor(pymysql.cursors.Cursor) as cursor:
+                cursor.execute(sql, args)
+                results = cursor.fetchall()
+            conn.commit()
+            return list(results)
+
+        return self._run(work)
+
+    def load_file(self, path, table, columns, duplicates='ignore'):
+        """Loads a TSV file into a table with LOAD DATA LOCAL INFILE.
+
+        The file must use MySQL's default escaping. See
+        :func:`tsv_line`. local_infile must be True.
+
+        Args:
+            path (str): The path of the TSV file.
+            table (str): The table to load into.
+            columns (list): The column names of the fields in the file.
+            duplicates (str): 'ignore' to skip rows with duplicate keys
+                or 'replace' to replace the old rows.
+
+        Returns:
+            int: The number of rows affected. A replaced row counts as
+            2.
+
+        Raises:
+            DatabaseError: If there is a problem with the LOAD DATA.
+        """
+        if duplicates not in ('ignore', 'replace'):
+            raise DatabaseError(
+                "Database Error: Not a duplicate mode: " + duplicates)
+
+        sql = ("LOAD DATA LOCAL INFILE %s {} INTO TABLE {} "
+               "CHARACTER SET binary "
+               "FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' "
+               "LINES TERMINATED BY '\\n' ({});").format(
+                   duplicates.upper(), table, ", ".join(columns))
+
+        def work(conn):
+            try:
+                with conn.cursor(pymysql.cursors.Cursor) as cursor:
+                    affected = cursor.execute(sql, [path])
+                conn.commit()
+                return affected
+
+            except pymysql.err.MySQLError:
+                if conn.open:
+                    conn.rollback()
+                raise
+
+        return self._run(work)
+
+    def close(self):
+        """Closes all of the idle connections in the pool."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._close_quietly(conn)
+
+    def _run(self, work):
+        """Runs work(conn) with a connection from the pool.
+
+        If the connection is lost or cannot be made it is thrown away
+        and the work is retried with a new connection after a backoff.
+
+        Args:
+            work (callable): Takes a pymysql connection and returns the
+                result.
+
+        Returns:
+            The result of work.
+
+        Raises:
+            DatabaseError: If the work fails for a reason other than
+                the connection or there are no retries left.
+        """
+        error = None
+        for i in range(self.retries):
+            conn = None
+            try:
+                conn = self._checkout()
+                result = work(conn)
+
+            except pymysql.err.MySQLError as err:
+                code = err.args[0] if err.args else None
+                if code not in RECONNECT_CODES:
+                    if conn is not None:
+                        self._checkin(conn)
+                    raise DatabaseError(str(err))
+
+                if conn is not None:
+                    self._discard(conn)
+                error = err
+                delay = self._backoff_time(i)
+                print("*** Database Connection Error: Retrying ("
+                      + str(i+1) + ") in {:.1f}s".format(delay), str(err))
+                time.sleep(delay)
+                continue
+
+            self._checkin(conn)
+            return result
+
+        raise DatabaseError(
+            "Database Error: Gave up after {} retries: {}".format(
+                self.retries, error))
+
+    def _backoff_time(self, attempt):
+        """Returns the seconds to wait before a retry. Half of the
+        exponential delay is random so threads do not retry together."""
+        delay = min(self.max_backoff, self.backoff * 2**attempt)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    def _open(self):
+        """Opens a new connection with the cached credentials."""
+        cursor = pymysql.cursors.Cursor
+        if self._format == 'j':
+            cursor = pymysql.cursors.DictCursor
+
+        return pymysql.connect(host=self.host, user=self.user,
+                               password=self._passwd, database=self.name,
+                               cursorclass=cursor,
+                               local_infile=self.local_infile)
+
+    def _checkout(self):
+        """Takes a live connection from the pool, opening a new one if
+        none are idle. Blocks while pool_size connections are in use."""
+        self._slots.acquire()
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                return self._open()
+
+            try:
+                conn.ping(reconnect=True)
+            except pymysql.err.MySQLError:
+                self._close_quietly(conn)
+                return self._open()
+            return conn
+
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _checkin(self, conn):
+        """Returns a connection to the pool."""
+        self._idle.put(conn)
+        self._slots.release()
+
+    def _discard(self, conn):
+        """Closes a broken connection instead of returning it."""
+        self._close_quietly(conn)
+        self._slots.release()
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except pymysql.err.MySQLError:
+            pass
+
+    # Helper for query and stream_query that stops statements other than
+    # select from being run.
+    @staticmethod
+    def _check_select(sql):
         not_allowed = ['drop', 'alter', 'update', 'delete', 'insert']
         for stmt in not_allowed:
             if sql.lower().find(stmt) > -1:
@@ -330,28 +917,12 @@ class Database:
                     "Database Error: Cannot use "
                     + stmt.upper() + " Database.query")
 
-        for i in range(10):
-            try:
-                with self.database.cursor() as cursor:
-                    cursor.execute(sql)
-                    results = cursor.fetchall()
-                return results
-
-            except pymysql.err.MySQLError as error:
-                code, _ = error.args
-                if code == 2013:
-                    print(
-                        "*** Database Connection Error: Retrying (" + str(i+1) + ")", str(error))
-                    time.sleep(30)
-                    self.close()
-                    self.connect(self._format)
-                else:
-                    raise DatabaseError(str(error))
-
-    def close(self):
-        """Closes the database connection."""
-        if self.database is not None:
-            self.database.close()
+    # Helper for select and query that runs sql and fetches all results
+    @staticmethod
+    def _fetch_all(conn, sql, args=None):
+        with conn.cursor() as cursor:
+            cursor.execute(sql, args)
+            return cursor.fetchall()
 
     # Helper for insert that creates a string of the right number of %s
     # to be used in the format string passed to cursor.execute.
@@ -360,6 +931,333 @@ class Database:
         return ", ".join(v)
 
 
+class BulkLoader:
+    """Stages inserts in TSV files and loads them in large chunks with
+    LOAD DATA LOCAL INFILE instead of one INSERT per row.
+
+    Can be used in place of a :class:`Database`. Inserts into the
+    staged tables are written to a spool file under stage_dir and
+    return True right away. Every chunk_rows rows, and on close, the
+    file is loaded and the rows that were new or duplicates are
+    counted. Inserts into other tables and all other methods go
+    straight to the database.
+
+    A chunk that fails to load is left in stage_dir so it can be loaded
+    again with :meth:`Database.load_file`.
+
+    Attributes:
+        database (Database): The database to load into.
+        stage_dir (str): The directory to spool files in.
+        tables (list of str): The tables to stage. If None all inserts
+            are staged.
+        chunk_rows (int): The number of rows to load at a time.
+        duplicates (str): 'ignore' or 'replace'. See
+            :meth:`Database.load_file`.
+        totals (dict): Counts of staged, loaded, duplicate and
+            replaced rows and loaded chunks.
+    """
+
+    def __init__(self, database, stage_dir, tables=None, chunk_rows=50000,
+                 duplicates='ignore'):
+        self.database = database
+        self.stage_dir = stage_dir
+        self.tables = tables
+        self.chunk_rows = chunk_rows
+        self.duplicates = duplicates
+        self.totals = {'staged': 0, 'loaded': 0, 'duplicates': 0,
+                       'replaced': 0, 'chunks': 0}
+        self._spools = {}
+        self._files = 0
+        self._lock = threading.Lock()
+        self.database.local_infile = True
+        os.makedirs(stage_dir, exist_ok=True)
+
+    def __getattr__(self, name):
+        return getattr(self.database, name)
+
+    def insert(self, columns, table, values):
+        """Stages values to be loaded into the columns of a table.
+
+        Same arguments as :meth:`Database.insert`.
+
+        Returns:
+            bool: True if the values were staged. Duplicates are only
+            found when the chunk is loaded.
+        """
+        if self.tables is not None and table not in self.tables:
+            return self.database.insert(columns, table, values)
+
+        with self._lock:
+            key = (table, tuple(columns))
+            spool = self._spools.get(key)
+            if spool is None:
+                spool = self._new_spool(table)
+                self._spools[key] = spool
+
+            spool['file'].write(tsv_line(values))
+            spool['rows'] += 1
+            self.totals['staged'] += 1
+
+            if spool['rows'] >= self.chunk_rows:
+                del self._spools[key]
+                self._load(spool, table, columns)
+        return True
+
+    def flush(self):
+        """Loads all of the staged rows."""
+        with self._lock:
+            spools = self._spools
+            self._spools = {}
+            for (table, columns), spool in spools.items():
+                self._load(spool, table, list(columns))
+
+    def close(self):
+        """Loads all of the staged rows, prints a report and closes the
+        database."""
+        try:
+            self.flush()
+            self.report()
+        finally:
+            self.database.close()
+
+    def report(self):
+        """Prints the totals for all of the chunks loaded."""
+        print("*** Bulk load: {chunks} chunks, {staged} rows staged, "
+              "{loaded} loaded, {duplicates} duplicates, {replaced} "
+              "replaced".format(**self.totals))
+
+    def _new_spool(self, table):
+        self._files += 1
+        path = os.path.join(self.stage_dir, "{}_{}_{}.tsv".format(
+            table, os.getpid(), self._files))
+        return {'path': path, 'rows': 0,
+                'file': open(path, 'wb')}
+
+    def _load(self, spool, table, columns):
+        """Loads one spool file into its table and counts the rows."""
+        spool['file'].close()
+        rows = spool['rows']
+        start = time.time()
+        try:
+            affected = self.database.load_file(spool['path'], table, columns,
+                                               self.duplicates)
+        except DatabaseError as err:
+            print("*** Bulk load failed, kept", spool['path'], str(err))
+            raise
+
+        if self.duplicates == 'replace':
+            loaded, duplicates = rows, 0
+            replaced = max(0, affected - rows)
+        else:
+            loaded, duplicates, replaced = affected, rows - affected, 0
+
+        self.totals['chunks'] += 1
+        self.totals['loaded'] += loaded
+        self.totals['duplicates'] += duplicates
+        self.totals['replaced'] += replaced
+        print("*** Bulk loaded {}: {} rows, {} new, {} duplicates, "
+              "{} replaced ({:.1f}s)".format(table, rows, loaded, duplicates,
+                                            replaced, time.time() - start))
+        os.remove(spool['path'])
+
+
+class SqliteDatabase:
+    """A local SQLite database with the same methods as
+    :class:`Database`.
+
+    Lets collection run without a MySQL server. The file uses WAL mode
+    and inserts are committed in batches, so writing is limited by the
+    disk instead of the network. Tables are created with
+    :meth:`create_table` before collection. Use slrg-sync-sqlite to
+    push the rows to MySQL later.
+
+    Can be shared by threads. All access goes through one connection
+    with a lock.
+
+    Attributes:
+        path (str): The path of the SQLite file.
+        batch_size (int): The number of inserts to commit at a time.
+            Selects and close also commit.
+    """
+
+    # The placeholder for values passed as args
+    PLACEHOLDER = '?'
+
+    def __init__(self, path, batch_size=500):
+        self.path = path
+        self.batch_size = batch_size
+        self.database = None
+        self._format = None
+        self._pending = 0
+        self._lock = threading.RLock()
+
+    def connect(self, _format=None):
+        """Opens the SQLite file, creating it if needed.
+
+        Args:
+            format (str): The format of the records to be returned.
+                'j' for dict results, otherwise tuples will be used.
+        """
+        self._format = _format
+        if self.database is not None:
+            return
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.database = sqlite3.connect(self.path, check_same_thread=False)
+        self.database.execute("PRAGMA journal_mode=WAL;")
+        self.database.execute("PRAGMA synchronous=NORMAL;")
+
+    def create_table(self, table, columns, unique=None):
+        """Creates a table if it does not exist.
+
+        Columns have no type, so values keep the type they are inserted
+        with.
+
+        Args:
+            table (str): The name of the table.
+            columns (list): The column names.
+            unique (list of list): The unique keys, each a list of
+                columns that together must be unique. Inserting a
+                duplicate of any key returns False. Default is None.
+        """
+        defs = list(columns)
+        for key in unique or []:
+            defs.append("UNIQUE ({})".format(", ".join(key)))
+        with self._lock:
+            self.database.execute("CREATE TABLE IF NOT EXISTS {} ({});".format(
+                table, ", ".join(defs)))
+            self.database.commit()
+
+    def insert(self, columns, table, values):
+        """Inserts given values into the columns of a given table.
+
+        See :meth:`Database.insert`. The insert is committed with the
+        rest of its batch.
+
+        Returns:
+            bool: False if the values were a duplicate entry, otherwise
+            True.
+
+        Raises:
+            DatabaseError: If there is a problem with the INSERT.
+        """
+        sql = "INSERT INTO {} ({}) VALUES({});".format(
+            table, ", ".join(columns), ", ".join("?" for _ in columns))
+        with self._lock:
+            try:
+                self.database.execute(sql, [_sqlite_value(v) for v in values])
+            except sqlite3.IntegrityError:
+                print("*** Tried to add duplicate entry ***")
+                return False
+            except sqlite3.Error as error:
+                raise DatabaseError(str(error))
+
+            self._pending += 1
+            if self._pending >= self.batch_size:
+                self.commit()
+        return True
+
+    def select(self, columns, table, where, args=None):
+        """Selects values from the given columns from the given table.
+
+        See :meth:`Database.select`.
+        """
+        sql = "SELECT {} FROM {} WHERE {};".format(
+            ", ".join(columns), table, " AND ".join(where))
+        return self._fetch_all(sql, args)
+
+    def query(self, sql):
+        """Run an SQL SELECT query and return the results.
+
+        See :meth:`Database.query`.
+        """
+        Database._check_select(sql)
+        return self._fetch_all(sql)
+
+    def count(self, table):
+        """Returns the number of rows in a table."""
+        with self._lock:
+            self.commit()
+            try:
+                return self.database.execute(
+                    "SELECT COUNT(*) FROM {};".format(table)).fetchone()[0]
+            except sqlite3.Error as error:
+                raise DatabaseError(str(error))
+
+    def stream(self, columns, table, size=10000):
+        """Yields the given columns of every row in a table.
+
+        See :meth:`Database.stream`.
+        """
+        sql = "SELECT {} FROM {};".format(", ".join(columns), table)
+        yield from self.stream_query(sql, size, dicts=False)
+
+    def stream_query(self, sql, size=10000, dicts=None, args=None):
+        """Run an SQL SELECT query and yield the results in batches of
+        size.
+
+        Args:
+            sql (str): A full SQL query for SELECT.
+            size (int): The number of rows to fetch at a time.
+            dicts (bool): Wether to yield dicts. Default is to use the
+                format passed to connect.
+            args (list): Values for ? placeholders in the sql.
+
+        Raises:
+            DatabaseError: If there is a problem with the query.
+        """
+        Database._check_select(sql)
+        if dicts is None:
+            dicts = self._format == 'j'
+
+        # A separate cursor so other queries can run between batches
+        try:
+            with self._lock:
+                self.commit()
+                cursor = self.database.execute(sql, args or [])
+            names = [d[0] for d in cursor.description]
+            while True:
+                with self._lock:
+                    rows = cursor.fetchmany(size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(zip(names, row)) if dicts else row
+        except sqlite3.Error as error:
+            raise DatabaseError(str(error))
+
+    def commit(self):
+        """Commits any inserts in the current batch."""
+        with self._lock:
+            if self.database is not None and self._pending:
+                self.database.commit()
+                self._pending = 0
+
+    def close(self):
+        """Commits any inserts and closes the file."""
+        with self._lock:
+            if self.database is not None:
+                self.commit()
+                self.database.close()
+                self.database = None
+
+    def _fetch_all(self, sql, args=None):
+        with self._lock:
+            self.commit()
+            try:
+                cursor = self.database.execute(sql, args or ())
+                rows = cursor.fetchall()
+            except sqlite3.Error as error:
+                raise DatabaseError(str(error))
+
+        if self._format == 'j':
+            names = [d[0] for d in cursor.description]
+            return [dict(zip(names, row)) for row in rows]
+        return rows
+
+
 class Log:
     """Wrapper for logging."""
 
@@ -460,6 +1358,465 @@ class GenderCollector:
         return (None, None)
 
 
+class BloomFilter:
+    """A set of strings that uses a fixed amount of memory.
+
+    Membership tests can give false positives, but never false
+    negatives.
+
+    Attributes:
+        bits (int): The number of bits in the filter.
+        hashes (int): The number of bits set for each key.
+    """
+
+    def __init__(self, capacity, error_rate, max_bytes=None):
+        """Sizes the filter for a number of keys and error rate.
+
+        Args:
+            capacity (int): The expected number of keys.
+            error_rate (float): The desired false positive rate when the
+                filter holds capacity keys.
+            max_bytes (int): The max size of the filter. If the size for
+                the error rate is larger the error rate will be higher.
+        """
+        capacity = max(capacity, 1)
+        bits = int(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        if max_bytes is not None:
+            bits = min(bits, max_bytes * 8)
+        self.bits = max(bits, 8)
+        self.hashes = max(1, round(self.bits / capacity * math.log(2)))
+        self._array = bytearray((self.bits + 7) // 8)
+
+    def _positions(self, key):
+        """Returns the bit positions for a key."""
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        """Adds a string key to the filter."""
+        for pos in self._positions(key):
+            self._array[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, key):
+        for pos in self._positions(key):
+            if not self._array[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+    def size_bytes(self):
+        """Returns the memory used by the bit array in bytes."""
+        return len(self._array)
+
+    def error_rate(self, count):
+        """Returns the expected false positive rate after adding count
+        keys."""
+        return (1 - math.exp(-self.hashes * count / self.bits)) ** self.hashes
+
+
+class KeySet:
+    """A set of byte string keys that moves its keys to a SQLite file
+    when there are too many to keep in memory.
+
+    Keys are added in batches and the SQLite file is only searched once
+    per batch.
+
+    Attributes:
+        path (str): The SQLite file keys are spilled to.
+        max_memory (int): The max number of keys kept in memory.
+        count (int): The number of keys in the set.
+        spilled (int): The number of keys in the SQLite file.
+    """
+
+    def __init__(self, path, max_memory=1000000):
+        self.path = path
+        self.max_memory = max_memory
+        self.count = 0
+        self.spilled = 0
+        self._memory = set()
+        self._db = None
+
+    def add_many(self, keys):
+        """Adds a batch of keys.
+
+        Args:
+            keys (list of bytes): The keys. None is never a duplicate.
+
+        Returns:
+            list of bool: True for each key that was not already in the
+            set or earlier in the batch.
+        """
+        found = set()
+        if self.spilled:
+            found = self._find([k for k in keys
+                                if k is not None and k not in self._memory])
+
+        added = []
+        for key in keys:
+            new = key is None or (key not in self._memory
+                                  and key not in found)
+            if key is not None and new:
+                self._memory.add(key)
+                self.count += 1
+            added.append(new)
+
+        if len(self._memory) > self.max_memory:
+            self._spill()
+        return added
+
+    def close(self):
+        """Closes and deletes the SQLite file."""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+            os.remove(self.path)
+        self._memory = set()
+
+    def _find(self, keys):
+        """Returns the keys that are in the SQLite file."""
+        found = set()
+        for start in range(0, len(keys), 500):
+            part = keys[start:start + 500]
+            found.update(row[0] for row in self._db.execute(
+                "SELECT key FROM keys WHERE key IN ({});".format(
+                    ", ".join("?" * len(part))), part))
+        return found
+
+    def _spill(self):
+        """Moves the keys in memory to the SQLite file."""
+        if self._db is None:
+            self._db = sqlite3.connect(self.path)
+            self._db.execute("PRAGMA journal_mode=OFF;")
+            self._db.execute("PRAGMA synchronous=OFF;")
+            self._db.execute("CREATE TABLE IF NOT EXISTS keys "
+                             "(key BLOB PRIMARY KEY) WITHOUT ROWID;")
+        self._db.executemany("INSERT OR IGNORE INTO keys VALUES (?);",
+                             ((key,) for key in self._memory))
+        self._db.commit()
+        self.spilled += len(self._memory)
+        self._memory = set()
+
+
+class PredicateChain:
+    """An ordered set of checks that a record must pass.
+
+    Each check has a cost. The number of times each check is run and
+    rejects a record is kept, and the checks are run in the order with
+    the lowest expected cost per record. A check can require other
+    checks to be run before it. The counts can be saved so that they
+    carry over between runs.
+
+    The order the checks are added in is the baseline order. The
+    report compares the cost spent with the expected cost of always
+    using the baseline order.
+
+    Attributes:
+        stats_path (str): A JSON file to load and save the counts in. If
+            None the counts are not saved.
+        stats (dict): The 'calls' and 'rejects' for each check.
+        records (int): The number of records checked this run.
+        spent (float): The total cost of the checks run this run.
+    """
+
+    def __init__(self, stats_path=None):
+        self.stats_path = stats_path
+        self.stats = {}
+        self.records = 0
+        self.spent = 0.0
+        self._checks = {}
+        self._names = []
+
+        if stats_path is not None and os.path.isfile(stats_path):
+            try:
+                self.stats = get_json_data(stats_path)
+            except (ValueError, OSError):
+                self.stats = {}
+
+    def add(self, name, check, cost, requires=()):
+        """Adds a check.
+
+        Args:
+            name (str): A name for the check.
+            check (func): A function that takes a record and returns
+                True if it passes.
+            cost (float): The cost of running the check.
+            requires (list): The names of checks that must run first.
+        """
+        self._checks[name] = (check, cost, list(requires))
+        self._names.append(name)
+        self.stats.setdefault(name, {'calls': 0, 'rejects': 0})
+
+    def pass_rate(self, name):
+        """Returns the estimated rate a check passes records at.
+
+        A smoothed estimate is used so that checks that have not been
+        run much are not ruled out.
+        """
+        stats = self.stats[name]
+        return 1 - (stats['rejects'] + 1) / (stats['calls'] + 2)
+
+    def expected_cost(self, order):
+        """Returns the expected cost of checking a record with the
+        checks in the given order."""
+        cost = 0.0
+        reach = 1.0
+        for name in order:
+            cost += reach * self._checks[name][1]
+            reach *= self.pass_rate(name)
+        return cost
+
+    def order(self):
+        """Returns the order of the checks with the lowest expected
+        cost that runs every check after the checks it requires."""
+        best = None
+        best_cost = None
+        for order in itertools.permutations(self._names):
+            if not self._is_valid_order(order):
+                continue
+            cost = self.expected_cost(order)
+            if best is None or cost < best_cost:
+                best, best_cost = order, cost
+        return list(best)
+
+    def check(self, record):
+        """Runs the checks on a record until one rejects it.
+
+        The counts are only updated once the record is accepted or
+        rejected. If a check raises, like when an API rate limit is
+        reached, nothing is counted and the record can be checked again.
+
+        Args:
+            record: The record to check.
+
+        Returns:
+            bool: True if the record passes every check.
+        """
+        results = []
+        passed = True
+        for name in self.order():
+            check, cost, _ = self._checks[name]
+            passed = check(record)
+            results.append((name, cost, passed))
+            if not passed:
+                break
+
+        self.records += 1
+        for name, cost, result in results:
+            self.stats[name]['calls'] += 1
+            self.spent += cost
+            if not result:
+                self.stats[name]['rejects'] += 1
+        return passed
+
+    def save(self):
+        """Writes the counts to stats_path."""
+        if self.stats_path is not None:
+            write_json_data(self.stats_path, self.stats)
+
+    def report(self, write=print):
+        """Writes the current order, pass rates, and the cost saved
+        compared to the baseline order.
+
+        Args:
+            write (func): A function to write the report with. Default
+                is print.
+        """
+        write("Check order: {}".format(", ".join(
+            "{}({:.0f}%)".format(name, self.pass_rate(name) * 100)
+            for name in self.order())))
+
+        baseline = self.expected_cost(self._names) * self.records
+        write("Check cost spent: {:.0f}, Expected with fixed order: {:.0f}, "
+              "Saved: {:.0f}".format(self.spent, baseline,
+                                     baseline - self.spent))
+
+    def _is_valid_order(self, order):
+        """Returns True if every check in order is after the checks it
+        requires."""
+        for i, name in enumerate(order):
+            for required in self._checks[name][2]:
+                if required not in order[:i]:
+                    return False
+        return True
+
+
+class Record(MutableMapping):
+    """A compact dict-like record with a fixed set of fields.
+
+    Each record keeps its values in its own list, in the order of the
+    fields. Only the map from field name to position is shared by all
+    records of the same type, so records use much less memory than
+    dicts. Keys that are not fields can still be set and are kept in a
+    small dict. Use :func:`make_record_type` to create a record type for
+    a list of fields.
+    """
+
+    __slots__ = ('_values', '_extra')
+    _fields = ()
+    _index = {}
+
+    def __init__(self, data=()):
+        self._values = [_MISSING] * len(self._fields)
+        self._extra = None
+        self.update(data)
+
+    @classmethod
+    def from_dict(cls, data):
+        """Creates a record with only the fields of a dict. Any other
+        keys are dropped."""
+        record = cls.__new__(cls)
+        record._values = [data.get(f, _MISSING) for f in cls._fields]
+        record._extra = None
+        return record
+
+    def __getitem__(self, key):
+        i = self._index.get(key)
+        if i is not None:
+            value = self._values[i]
+            if value is not _MISSING:
+                return value
+        elif self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        i = self._index.get(key)
+        if i is not None:
+            self._values[i] = value
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        i = self._index.get(key)
+        if i is not None and self._values[i] is not _MISSING:
+            self._values[i] = _MISSING
+        elif i is None and self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        i = self._index.get(key)
+        if i is not None:
+            return self._values[i] is not _MISSING
+        return self._extra is not None and key in self._extra
+
+    def __iter__(self):
+        for field, value in zip(self._fields, self._values):
+            if value is not _MISSING:
+                yield field
+        if self._extra is not None:
+            yield from self._extra
+
+    def __len__(self):
+        count = sum(1 for v in self._values if v is not _MISSING)
+        return count + (len(self._extra) if self._extra is not None else 0)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class JsonListWriter:
+    """Writes records to a file as a JSON list one at a time, so the
+    whole list never has to be in memory.
+
+    The file can be read with json.load or :func:`iter_json_list`. It is
+    compressed if the path ends in a compressed extension, see
+    :func:`open_file`.
+
+    Attributes:
+        path (str): The file being written.
+        count (int): The number of records written.
+        size (int): The number of bytes written before compression.
+    """
+
+    def __init__(self, path, threads=1, level=None):
+        self.path = path
+        self.count = 0
+        self.size = 1
+        self._file = open_file(path, 'w', threads=threads, level=level)
+        self._file.write('[')
+
+    def write(self, record):
+        """Adds a record to the list."""
+        self.write_json(json.dumps(record, default=dict))
+
+    def write_json(self, text):
+        """Adds a record that is already encoded as JSON."""
+        if self.count:
+            text = ', ' + text
+        self._file.write(text)
+        self.count += 1
+        # json.dumps escapes non ASCII characters, so one per byte
+        self.size += len(text)
+
+    def close(self):
+        """Ends the list and closes the file."""
+        self._file.write(']')
+        self.size += 1
+        self._file.close()
+
+    def abort(self):
+        """Closes the file without ending the list, so it can't be read
+        as a complete list."""
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _BlockCompressor(io.RawIOBase):
+    """A binary file that compresses each block of COMPRESS_BLOCK_SIZE
+    bytes written to it in a pool of threads and writes them in order.
+
+    zlib, bz2 and lzma release the GIL while they compress, so the
+    blocks are compressed in parallel.
+    """
+
+    def __init__(self, file, compress, threads):
+        self._file = file
+        self._compress = compress
+        self._threads = threads
+        self._pool = ThreadPoolExecutor(max_workers=threads)
+        self._pending = collections.deque()
+        self._buf = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._buf += data
+        while len(self._buf) >= COMPRESS_BLOCK_SIZE:
+            self._submit(bytes(self._buf[:COMPRESS_BLOCK_SIZE]))
+            del self._buf[:COMPRESS_BLOCK_SIZE]
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._buf:
+                self._submit(bytes(self._buf))
+                self._buf = bytearray()
+            while self._pending:
+                self._file.write(self._pending.popleft().result())
+        finally:
+            self._pool.shutdown()
+            self._file.close()
+            super().close()
+
+    def _submit(self, block):
+        self._pending.append(self._pool.submit(self._compress, block))
+        while len(self._pending) > self._threads * 2:
+            self._file.write(self._pending.popleft().result())
+
+
 # Collection Info and Data Classes #####################################
 
 class CollectionInfo:
@@ -473,13 +1830,41 @@ class CollectionInfo:
         validation (ValidationData): Information for validating records
             and results during processing.
         limits (LimitData): Information on processing limits.
+        skip (SkipData): Information for the index of work already in
+            the database. If None no index is used.
+        near_dup (NearDupData): Information for the near duplicate
+            index. If None near duplicates are not checked.
+        compression (CompressionData): Information for compressing the
+            source columns. If None they are stored as text.
+        features (FeatureData): Information for the features computed
+            for each sample. If None no features are stored.
+        content_hash (bool): Whether the table has a content_hash column
+            that each sample's content hash is stored in.
     """
 
-    def __init__(self, records, table, validation, limits):
+    def __init__(self, records, table, validation, limits, skip=None,
+                 near_dup=None, compression=None, features=None,
+                 content_hash=False):
         self.records = records
         self.table = table
         self.validation = validation
         self.limits = limits
+        self.skip = skip
+        self.near_dup = near_dup
+        self.compression = compression
+        self.features = features
+        self.content_hash = content_hash
+
+    def get_tables(self):
+        """Returns a list of all the tables samples are stored in."""
+        return [self.table]
+
+    def sample_columns(self, table):
+        """Returns the columns of a table a sample is stored in, with
+        the feature columns after the table's own columns."""
+        if self.features is None:
+            return table.columns
+        return list(table.columns) + list(self.features.names)
 
 
 class RecordsData:
@@ -503,11 +1888,14 @@ class TableData:
     Attributes:
         name (str): The name of the table.
         columns (list): The column names.
+        language (str): The language of the samples in the table if
+            they are all one language, otherwise None.
     """
 
-    def __init__(self, name, columns):
+    def __init__(self, name, columns, language=None):
         self.name = name
         self.columns = columns
+        self.language = language
 
 
 class ValidationData:
@@ -544,6 +1932,129 @@ class LimitData:
         return self.start + self.count
 
 
+class SkipData:
+    """Information for the index of work that is already in the
+    database.
+
+    Attributes:
+        error_rate (float): The false positive rate of the index. Keys
+            that are falsely reported as known will not be collected.
+        max_bytes (int): The max memory for the index in bytes.
+        extra (int): The number of new keys to leave room for.
+    """
+
+    def __init__(self, error_rate, max_bytes, extra):
+        self.error_rate = error_rate
+        self.max_bytes = max_bytes
+        self.extra = extra
+
+
+class NearDupData:
+    """Information for the near duplicate index.
+
+    See :class:`~slrg_data.collection.neardup.NearDupIndex`.
+
+    Attributes:
+        path (str): The SQLite file for the index.
+        action (str): 'skip' to not store near duplicates or 'flag' to
+            store them and only log them.
+        num_perm (int): The number of hash functions in a signature.
+        bands (int): The number of LSH bands.
+        threshold (float): The min similarity for a near duplicate.
+        shingle (int): The number of tokens in a shingle.
+        batch_size (int): The number of samples to add to the index
+            before committing them.
+    """
+
+    def __init__(self, path, action, num_perm, bands, threshold, shingle,
+                 batch_size=500):
+        self.path = path
+        self.action = action
+        self.num_perm = num_perm
+        self.bands = bands
+        self.threshold = threshold
+        self.shingle = shingle
+        self.batch_size = batch_size
+
+    def make_index(self):
+        """Opens the near duplicate index."""
+        return neardup.NearDupIndex(self.path, self.num_perm, self.bands,
+                                    self.threshold, self.shingle,
+                                    batch_size=self.batch_size)
+
+
+class CompressionData:
+    """Information for compressing source columns before they are
+    stored.
+
+    See :func:`compress_text`.
+
+    Attributes:
+        codec (str): The codec. One of the keys of CODECS.
+        level (int): The compression level for the codec.
+        columns (list): The columns to compress.
+    """
+
+    def __init__(self, codec, level, columns):
+        self.codec = codec
+        self.level = level
+        self.columns = columns
+
+    def compress_values(self, columns, values):
+        """Compresses the values of a row that are in compressed
+        columns.
+
+        Args:
+            columns (list): The column names of the row.
+            values (list): The values of the row.
+
+        Returns:
+            list: The values with text in compressed columns replaced by
+            compressed bytes.
+        """
+        return [compress_text(value, self.codec, self.level)
+                if column in self.columns and isinstance(value, str)
+                else value
+                for column, value in zip(columns, values)]
+
+
+class FeatureData:
+    """Information for the features computed for each sample.
+
+    See :mod:`slrg_data.collection.features`.
+
+    Attributes:
+        names (list): The features to compute. Each is stored in a
+            column with the same name.
+        columns (list): The columns the source of a sample can be in.
+            The first one in a table is used.
+        batch_size (int): The number of samples to compute features for
+            and insert at a time.
+    """
+
+    def __init__(self, names, columns, batch_size):
+        self.names = names
+        self.columns = columns
+        self.batch_size = batch_size
+
+    def get_source(self, columns, values):
+        """Returns the source from the values of a row, or None if the
+        row has none of the source columns."""
+        for column in self.columns:
+            if column in columns:
+                return values[columns.index(column)]
+        return None
+
+    @staticmethod
+    def get_language(table, values):
+        """Returns the language of a row's sample from its
+        programming_language column, or the table's language if it has
+        none."""
+        if 'programming_language' in table.columns:
+            return values[table.columns.index('programming_language')]
+        return table.language
+
+
 class LanguageData:
     """Information on the languages to collect and exclude.
 
@@ -559,6 +2070,30 @@ class LanguageData:
 
 # Functions ############################################################
 
+def make_key(*values):
+    """Joins values into a single string key for a skip index."""
+    return "\0".join(str(v) for v in values)
+
+
+def content_hash(source):
+    """Returns a hash of the normalised content of some source code.
+
+    Line endings are made '\\n', trailing whitespace is removed from
+    every line and blank lines at the start and end are dropped, so
+    copies that only differ in those ways get the same hash.
+
+    Args:
+        source (str): The source code.
+
+    Returns:
+        str: A 32 character hex digest.
+    """
+    lines = [line.rstrip() for line in source.splitlines()]
+    normal = "\n".join(lines).strip("\n")
+    return hashlib.blake2b(normal.encode('utf-8', 'replace'), digest_size=16,
+                           key=CONTENT_HASH_KEY).hexdigest()
+
+
 def find_time(sec):
     """Finds the time represented by a given number of seconds.
 
@@ -605,40 +2140,376 @@ def requests_session(username=None, passwd=None, prompt="Password: "):
     return session
 
 
-def session_get_json(session, url):
+def session_get(session, url):
     """Wraps requests session get call to the given url.
 
-    Catches json.decoder.JSONDecodeError if the result of the get is not
-    valid JSON.
+    If there is a connection error it waits and tries again. Max 10
+    tries.
 
     Args:
         session (requests.Session): The request session.
         url (str): The url to GET from.
 
     Returns:
-        dict: The JSON returned by the GET call, or None if there is
-            a decoding error.
+        requests.Response: The response, or None if the connection
+            failed every time.
     """
     for _ in range(10):
         try:
-            return session.get(url).json()
-        except json.decoder.JSONDecodeError:
-            return None
+            return session.get(url)
         except requests.exceptions.ConnectionError as err:
             time.sleep(30)
             print("Connection Error:", str(err))
+    return None
+
+
+def session_get_json(session, url):
+    """Wraps requests session get call to the given url.
+
+    Catches json.decoder.JSONDecodeError if the result of the get is not
+    valid JSON.
+
+    Args:
+        session (requests.Session): The request session.
+        url (str): The url to GET from.
+
+    Returns:
+        dict: The JSON returned by the GET call, or None if there is
+            a decoding error.
+    """
+    response = session_get(session, url)
+    if response is None:
+        return None
+    try:
+        return response.json()
+    except json.decoder.JSONDecodeError:
+        return None
 
 
-def get_json_data(path):
-    """Loads JSON data from a given path and returns it."""
-    with open(path) as file:
-        return json.load(file)
+def get_json_data(path, fields=None):
+    """Loads JSON data from a given path and returns it.
 
+    Args:
+        path (str): The path of a JSON file. It can be compressed, see
+            :func:`open_file`.
+        fields (list): If given the file must contain a list of JSON
+            objects. Only the given fields of each object are kept and
+            the objects are returned as :class:`Record`. The file is
+            parsed one object at a time so the full objects are never
+            all in memory.
+
+    Returns:
+        The JSON data, or a list of Record if fields are given.
+    """
+    if fields is None:
+        with open_file(path) as file:
+            return json.load(file)
 
-def write_json_data(path, data):
-    """Writes JSON data to a given path."""
-    with open(path, 'w') as file:
-        json.dump(data, file)
+    record_type = make_record_type(fields)
+    return [record_type.from_dict(obj) for obj in iter_json_list(path)]
+
+
+def iter_json_list(path, chunk_size=2**20):
+    """Iterates over the items of a JSON list in a file without loading
+    the whole list.
+
+    Args:
+        path (str): The path of a file containing a JSON list. It can be
+            compressed, see :func:`open_file`.
+        chunk_size (int): The number of characters to read at a time.
+
+    Yields:
+        The items of the list.
+
+    Raises:
+        ValueError: If the file does not contain a JSON list.
+    """
+    decoder = json.JSONDecoder()
+    with open_file(path) as file:
+        buf = file.read(chunk_size).lstrip()
+        if not buf.startswith('['):
+            raise ValueError("Not a JSON list: " + path)
+        pos = 1
+        eof = False
+
+        while True:
+            # Skip whitespace and separators before the next item
+            while True:
+                while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                    pos += 1
+                if pos < len(buf) or eof:
+                    break
+                buf, pos = file.read(chunk_size), 0
+                eof = not buf
+
+            if pos >= len(buf) or buf[pos] == ']':
+                return
+
+            try:
+                item, end = decoder.raw_decode(buf, pos)
+            except json.decoder.JSONDecodeError:
+                if eof:
+                    raise
+                more = file.read(max(chunk_size, len(buf) - pos))
+                eof = not more
+                buf, pos = buf[pos:] + more, 0
+                continue
+
+            yield item
+            pos = end
+
+
+def make_record_type(fields):
+    """Creates a :class:`Record` type for the given fields.
+
+    Args:
+        fields (list): The names of the fields.
+
+    Returns:
+        type: A subclass of Record.
+    """
+    fields = tuple(fields)
+    return type('Record', (Record,), {
+        '__slots__': (),
+        '_fields': fields,
+        '_index': {field: i for i, field in enumerate(fields)}
+    })
+
+
+def tsv_line(values):
+    """Returns a line for a TSV file that can be loaded with LOAD DATA.
+
+    Uses MySQL's default escaping. None is written as \\N. Text is
+    encoded as UTF-8 and bytes are written as they are, so the file
+    must be loaded with CHARACTER SET binary.
+
+    Args:
+        values (list): The values of a row.
+
+    Returns:
+        bytes: The escaped values separated by tabs, ending in a
+        newline.
+    """
+    fields = []
+    for value in values:
+        if value is None:
+            fields.append(b'\\N')
+            continue
+        if isinstance(value, bool):
+            value = int(value)
+        if isinstance(value, (bytes, bytearray)):
+            value = bytes(value)
+            for char, escape in _TSV_BYTE_ESCAPES:
+                value = value.replace(char, escape)
+            fields.append(value)
+        else:
+            fields.append(str(value).translate(_TSV_ESCAPES).encode('utf-8'))
+    return b'\t'.join(fields) + b'\n'
+
+
+def compress_text(text, codec='zlib', level=6):
+    """Compresses text to be stored in a binary column.
+
+    The result starts with COMPRESSED_MARKER and the codec's byte from
+    CODECS so :func:`decompress_value` knows how to read it.
+
+    Args:
+        text (str): The text to compress.
+        codec (str): 'zlib', 'bz2', 'lzma' or 'zstd'. zstd needs the
+            zstandard package.
+        level (int): The compression level. For lzma it is the preset.
+
+    Returns:
+        bytes: The marked, compressed text.
+
+    Raises:
+        ValueError: If the codec is not known or not installed.
+    """
+    data = text.encode('utf-8')
+    if codec == 'zlib':
+        packed = zlib.compress(data, level)
+    elif codec == 'bz2':
+        packed = bz2.compress(data, level)
+    elif codec == 'lzma':
+        packed = lzma.compress(data, preset=level)
+    elif codec == 'zstd' and zstandard is not None:
+        packed = zstandard.ZstdCompressor(level=level).compress(data)
+    else:
+        raise ValueError("Not an available codec: " + str(codec))
+    return COMPRESSED_MARKER + CODECS[codec] + packed
+
+
+def decompress_value(value):
+    """Returns the text of a value from a compressed column.
+
+    Values made by :func:`compress_text` are decompressed and other
+    bytes are decoded as UTF-8, so columns that were converted to a
+    binary type after rows were added still read correctly. Anything
+    else is returned as it is.
+
+    Raises:
+        ValueError: If the value is marked with an unknown codec.
+    """
+    if not isinstance(value, (bytes, bytearray)):
+        return value
+    if value[:1] != COMPRESSED_MARKER:
+        return bytes(value).decode('utf-8', 'replace')
+
+    codec, packed = value[1:2], bytes(value[2:])
+    if codec == CODECS['zlib']:
+        data = zlib.decompress(packed)
+    elif codec == CODECS['bz2']:
+        data = bz2.decompress(packed)
+    elif codec == CODECS['lzma']:
+        data = lzma.decompress(packed)
+    elif codec == CODECS['zstd'] and zstandard is not None:
+        data = zstandard.ZstdDecompressor().decompress(packed)
+    else:
+        raise ValueError("Value compressed with an unavailable codec: "
+                         + repr(codec))
+    return data.decode('utf-8', 'replace')
+
+
+def decompress_rows(rows, columns, threads=4, batch=256):
+    """Decompresses the compressed columns of dict rows as they are
+    read.
+
+    Batches of rows are decompressed by a pool of threads while the
+    next batches are read. zlib, bz2 and lzma release the GIL, so large
+    values are decompressed in parallel. Rows are yielded in order.
+
+    Args:
+        rows (iterable of dict): The rows. Changed in place.
+        columns (list): The columns that may be compressed.
+        threads (int): The number of threads. 1 or less decompresses
+            in the calling thread.
+        batch (int): The number of rows given to a thread at a time.
+
+    Yields:
+        dict: Each row with its compressed columns as text.
+    """
+    columns = list(columns)
+
+    def work(chunk):
+        for row in chunk:
+            for column in columns:
+                if column in row:
+                    row[column] = decompress_value(row[column])
+        return chunk
+
+    rows = iter(rows)
+    if threads <= 1:
+        for row in rows:
+            yield work([row])[0]
+        return
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        pending = collections.deque()
+        while True:
+            chunk = list(itertools.islice(rows, batch))
+            if not chunk:
+                break
+            pending.append(pool.submit(work, chunk))
+            if len(pending) > threads * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def _sqlite_value(value):
+    """Converts a value to a type SQLite can store."""
+    if value is None or isinstance(value, (int, float, str, bytes)):
+        return value
+    return str(value)
+
+
+def write_json_data(path, data, threads=1, level=None):
+    """Writes JSON data to a given path. The file is compressed if the
+    path ends in a compressed extension, see :func:`open_file`."""
+    with open_file(path, 'w', threads=threads, level=level) as file:
+        json.dump(data, file, default=dict)
+
+
+def open_file(path, mode='r', threads=1, level=None, newline=None):
+    """Opens a file, compressing or decompressing it as it is read or
+    written if its name ends in .gz, .bz2, .xz or .zst.
+
+    .zst files need the zstandard package.
+
+    Args:
+        path (str): The path of the file.
+        mode (str): 'r', 'w' or 'a', with 'b' for bytes. Default is
+            to read text.
+        threads (int): The number of threads to compress with when
+            writing. More than 1 compresses blocks of the file in
+            parallel, which gives a little less compression.
+        level (int): The compression level. Default is the codec's.
+        newline (str): Passed to the text wrapper, as for open.
+
+    Returns:
+        file: A file object.
+
+    Raises:
+        ValueError: If the file is .zst and zstandard is not installed.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    if ext not in COMPRESSED_EXTENSIONS:
+        return open(path, mode, newline=newline)
+
+    binary = 'b' in mode
+    raw_mode = mode.replace('t', '').replace('b', '') + 'b'
+    writing = raw_mode[0] in 'wax'
+
+    if ext == '.zst':
+        if zstandard is None:
+            raise ValueError("Reading and writing .zst files needs the "
+                             "zstandard package: " + path)
+        if writing:
+            ctx = zstandard.ZstdCompressor(
+                level=3 if level is None else level,
+                threads=threads if threads > 1 else 0)
+            raw = ctx.stream_writer(open(path, raw_mode), closefd=True)
+        else:
+            raw = zstandard.ZstdDecompressor().stream_reader(
+                open(path, 'rb'), closefd=True)
+            raw = io.BufferedReader(raw)
+    elif writing and threads > 1:
+        raw = io.BufferedWriter(_BlockCompressor(
+            open(path, raw_mode), _block_compress_function(ext, level),
+            threads))
+    else:
+        opener = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}[ext]
+        if writing and level is not None:
+            key = 'preset' if ext == '.xz' else 'compresslevel'
+            raw = opener(path, raw_mode, **{key: level})
+        else:
+            raw = opener(path, raw_mode)
+
+    if binary:
+        return raw
+    return io.TextIOWrapper(raw, newline=newline)
+
+
+def strip_compression(path):
+    """Returns a path without its compressed extension, if it has one.
+    ie) records.json.gz -> records.json"""
+    base, ext = os.path.splitext(path)
+    if ext.lower() in COMPRESSED_EXTENSIONS:
+        return base
+    return path
+
+
+def _block_compress_function(ext, level):
+    """Returns a function that compresses a block of bytes into a
+    complete stream. Streams can be joined end to end and still read as
+    one file by gzip, bz2 and lzma."""
+    if ext == '.gz':
+        level = 6 if level is None else level
+        return lambda block: gzip.compress(block, level)
+    if ext == '.bz2':
+        level = 9 if level is None else level
+        return lambda block: bz2.compress(block, level)
+    return lambda block: lzma.compress(block, preset=level)
 
 
 def get_gender(name, database, table, write=lambda x: None):
@@ -694,12 +2565,8 @@ def get_gender_from_database(name, database, table):
         found, otherwise None.
     """
     columns = ['gender', 'probability']
-
-    if name.find('"') > -1:
-        return None
-
-    where = ['name="{}"'.format(name)]
-    result = database.select(columns, table, where)
+    where = ['name=' + database.PLACEHOLDER]
+    result = database.select(columns, table, where, [name])
     if result is not None and result:
         return result[0]
     return None
@@ -0,0 +1,166 @@
+"""Cheap lexical features of source code samples, computed when samples
+are collected and stored in columns next to them.
+
+Storing the features lets analyses filter samples by size and shape
+with an indexed column instead of scanning the source of every sample.
+Features are computed for a batch of samples at a time and the work
+shared by several features, like splitting lines, is only done once per
+sample.
+
+Comments are found with the syntax of each sample's language. See
+:func:`comment_syntax`.
+"""
+from .neardup import TOKEN_RE
+
+
+# Constants ############################################################
+
+# The features that can be computed, with their column types
+FEATURES = {
+    'char_count': 'INT',
+    'line_count': 'INT',
+    'token_count': 'INT',
+    'blank_ratio': 'FLOAT',
+    'comment_ratio': 'FLOAT',
+    'avg_line_length': 'FLOAT',
+    'max_line_length': 'INT',
+}
+
+# Comment syntaxes: (// and /* */ comments, # comments)
+SLASH_COMMENTS = (True, False)
+HASH_COMMENTS = (False, True)
+ALL_COMMENTS = (True, True)
+
+# Words in a language's name that choose its comment syntax, checked in
+# order. C and C++ # lines are preprocessor directives, not comments.
+# Languages that match none use ALL_COMMENTS.
+LANGUAGE_COMMENTS = [
+    ('python', HASH_COMMENTS), ('pypy', HASH_COMMENTS),
+    ('ruby', HASH_COMMENTS), ('perl', HASH_COMMENTS),
+    ('php', ALL_COMMENTS),
+    ('c++', SLASH_COMMENTS), ('cpp', SLASH_COMMENTS),
+    ('gnu c', SLASH_COMMENTS), ('clang', SLASH_COMMENTS),
+    ('msvc', SLASH_COMMENTS), ('c#', SLASH_COMMENTS),
+    ('java', SLASH_COMMENTS), ('kotlin', SLASH_COMMENTS),
+    ('scala', SLASH_COMMENTS), ('rust', SLASH_COMMENTS),
+    ('go', SLASH_COMMENTS), ('swift', SLASH_COMMENTS),
+]
+
+# Features that need the lines of a sample
+_LINE_FEATURES = {'line_count', 'blank_ratio', 'comment_ratio',
+                  'avg_line_length', 'max_line_length'}
+
+
+# Functions ############################################################
+
+def check_names(names):
+    """Checks that every name is a known feature.
+
+    Raises:
+        ValueError: If a name is not in FEATURES.
+    """
+    for name in names:
+        if name not in FEATURES:
+            raise ValueError("Not a feature: " + str(name))
+
+
+def comment_syntax(language):
+    """Returns the comment syntax of a language.
+
+    Args:
+        language (str): A language name, like c++ from the config or
+            GNU C++17 from Codeforces. Case does not matter.
+
+    Returns:
+        tuple: One of SLASH_COMMENTS, HASH_COMMENTS or ALL_COMMENTS.
+        ALL_COMMENTS if the language is None or not known.
+    """
+    name = (language or '').lower()
+    for word, syntax in LANGUAGE_COMMENTS:
+        if word in name:
+            return syntax
+    return ALL_COMMENTS
+
+
+def count_comments(lines, syntax):
+    """Counts the lines of a sample that are comments.
+
+    A line is a comment if it starts with a line comment, starts a
+    /* */ block or is inside one. Code with a comment at the end of the
+    line is not a comment line.
+
+    Args:
+        lines (list of str): The lines of the sample.
+        syntax (tuple): The comment syntax. See :func:`comment_syntax`.
+
+    Returns:
+        int: The number of comment lines.
+    """
+    slashes, hashes = syntax
+    count = 0
+    in_block = False
+    for line in lines:
+        text = line.strip()
+        if in_block:
+            count += 1
+            end = text.rfind('*/')
+            in_block = end < 0 or text.rfind('/*') > end
+        elif slashes and text.startswith('//'):
+            count += 1
+        elif slashes and text.startswith('/*'):
+            count += 1
+            end = text.rfind('*/', 2)
+            in_block = end < 0 or text.rfind('/*') > end
+        elif hashes and text.startswith('#'):
+            count += 1
+        elif slashes and '/*' in text:
+            # A block that starts after code on the line
+            in_block = text.rfind('/*') > text.rfind('*/')
+    return count
+
+
+def extract(sources, names, languages=None):
+    """Computes features for a batch of samples.
+
+    Args:
+        sources (list of str): The source code of each sample. None is
+            treated as empty.
+        names (list of str): The features to compute, in the order of
+            their columns.
+        languages (list of str): The language of each sample, to choose
+            its comment syntax. Default is None for every sample.
+
+    Returns:
+        list of list: The values of the features for each sample.
+    """
+    need_lines = not _LINE_FEATURES.isdisjoint(names)
+    need_tokens = 'token_count' in names
+    if languages is None:
+        languages = [None] * len(sources)
+    rows = []
+    for source, language in zip(sources, languages):
+        source = source or ''
+        found = {'char_count': len(source)}
+
+        if need_tokens:
+            found['token_count'] = sum(1 for _ in TOKEN_RE.finditer(source))
+
+        if need_lines:
+            lines = source.splitlines()
+            count = len(lines)
+            found['line_count'] = count
+            found['max_line_length'] = max(map(len, lines), default=0)
+            if count:
+                found['blank_ratio'] = sum(
+                    1 for line in lines if not line.strip()) / count
+                found['comment_ratio'] = count_comments(
+                    lines, comment_syntax(language)) / count
+                found['avg_line_length'] = (len(source) - source.count('\n')
+                                            - source.count('\r')) / count
+            else:
+                found['blank_ratio'] = 0.0
+                found['comment_ratio'] = 0.0
+                found['avg_line_length'] = 0.0
+
+        rows.append([found[name] for name in names])
+    return rows
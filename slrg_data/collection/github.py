@@ -6,18 +6,58 @@ import sys
 import getpass
 import os
 import http
-import random
 import shutil
 import hashlib
+import queue
+import threading
+import urllib.parse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
 # 3rd party libraries
 import git
+import requests
 
 # Local imports
 from . import common
 from . import script
 
 
+# Constants ############################################################
+
+# Range of line counts for a file to be collected by ProjectsCollector
+MIN_LINES = 10
+MAX_LINES = 1000
+
+# Files larger than this are rejected before being read. 1000 lines of
+# 1000 characters, well beyond any file that is not generated.
+MAX_FILE_SIZE = 2**20
+
+# Number of bytes at the start of a file to check for NUL bytes
+BINARY_SNIFF_SIZE = 8192
+
+# The GitHub commits API lists at most 300 files per page and 3000 files
+# in total
+COMMIT_FILES_PER_PAGE = 300
+COMMIT_MAX_FILE_PAGES = 10
+
+# GitHub API file statuses for git diff-tree status letters
+DIFF_STATUSES = {
+    'A': 'added',
+    'D': 'removed',
+    'M': 'modified',
+    'R': 'renamed',
+    'C': 'copied',
+    'T': 'changed'
+}
+
+
+# Cost of a check made on a project before it is cloned when it is not
+# in the predicate costs given to ProjectsCollector. The costs are set
+# in the config file.
+DEFAULT_PREDICATE_COST = 1
+
+
 # Git Collectors #######################################################
 
 class GitCollector(common.Collector):
@@ -37,14 +77,27 @@ class GitCollector(common.Collector):
             rate limit has been reached.
         gender_file (str): A prefix for the filename for missing gender
             data to be written to.
+        offline_work (deque): Queued functions that do not need the
+            GitHub API. They are run while waiting for the API rate
+            limit to reset.
+        offline (bool): True while offline work is run during a rate
+            limit wait. Work that can use the API should avoid it while
+            this is True.
+        unfinished (set): The indexes of the records with queued work
+            that has not finished. A run that stops early should be
+            resumed from the lowest one.
     """
 
     def __init__(self, database, collection_info, log):
         super(GitCollector, self).__init__(database, collection_info, log)
         self.totals.update({'files': 0, 'added': 0})
+        self.times.update({'waited': 0.0, 'offline': 0.0})
         self.gender_collector = common.GenderCollector(database, 'genders')
         self.gender_wait = []
         self.gender_file = 'missing_gender'
+        self.offline_work = deque()
+        self.offline = False
+        self.unfinished = set()
 
     def set_up(self):
         """Extends :func:`Collector.set_up() <slrg_data.collection.common.Collector.set_up>`
@@ -57,6 +110,73 @@ class GitCollector(common.Collector):
         self.session = authenticated_session(login, passwd)
         self.times['session'] = time.time()
 
+    def wait_for_reset(self):
+        """Waits for the GitHub API rate limit to reset.
+
+        Queued offline work is run first. Then the collector sleeps for
+        whatever time is left until the reset.
+        """
+        start = time.time()
+        reset = api_reset_time(self.times['session'], 120)
+
+        if self.offline_work:
+            self.log.info("**** Rate limit reached: running {} queued "
+                          "tasks ****".format(len(self.offline_work)))
+            self.offline = True
+            try:
+                self.run_offline_work(until=reset)
+            finally:
+                self.offline = False
+
+        if time.time() < reset:
+            wait_for_api(self.times['session'], 120, self.log.info)
+
+        self.times['waited'] += time.time() - start
+        self.times['session'] = time.time()
+
+    def run_offline_work(self, until=None, keep=0):
+        """Runs queued offline work.
+
+        Args:
+            until (float): A timestamp to stop at. If None all the work
+                is run.
+            keep (int): The number of tasks to leave in the queue.
+        """
+        start = time.time()
+        while len(self.offline_work) > keep:
+            if until is not None and time.time() >= until:
+                break
+            self.offline_work.popleft()()
+
+        if until is not None:
+            self.times['offline'] += time.time() - start
+
+    def process_data(self, data):
+        """Extends :func:`Collector.process_data() <slrg_data.collection.common.Collector.process_data>`
+        to run any queued offline work once all records are processed.
+        """
+        super(GitCollector, self).process_data(data)
+        self.run_offline_work()
+
+    def clean_up(self):
+        """Prints the time spent waiting for the GitHub API.
+
+        Extends :func:`Collector.clean_up() <slrg_data.collection.common.Collector.clean_up>`.
+        """
+        super(GitCollector, self).clean_up()
+
+        waited = self.times['waited']
+        self.log.info("Waiting for GitHub API: {}, Idle: {}".format(
+            common.find_time(waited),
+            common.find_time(max(0, waited - self.times['offline']))))
+        if self.offline_work:
+            self.log.info("Queued tasks not run: {}".format(
+                len(self.offline_work)))
+        if self.unfinished:
+            self.log.info("Records with unfinished queued work: {}. "
+                          "Resume from idx {} to collect them.".format(
+                              len(self.unfinished), min(self.unfinished)))
+
     def add_name_and_gender(self, entry_data):
         """Add fullname and gender data to an entry.
 
@@ -68,13 +188,31 @@ class GitCollector(common.Collector):
             entry_data (dict): A row of json data gathered from
                 :ref:`GhTorrent via BigQuery <ght-big-query-lab>`.
         """
+        fullname, gender, gender_probability = self.get_fullname_and_gender(
+            entry_data)
+        self.set_name_and_gender(entry_data, fullname, gender,
+                                 gender_probability)
+
+    def set_name_and_gender(self, entry_data, fullname, gender,
+                            gender_probability):
+        """Sets the 'user_fullname', 'gender' and 'gender_probability'
+        keys of an entry.
+
+        The values are only set if there is a fullname and a gender,
+        otherwise they are set to None. If the gender is unavailable the
+        entry may be saved to write to the missing gender file.
+
+        Args:
+            entry_data (dict): A row of json data gathered from
+                :ref:`GhTorrent via BigQuery <ght-big-query-lab>`.
+            fullname (str): The user's fullname.
+            gender (str): The gender for the user's first name.
+            gender_probability (float): The probability of the gender.
+        """
         entry_data['user_fullname'] = None
         entry_data['gender'] = None
         entry_data['gender_probability'] = None
 
-        fullname, gender, gender_probability = self.get_fullname_and_gender(
-            entry_data)
-
         if fullname not in [None, '']:
             if gender not in ['nil', None]:
                 entry_data['user_fullname'] = fullname
@@ -101,22 +239,49 @@ class GitCollector(common.Collector):
             gender_probability that can be obtained. If any of the
             values are not accessible they are returned as None.
         """
+        fullname = self.lookup_fullname(entry_data)
+        gender, gender_probability = self.lookup_gender(fullname)
+        return fullname, gender, gender_probability
+
+    def lookup_fullname(self, entry_data, wait=True):
+        """Gets a github users fullname from the GitHub API.
+
+        Args:
+            entry_data(dict): A row of json data gathered from
+                :ref:`GhTorrent via BigQuery <ght-big-query-lab>`..
+            wait (bool): Whether to wait for the rate limit to reset
+                when it is reached. If False RateLimitExceeded is
+                raised instead.
+
+        Returns:
+            str: The fullname, or None if it cannot be obtained.
+        """
         try:
             fullname = get_fullname(
                 entry_data['login'], self.session, self.times['session'])
         except RateLimitExceeded:
-            wait_for_api(self.times['session'], 120, self.log.info)
-            self.times['session'] = 0
+            if not wait:
+                raise
+            fullname = None
+            self.wait_for_reset()
 
-        if fullname not in [None, '']:
-            name = fullname.split()[0]
-            gender, gender_probability = self.gender_collector.get_gender(name)
-        else:
+        if fullname in [None, '']:
             print("No User Name: " + entry_data['login'])
-            gender = None
-            gender_probability = None
+        return fullname
 
-        return fullname, gender, gender_probability
+    def lookup_gender(self, fullname):
+        """Gets the gender for the first name in a fullname.
+
+        Args:
+            fullname (str): A users fullname.
+
+        Returns:
+            (str, float): The gender and gender_probability. Both are
+            None if there is no fullname or the gender is unavailable.
+        """
+        if fullname in [None, '']:
+            return None, None
+        return self.gender_collector.get_gender(fullname.split()[0])
 
     def write_missing(self, collection_type):
         """Run with cleanup to save any records missing gender.
@@ -144,11 +309,15 @@ class CommitsCollector(GitCollector):
     process.
     """
 
+    skip_columns = ['commit_sha', 'file_sha']
+    record_keys = ['url', 'sha', 'login']
+
     def __init__(self, database, collection_info, log):
         super(CommitsCollector, self).__init__(
             database, collection_info, log)
-        self.totals.update({'commits': 0})
+        self.totals.update({'commits': 0, 'pages': 0})
         self.gender_file = 'commits_missing_gender'
+        self.rate_remaining = None
 
     def process(self, entry):
         """Processes a row of commit data collected from GhTorrent.
@@ -161,15 +330,13 @@ class CommitsCollector(GitCollector):
         """
         try:
             print("#", self.totals['entry'], "###", end=" ")
-
             commit_data = self.get_commit_data(entry['url'], entry['sha'])
 
             if api_ok(commit_data, write=self.log.info):
                 self.process_commit(commit_data, entry)
 
         except RateLimitExceeded:
-            wait_for_api(self.times['session'], 120, self.log.info)
-            self.times['session'] = time.time()
+            self.wait_for_reset()
         except KeyError as error:
             self.log.error("In process:", error)
 
@@ -187,12 +354,95 @@ class CommitsCollector(GitCollector):
                 for more info.
         """
         url = project_url + "/commits/" + commit_sha
-        return common.session_get_json(self.session, url)
+        return self.get_api_json(url)
+
+    def get_api_json(self, url):
+        """Requests JSON from the GitHub API and records how many
+        requests are left in the rate limit.
+
+        Args:
+            url (str): The api url to GET from.
+
+        Returns:
+            dict: The JSON response, or None if there was no valid
+                response.
+        """
+        response = common.session_get(self.session, url)
+        if response is None:
+            return None
+
+        remaining = response.headers.get('X-RateLimit-Remaining')
+        if remaining is not None:
+            self.rate_remaining = int(remaining)
+
+        try:
+            return response.json()
+        except ValueError:
+            return None
+
+    def iter_commit_files(self, commit_data, entry):
+        """Iterates over all the files in a commit.
+
+        The API only returns the first page of files with a commit. If
+        the page is full the following pages are requested as they are
+        needed, so no pages are requested once iteration stops. If the
+        rate limit has more than limits.page_min_rate requests left
+        limits.page_workers pages are requested at the same time.
+
+        Args:
+            commit_data (dict): A GitHub API response for commit
+                information.
+            entry (dict): A row of commit data from :ref:`GhTorrent via BigQuery <ght-big-query-lab>`.
+
+        Yields:
+            dict: The file data for each file in the commit.
+
+        Raises:
+            RateLimitExceeded: If the rate limit is reached while
+                requesting more pages.
+        """
+        limits = self.collection_info.limits
+        url = "{}/commits/{}?page={{}}".format(entry['url'], entry['sha'])
+        files = commit_data['files']
+        page = 1
+        last_page = len(files) < COMMIT_FILES_PER_PAGE
+
+        while True:
+            yield from files
+            if last_page or page >= COMMIT_MAX_FILE_PAGES:
+                return
+
+            workers = 1
+            if (self.rate_remaining is not None
+                    and self.rate_remaining > limits.page_min_rate):
+                workers = limits.page_workers
+            pages = range(page + 1,
+                          min(page + workers, COMMIT_MAX_FILE_PAGES) + 1)
+
+            with ThreadPoolExecutor(max_workers=len(pages)) as executor:
+                responses = list(executor.map(
+                    lambda p: self.get_api_json(url.format(p)), pages))
+            self.totals['pages'] += len(pages)
+
+            files = []
+            for response in responses:
+                page += 1
+                if not api_ok(response, write=self.log.info):
+                    last_page = True
+                    break
+                files.extend(response['files'])
+                if len(response['files']) < COMMIT_FILES_PER_PAGE:
+                    last_page = True
+                    break
 
     def process_commit(self, commit_data, entry):
         """Collects additional data and adds valid commits to the
         database.
 
+        If limits.max_commit_files is set no more files are processed
+        once it is reached. Files that are already in the skip index are
+        not added again, but still count towards the limit.
+
         Args:
             commit_data (dict): A GitHub API response for commit
                 information.
@@ -206,16 +456,31 @@ class CommitsCollector(GitCollector):
         self.totals['commits'] += 1
         print("Processing Commit:", commit_data['sha'], "###")
 
-        for file_data in commit_data['files']:
+        max_files = self.collection_info.limits.max_commit_files
+        added = 0
+        for file_data in self.iter_commit_files(commit_data, entry):
             self.totals['files'] += 1
 
             if not self.is_valid(file_data):
                 continue
 
-            print("Processing File:", file_data['filename'], "....")
-            if self.add_file_to_db(file_data, entry):
+            table = self.collection_info.get_table(file_data['filename'])
+            if self.is_known(table.name, entry['sha'], file_data['sha']):
+                print("Already collected:", file_data['filename'])
+                added += 1
+            else:
+                print("Processing File:", file_data['filename'], "....")
+                if not self.add_file_to_db(file_data, entry):
+                    continue
+
                 self.totals['added'] += 1
                 print("-- Added")
+                self.add_known(table.name, entry['sha'], file_data['sha'])
+                added += 1
+
+            if max_files is not None and added >= max_files:
+                print("-- Reached {} files for commit".format(added))
+                break
 
     def is_valid(self, file_data):
         """Confirms a file meets the requirements to be added to the
@@ -257,13 +522,18 @@ class CommitsCollector(GitCollector):
             bool: True if the information was successfully added to
                 the database, otherwise False.
         """
+        file_values = self.get_file_values(file_data)
+        digest = self.check_content(file_values[2])
+        if digest is None:
+            return False
+
         values = self.get_entry_values(entry)
-        values.extend(self.get_file_values(file_data))
+        values.extend(file_values)
+        if self.collection_info.content_hash:
+            values.append(digest)
 
-        if self.database.insert(self.collection_info.table.columns,
-                                self.collection_info.table.name, values):
-            return True
-        return False
+        table = self.collection_info.get_table(file_data['filename'])
+        return self.insert_sample(table, values, digest)
 
     def transform_entry_value(self, value, entry_field):
         """Transforms commit creation time into a string.
@@ -328,10 +598,241 @@ class CommitsCollector(GitCollector):
             added, files, (added / files) * 100))
         self.log.info("Files added/commit: {}/{:.0f} {:.0f}%".format(
             added, commits, (added / commits) * 100))
+        self.log.info("Extra file pages requested: {}".format(
+            self.totals['pages']))
 
         self.write_missing('commits')
 
 
+class CloneCommitsCollector(CommitsCollector):
+    """Collector for GitHub commit data that reads commits from local
+    clones instead of the GitHub API.
+
+    Records are grouped by project and each project is cloned once. The
+    files added by each commit are found with git diff-tree and turned
+    into the same file data the GitHub commits API returns, so the
+    values stored are the same as for :class:`CommitsCollector`. The
+    only API calls made are for user names.
+
+    Adds 'clones' key to the totals dict attribute inherited from
+    :class:`~CommitsCollector`.
+
+    Attributes:
+        repo_cache (RepoCache): A cache of mirrored repositories. If
+            given the mirrors are read directly instead of cloning.
+        temp_repos (TempRepoManager): Manages the directories projects
+            are cloned into. If None one is created in the default
+            temp_repos directory.
+    """
+
+    def __init__(self, database, collection_info, log, repo_cache=None,
+                 temp_repos=None):
+        super(CloneCommitsCollector, self).__init__(
+            database, collection_info, log)
+        self.totals.update({'clones': 0})
+        self.repo_cache = repo_cache
+
+        if temp_repos is None:
+            temp_repos = TempRepoManager(os.path.join(
+                common.SLRG_DIR, 'git', 'commits', 'temp_repos'))
+        self.temp_repos = temp_repos
+
+    def set_up(self):
+        """Extends :func:`GitCollector.set_up() <GitCollector.set_up>`
+        to start the temp repo manager."""
+        super(CloneCommitsCollector, self).set_up()
+        self.temp_repos.start(write=self.log.info)
+
+    def process_data(self, data):
+        """Processes the records within the limits one project at a
+        time.
+
+        Overrides
+        :func:`~slrg_data.collection.common.Collector.process_data`.
+
+        Args:
+            data (list): A list of dict records to process.
+        """
+        projects = {}
+        for idx, entry in enumerate(data):
+            if idx < self.collection_info.limits.start:
+                continue
+            elif idx >= self.collection_info.limits.end():
+                break
+            projects.setdefault(entry['url'], []).append((idx, entry))
+
+        for url, entries in projects.items():
+            self.process_project(url, entries)
+
+    def process_project(self, project_url, entries):
+        """Clones a project and processes all of the records for its
+        commits.
+
+        Args:
+            project_url (str): The api url for the project.
+            entries (list): A list of (index, entry) tuples for the
+                commit records of the project.
+        """
+        login, name = project_url.rstrip('/').split('/')[-2:]
+        url = "https://:@github.com/{}/{}.git".format(login, name)
+
+        repo_path = None
+        try:
+            print("Cloning Project:", login + "/" + name, "###")
+            if self.repo_cache is not None:
+                repo = git.Repo(self.repo_cache.get_mirror(url, login, name))
+            else:
+                repo_path = self.temp_repos.new_path()
+                repo = git.Repo.clone_from(url, repo_path, bare=True)
+            self.totals['clones'] += 1
+
+            for idx, entry in entries:
+                print("#", self.totals['entry'], "###", end=" ")
+                self.process_local(repo, entry)
+                self.totals['entry'] += 1
+                self.idx = idx
+
+        except git.GitError as error:
+            self.log.error("In process_project", error)
+            self.totals['entry'] += len(entries)
+            self.idx = entries[-1][0]
+
+        finally:
+            if repo_path is not None:
+                self.temp_repos.release(repo_path)
+
+    def process_local(self, repo, entry):
+        """Processes a row of commit data using a local clone.
+
+        Commits without any valid files are skipped before looking up
+        the user's name.
+
+        Args:
+            repo (git.Repo): The cloned repository of the commit.
+            entry (dict): A row of commit data from :ref:`GhTorrent via BigQuery <ght-big-query-lab>`.
+        """
+        try:
+            commit_data = self.get_local_commit_data(repo, entry['sha'])
+
+            if not any(self.is_valid(f) for f in commit_data['files']):
+                self.totals['files'] += len(commit_data['files'])
+                print("No valid files:", entry['sha'])
+                return
+
+            self.process_commit(commit_data, entry)
+
+        except RateLimitExceeded:
+            self.wait_for_reset()
+        except (git.GitError, git.exc.ODBError,  # pylint: disable=no-member
+                ValueError) as error:
+            # Commit sha is not in the repository
+            self.log.error("In process_local", error)
+        except KeyError as error:
+            self.log.error("In process_local", error)
+
+    def get_local_commit_data(self, repo, commit_sha):
+        """Finds the files changed by a commit in a local repository.
+
+        The result has the parts of a GitHub commits API response that
+        :func:`~CommitsCollector.process_commit` uses. Only added files
+        with a collected extension have their contents read, other
+        files have no 'patch'.
+
+        Args:
+            repo (git.Repo): The cloned repository of the commit.
+            commit_sha (str): The sha of the commit.
+
+        Returns:
+            dict: A dict with the commit 'sha' and a list of 'files'.
+        """
+        commit = repo.commit(commit_sha)
+        # -z gives paths as they are instead of quoting unusual ones
+        args = ['-r', '-M', '-z', '--no-commit-id', '--raw']
+        if commit.parents:
+            args.extend([commit.parents[0].hexsha, commit.hexsha])
+        else:
+            args.extend(['--root', commit.hexsha])
+
+        files = []
+        fields = [f for f in repo.git.diff_tree(*args).split('\0') if f]
+        fields.reverse()
+        while fields:
+            blob_sha, status = fields.pop().split()[3:5]
+            path = fields.pop()
+            # Renames and copies have the old path, then the new one
+            if status[0] in 'RC':
+                path = fields.pop()
+            file_data = {'sha': blob_sha, 'filename': path,
+                         'status': DIFF_STATUSES.get(status[0], status),
+                         'changes': 0}
+
+            if (file_data['status'] == 'added' and has_extensions(
+                    file_data['filename'],
+                    self.collection_info.validation.extensions)):
+                self.add_local_patch(repo, file_data)
+            files.append(file_data)
+
+        return {'sha': commit.hexsha, 'files': files}
+
+    def iter_commit_files(self, commit_data, entry):
+        """Iterates over all the files in a commit.
+
+        Overrides :func:`CommitsCollector.iter_commit_files`. Local
+        commit data always has every file.
+        """
+        return iter(commit_data['files'])
+
+    def add_local_patch(self, repo, file_data):
+        """Adds the 'patch' and 'changes' that the GitHub API would give
+        for an added file.
+
+        Binary files and files that cannot be decoded are left without
+        a patch or changes, like the API does.
+
+        Args:
+            repo (git.Repo): The cloned repository of the file.
+            file_data (dict): The 'sha', 'filename', and 'status' of an
+                added file.
+        """
+        data = repo.git.cat_file('blob', file_data['sha'],
+                                 stdout_as_string=False)
+        if is_binary(data):
+            return
+
+        try:
+            source = data.decode()
+        except UnicodeDecodeError:
+            return
+
+        lines = source.split('\n')
+        no_newline = lines[-1] != ''
+        if not no_newline:
+            lines.pop()
+
+        patch = "@@ -0,0 +1,{} @@".format(len(lines))
+        for line in lines:
+            patch += "\n+" + line
+        if no_newline:
+            patch += "\n\\ No newline at end of file"
+
+        file_data['patch'] = patch
+        file_data['changes'] = len(lines)
+
+    def clean_up(self):
+        """Stops the temp repo manager and prints details of the
+        collection for projects cloned.
+
+        Extends :func:`CommitsCollector.clean_up() <CommitsCollector.clean_up>`.
+        """
+        super(CloneCommitsCollector, self).clean_up()
+        self.log.info("Projects cloned: {}".format(self.totals['clones']))
+
+        if self.repo_cache is not None:
+            self.repo_cache.report(self.log.info)
+
+        self.temp_repos.close(write=self.log.info)
+
+
 class ProjectsCollector(GitCollector):
     """Concrete Collector class for collecting source code samples using
     GitHub project data.
@@ -340,13 +841,52 @@ class ProjectsCollector(GitCollector):
     :class:`~GitCollector`.
 
     see :ref:`Git Projects <git-projects>` for more information on this process.
+
+    Attributes:
+        repo_cache (RepoCache): A cache of mirrored repositories to
+            clone projects from. If None projects are cloned directly
+            from GitHub.
+        temp_repos (TempRepoManager): Manages the directories projects
+            are cloned into. If None one is created in the default
+            temp_repos directory.
+        predicates (common.PredicateChain): The checks a project must
+            pass before it is cloned, in the order that is expected to
+            cost the least.
     """
 
-    def __init__(self, database, collection_info, log):
+    skip_columns = ['project_id', 'file_hash']
+    record_keys = ['projects_id', 'url', 'name', 'login']
+
+    def __init__(self, database, collection_info, log, repo_cache=None,
+                 temp_repos=None, predicate_costs=None):
         super(ProjectsCollector, self).__init__(
             database, collection_info, log)
-        self.totals.update({'projects': 0})
+        self.totals.update({'projects': 0, 'blob_projects': 0})
         self.gender_file = 'projects_missing_gender'
+        self.repo_cache = repo_cache
+
+        if temp_repos is None:
+            temp_repos = TempRepoManager(os.path.join(
+                common.SLRG_DIR, 'git', 'projects', 'temp_repos'))
+        self.temp_repos = temp_repos
+
+        costs = predicate_costs if predicate_costs is not None else {}
+        stats_path = os.path.join(common.SLRG_DIR, 'git', 'projects',
+                                  'predicate_stats.json')
+        self.predicates = common.PredicateChain(stats_path)
+        self.predicates.add('name', self.check_name,
+                            costs.get('name', DEFAULT_PREDICATE_COST))
+        self.predicates.add('gender', self.check_gender,
+                            costs.get('gender', DEFAULT_PREDICATE_COST),
+                            requires=['name'])
+        self.predicates.add('contributors', self.check_contributors,
+                            costs.get('contributors', DEFAULT_PREDICATE_COST))
+
+    def set_up(self):
+        """Extends :func:`GitCollector.set_up() <GitCollector.set_up>`
+        to start the temp repo manager."""
+        super(ProjectsCollector, self).set_up()
+        self.temp_repos.start(write=self.log.info)
 
     def process(self, project_data):
         """Collects additional data and adds valid projects to the
@@ -358,22 +898,84 @@ class ProjectsCollector(GitCollector):
         """
         print("#", self.idx, "###", end=" ")
 
-        # Don't want to continue if the name or gender are not found
-        self.add_name_and_gender(project_data)
-        if (project_data['user_fullname'] is None
-                or project_data['gender'] is None):
-            print("Invalid project: " + project_data['name'] + " ###")
-            return
+        while True:
+            try:
+                valid = self.predicates.check(project_data)
+                break
+            except RateLimitExceeded:
+                # Not counted against the check, try again after reset
+                self.wait_for_reset()
 
-        self.add_contributors(project_data)
-        if not self.is_valid_project(project_data):
+        if not valid:
             print("Invalid project: " + project_data['name'] + " ###")
             return
 
         self.totals['projects'] += 1
-        print("Processing Project:", project_data['name'], "###")
+        self.queue_valid_project(project_data)
+
+    def check_name(self, project_data):
+        """Looks up the project owner's fullname.
+
+        Sets 'user_fullname' in project_data to the fullname. It will
+        be replaced by :func:`check_gender`.
 
-        self.process_valid_project(project_data)
+        Returns:
+            bool: True if the owner has a fullname.
+        """
+        project_data['user_fullname'] = self.lookup_fullname(project_data,
+                                                             wait=False)
+        return project_data['user_fullname'] not in [None, '']
+
+    def check_gender(self, project_data):
+        """Looks up the gender of the project owner's first name and
+        adds the name and gender to project_data.
+
+        Must be run after :func:`check_name`.
+
+        Returns:
+            bool: True if a gender was found.
+        """
+        fullname = project_data['user_fullname']
+        gender, gender_probability = self.lookup_gender(fullname)
+        self.set_name_and_gender(project_data, fullname, gender,
+                                 gender_probability)
+        return project_data['gender'] is not None
+
+    def check_contributors(self, project_data):
+        """Adds the project's contributors to project_data and checks
+        the project is valid.
+
+        Returns:
+            bool: True if the project is valid. See
+            :func:`is_valid_project`.
+        """
+        self.add_contributors(project_data, wait=False)
+        return self.is_valid_project(project_data)
+
+    def queue_valid_project(self, project_data):
+        """Queues a valid project to be cloned and processed as offline
+        work.
+
+        Up to limits.clone_ahead projects are kept in the queue so that
+        there is work to do while waiting for the API rate limit to
+        reset. Once the queue is full the oldest project is processed.
+        The project's record stays in unfinished until it is processed,
+        so a run that stops early can be resumed without losing it.
+
+        Args:
+            project_data (dict): A row of project data from
+                :ref:`GhTorrent via BigQuery <ght-big-query-lab>`.
+        """
+        idx = self.idx
+
+        def work():
+            print("Processing Project:", project_data['name'], "###")
+            self.process_valid_project(project_data)
+            self.unfinished.discard(idx)
+
+        self.unfinished.add(idx)
+        self.offline_work.append(work)
+        self.run_offline_work(keep=self.collection_info.limits.clone_ahead)
 
     def is_valid_project(self, project_data):
         """Checks to make sure project is valid.
@@ -402,6 +1004,49 @@ class ProjectsCollector(GitCollector):
         return True
 
     def process_valid_project(self, project_data):
+        """Adds all valid source code in a project to the database.
+
+        If the owner is the project's only contributor and the project
+        has few enough candidate files the files are downloaded directly
+        instead of cloning the repository. See :func:`process_blobs`.
+        Otherwise the repository is cloned and blamed. See
+        :func:`process_repo`. Listing the files uses the API, so when
+        run as offline work the repository is always cloned.
+
+        Args:
+            project_data (dict): A row of project data from
+                :ref:`GhTorrent via BigQuery <ght-big-query-lab>`.
+        """
+        threshold = self.collection_info.limits.blob_threshold
+        paths = None
+        if (threshold > 0 and not self.offline
+                and self.is_sole_author(project_data)):
+            paths = self.get_candidate_paths(project_data)
+
+        if paths is not None and len(paths) <= threshold:
+            self.totals['blob_projects'] += 1
+            self.process_blobs(paths, project_data)
+        else:
+            self.process_repo(project_data)
+
+    @staticmethod
+    def is_sole_author(project_data):
+        """Checks that the project owner is the only contributor to a
+        project.
+
+        Args:
+            project_data (dict): A row of project data from
+                :ref:`GhTorrent via BigQuery <ght-big-query-lab>`.
+
+        Returns:
+            bool: True if there is exactly one contributor and it is the
+                owner, otherwise False.
+        """
+        contribs = project_data['contributors']
+        return (contribs is not None and len(contribs) == 1
+                and contribs[0]['author']['login'] == project_data['login'])
+
+    def process_repo(self, project_data):
         """Clones the project repo and adds all valid source code to
         the database.
 
@@ -418,6 +1063,9 @@ class ProjectsCollector(GitCollector):
                                             project_data["login"])
 
             for filename in files:
+                if self.is_known_file(filename, project_data):
+                    print("Already collected:", filename)
+                    continue
                 path = os.path.join(repo_path, filename)
                 self.process_file(path, filename, project_data)
 
@@ -425,30 +1073,142 @@ class ProjectsCollector(GitCollector):
             self.log.error("In process", error)
 
         finally:
-            try:
-                shutil.rmtree(repo_path)
-            except (FileNotFoundError, TypeError):
-                pass
+            if repo_path is not None:
+                if self.repo_cache is not None:
+                    self.repo_cache.release(repo_path)
+                self.temp_repos.release(repo_path)
+
+    def get_candidate_paths(self, project_data):
+        """Lists the paths of all files in a project that could be
+        collected.
+
+        Uses the GitHub API tree listing for the default branch. Paths
+        are checked for valid extensions and excluded files and
+        directories, but not for authorship.
+
+        Args:
+            project_data (dict): A row of project data from
+                :ref:`GhTorrent via BigQuery <ght-big-query-lab>`.
+
+        Returns:
+            list: A list of relative file paths, or None if the listing
+            is unavailable or incomplete.
+        """
+        tree_url = "{}/git/trees/HEAD?recursive=1".format(project_data['url'])
+        tree = common.session_get_json(self.session, tree_url)
+
+        try:
+            if not api_ok(tree, write=self.log.info):
+                return None
+        except RateLimitExceeded:
+            self.wait_for_reset()
+            return None
+        except GitApiError:
+            # Empty repositories have no tree, let the clone handle them
+            return None
+
+        if 'tree' not in tree or tree.get('truncated', False):
+            return None
+
+        validation = self.collection_info.validation
+        return [item['path'] for item in tree['tree']
+                if item['type'] == 'blob'
+                and is_candidate_path(item['path'], validation)]
+
+    def process_blobs(self, paths, project_data):
+        """Downloads the files at the given paths and adds all valid
+        source code to the database.
+
+        Only used for projects where :func:`is_sole_author` is True, so
+        every file has a single author and no blame is needed. Files are downloaded concurrently, but
+        added to the database one at a time.
+
+        Args:
+            paths (list): Relative paths of the files to collect.
+            project_data (dict): A row of project data from
+                :ref:`GhTorrent via BigQuery <ght-big-query-lab>`.
+        """
+        known = set(path for path in paths
+                    if self.is_known_file(path, project_data))
+        if known:
+            print("-- Already collected {} files".format(len(known)))
+            paths = [path for path in paths if path not in known]
+
+        print("-- Fetching {} files without cloning".format(len(paths)))
+        workers = self.collection_info.limits.blob_workers
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            sources = executor.map(
+                lambda path: self.get_blob(path, project_data), paths)
+
+            for filename, source in zip(paths, sources):
+                if source is not None:
+                    self.process_source(source, filename, project_data)
+
+    def get_blob(self, path, project_data):
+        """Downloads the raw contents of a file in a project.
+
+        Raw content requests do not count against the GitHub API rate
+        limit.
+
+        Args:
+            path (str): The files path in the repository.
+            project_data (dict): A row of project data from
+                :ref:`GhTorrent via BigQuery <ght-big-query-lab>`.
+
+        Returns:
+            str: The contents of the file with normalised line endings,
+            or None if it could not be downloaded or decoded.
+        """
+        url = "https://raw.githubusercontent.com/{}/{}/HEAD/{}".format(
+            project_data['login'], project_data['name'],
+            urllib.parse.quote(path))
+        try:
+            response = self.session.get(url)
+            if (response.status_code != 200
+                    or len(response.content) > MAX_FILE_SIZE
+                    or is_binary(response.content)):
+                return None
+            return decode_source(response.content)
+
+        except (requests.exceptions.RequestException,
+                UnicodeDecodeError) as error:
+            self.log.error("Blob Error", error)
+            return None
 
     def _make_repo(self, project_data):
-        """Clones a repository and return a git.Repo object for it."""
-        repos_dir = os.path.join(
-            common.SLRG_DIR, 'git', 'projects', 'temp_repos')
-        temp_dir = "temp_{}".format(str(random.randint(0, 2000000)))
-        repo_path = os.path.join(repos_dir, temp_dir)
+        """Clones a repository and return a git.Repo object for it.
+
+        If there is a repo_cache the clone is made from the cached
+        mirror of the repository. If the clone fails the directory is
+        released before the error is raised.
+        """
+        repo_path = self.temp_repos.new_path()
 
         url = "https://:@github.com/{}/{}.git".format(
             project_data['login'], project_data['name'])
 
-        repo = git.Repo.clone_from(url, repo_path)
+        try:
+            if self.repo_cache is not None:
+                repo = self.repo_cache.checkout(
+                    url, project_data['login'], project_data['name'],
+                    repo_path)
+            else:
+                repo = git.Repo.clone_from(url, repo_path)
+        except git.GitError:
+            self.temp_repos.release(repo_path)
+            raise
+
         return repo, repo_path
 
-    def add_contributors(self, project_data):
+    def add_contributors(self, project_data, wait=True):
         """Add a list of contributors to project data.
 
         Args:
             project_data (dict): A row of project data from
                 :ref:`GhTorrent via BigQuery <ght-big-query-lab>`.
+            wait (bool): Whether to wait for the rate limit to reset
+                when it is reached. If False RateLimitExceeded is
+                raised instead.
         """
         project_data['contributors'] = None
         contrib_url = "{}/stats/contributors".format(project_data['url'])
@@ -459,8 +1219,9 @@ class ProjectsCollector(GitCollector):
                 project_data['contributors'] = contribs
 
         except RateLimitExceeded:
-            wait_for_api(self.times['session'], 120, self.log.info)
-            self.times['session'] = time.time()
+            if not wait:
+                raise
+            self.wait_for_reset()
 
     def process_file(self, path, filename, project_data):
         """Process a file and add it to the database if it is valid.
@@ -473,19 +1234,64 @@ class ProjectsCollector(GitCollector):
         """
         self.totals['files'] += 1
         file_data = self.get_file_data(path, filename)
+        self.add_valid_file(file_data, filename, project_data)
+
+    def process_source(self, source, filename, project_data):
+        """Process the contents of a file and add it to the database if
+        it is valid.
+
+        Args:
+            source (str): The source code from the file.
+            filename (str): The files path in the repository.
+            project_data (dict): A row of project data from
+                :ref:`GhTorrent via BigQuery <ght-big-query-lab>`.
+        """
+        self.totals['files'] += 1
+        file_data = self.get_source_data(source, filename)
+        self.add_valid_file(file_data, filename, project_data)
+
+    def add_valid_file(self, file_data, filename, project_data):
+        """Adds file data to the database if it is not None.
 
+        Args:
+            file_data (list): File data from :func:`get_file_data` or
+                None if the file was not valid.
+            filename (str): The files path in the repository.
+            project_data (dict): A row of project data from
+                :ref:`GhTorrent via BigQuery <ght-big-query-lab>`.
+        """
         if file_data is not None:
             print("Processing File:", "....", filename)
 
             if self.add_file_to_db(file_data, project_data):
                 print("-- Added")
                 self.totals['added'] += 1
+                table = self.collection_info.get_table(filename)
+                self.add_known(table.name, project_data['projects_id'],
+                               file_data[0])
+
+    def is_known_file(self, filename, project_data):
+        """Checks the skip index for a file of a project.
+
+        Args:
+            filename (str): The files path in the repository.
+            project_data (dict): A row of project data from
+                :ref:`GhTorrent via BigQuery <ght-big-query-lab>`.
+
+        Returns:
+            bool: True if the file is probably already in the table for
+                its language.
+        """
+        table = self.collection_info.get_table(filename)
+        return self.is_known(table.name, project_data['projects_id'],
+                             hashlib.md5(filename.encode()).hexdigest())
 
     def get_file_data(self, path, filename):
         """Collects the source and other file info from the file.
 
-        In addition to the source code a count of the number of lines
-        in the file is determined and a hash of the filename is created.
+        The file size, line count and a check for binary contents are
+        done on the raw bytes so that invalid files are rejected before
+        being decoded. See :func:`get_source_data`.
 
         Args:
             path (str): The full path to the file.
@@ -497,14 +1303,54 @@ class ProjectsCollector(GitCollector):
                 line count. If the file is not valid returns None.
         """
         try:
-            with open(path) as file:
-                source = file.read()
-        except (FileExistsError, FileNotFoundError,
-                UnicodeDecodeError) as error:
+            size = os.stat(path).st_size
+            if size > MAX_FILE_SIZE or size < MIN_LINES:
+                print("File size out of range: " + str(size))
+                return None
+
+            with open(path, 'rb') as file:
+                data = file.read()
+        except (FileExistsError, FileNotFoundError) as error:
+            self.log.error("File Error", error)
+            return None
+
+        if is_binary(data):
+            print("Binary file: " + filename)
+            return None
+
+        line_count = count_lines(data)
+        if not in_line_range(line_count):
+            print("Lines out of range: " + str(line_count))
+            return None
+
+        try:
+            source = decode_source(data)
+        except UnicodeDecodeError as error:
             self.log.error("File Error", error)
             return None
 
-        line_count = source.count('\n')
+        return self.get_source_data(source, filename, line_count)
+
+    def get_source_data(self, source, filename, line_count=None):
+        """Collects file info for the source code of a file.
+
+        In addition to the source code a count of the number of lines
+        in the file is determined and a hash of the filename is created.
+
+        Args:
+            source (str): The source code from the file.
+            filename (str): The files path in the repository.
+            line_count (int): The number of lines in the source, if it
+                is already known.
+
+        Returns:
+            list: If the file is valid returns a list with the hash of
+                the filename, the filename, the source code, and a
+                line count. If the file is not valid returns None.
+        """
+        if line_count is None:
+            line_count = source.count('\n')
+
         if self.is_valid_file(filename, source, line_count):
             hash_name = hashlib.md5(filename.encode()).hexdigest()
             return [hash_name, filename, source, line_count]
@@ -516,7 +1362,7 @@ class ProjectsCollector(GitCollector):
         """Checks to see if a file is valid.
 
         Additional validation of a file. Currently only checks to make
-        sure the number of lines is the range [10, 1000]
+        sure the number of lines is the range [MIN_LINES, MAX_LINES]
 
         Args:
             filename (str): The files path in the repository.
@@ -526,9 +1372,7 @@ class ProjectsCollector(GitCollector):
         Returns:
             bool: True if the file is valid, otherwise False.
         """
-        if 10 <= line_count <= 1000:
-            return True
-        return False
+        return in_line_range(line_count)
 
     def add_file_to_db(self, file_data, project_data):
         """Attempts to add all necessary information for a source code
@@ -545,13 +1389,17 @@ class ProjectsCollector(GitCollector):
             bool: True if the information was successfully added to
                 the database, otherwise False.
         """
+        digest = self.check_content(file_data[2])
+        if digest is None:
+            return False
+
         values = self.get_entry_values(project_data)
         values.extend(file_data)
+        if self.collection_info.content_hash:
+            values.append(digest)
 
-        if self.database.insert(self.collection_info.table.columns,
-                                self.collection_info.table.name, values):
-            return True
-        return False
+        table = self.collection_info.get_table(file_data[1])
+        return self.insert_sample(table, values, digest)
 
     def clean_up(self):
         """Prints details of the collection for projects, files processed,
@@ -571,6 +1419,16 @@ class ProjectsCollector(GitCollector):
             added, files, (added / files) * 100))
         self.log.info("Files added/project: {}/{:.0f} {:.0f}%".format(
             added, projects, (added / projects) * 100))
+        self.log.info("Projects collected without cloning: {}".format(
+            self.totals['blob_projects']))
+
+        if self.repo_cache is not None:
+            self.repo_cache.report(self.log.info)
+
+        self.temp_repos.close(write=self.log.info)
+
+        self.predicates.report(self.log.info)
+        self.predicates.save()
 
         self.write_missing('projects')
 
@@ -580,16 +1438,98 @@ class GitCollectionInfo(common.CollectionInfo):
 
     Attributes:
         git_data (GithubData): Login and password info for a git account.
-        language (str): The language of the data being collected.
+        language (str): The language of the data being collected. If
+            more than one language is being collected their names are
+            joined with '_'.
+        lang_tables (list): A list of (extensions, TableData) tuples
+            used to choose the table for a file when collecting more than
+            one language. Files that match none of them use table.
     """
 
     def __init__(self, records, table, validation, limits, git_data, lang,
-                 save_missing):
+                 save_missing, lang_tables=None, skip=None, near_dup=None,
+                 compression=None, features=None, content_hash=False):
         super(GitCollectionInfo, self).__init__(
-            records, table, validation, limits)
+            records, table, validation, limits, skip, near_dup, compression,
+            features, content_hash)
         self.git_data = git_data
         self.language = lang
         self.save_missing = save_missing
+        self.lang_tables = lang_tables if lang_tables is not None else []
+
+    def get_table(self, filename):
+        """Returns the table that a file should be added to.
+
+        The first language in lang_tables with a matching extension is
+        used.
+
+        Args:
+            filename (str): A filename or path.
+
+        Returns:
+            TableData: The table for the file's language.
+        """
+        for extensions, table in self.lang_tables:
+            if has_extensions(filename, extensions):
+                return table
+        return self.table
+
+    def get_tables(self):
+        """Returns a list of all the tables samples are stored in.
+
+        Extends :func:`~slrg_data.collection.common.CollectionInfo.get_tables`
+        to include the tables for every language.
+        """
+        tables = [self.table]
+        for _, table in self.lang_tables:
+            if table.name not in [t.name for t in tables]:
+                tables.append(table)
+        return tables
+
+
+class CommitsLimitData(common.LimitData):
+    """Extended limit data for GitHub commit collection.
+
+    Attributes:
+        max_commit_files (int): The maximum number of files to add to
+            the database from a single commit. None if there is no
+            limit.
+        page_workers (int): The number of pages of a large commit's
+            files to request at the same time.
+        page_min_rate (int): Pages are only requested at the same time
+            while more than this many requests are left in the GitHub
+            API rate limit.
+    """
+
+    def __init__(self, start, count, max_commit_files, page_workers,
+                 page_min_rate):
+        super(CommitsLimitData, self).__init__(start, count)
+        self.max_commit_files = max_commit_files
+        self.page_workers = page_workers
+        self.page_min_rate = page_min_rate
+
+
+class ProjectsLimitData(common.LimitData):
+    """Extended limit data for GitHub project collection.
+
+    Attributes:
+        clone_ahead (int): The number of valid projects to queue before
+            cloning them. Queued projects are cloned while waiting for
+            the GitHub API rate limit to reset. 0 clones each project
+            right away.
+        blob_threshold (int): The maximum number of candidate files a
+            project can have for its files to be downloaded directly
+            instead of cloning the repository. 0 always clones.
+        blob_workers (int): The number of files to download at the
+            same time when not cloning.
+    """
+
+    def __init__(self, start, count, blob_threshold, blob_workers,
+                 clone_ahead):
+        super(ProjectsLimitData, self).__init__(start, count)
+        self.clone_ahead = clone_ahead
+        self.blob_threshold = blob_threshold
+        self.blob_workers = blob_workers
 
 
 class GithubData:
@@ -606,6 +1546,325 @@ class GithubData:
         self.passwd = passwd
 
 
+class RepoCache:
+    """A persistent cache of bare mirrors of GitHub repositories.
+
+    Mirrors are kept between runs so that collecting from the same
+    projects for another language does not clone them again. Only the
+    branches are fetched, not other refs like pull requests. A cached
+    mirror is refreshed with a fetch and working copies are made from
+    it with a local shared clone.
+
+    When the total size of the mirrors is more than max_size the least
+    recently used mirrors are removed. Mirrors with working copies that
+    have not been released are never removed, since the working copies
+    use the mirror's objects.
+
+    Attributes:
+        cache_dir (str): The directory the mirrors are stored in.
+        max_size (int): The maximum size of the cache in bytes.
+        hits (int): The number of checkouts that used a cached mirror.
+        misses (int): The number of checkouts that had to clone a new
+            mirror.
+    """
+
+    def __init__(self, cache_dir, max_size):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._sizes = None
+        self._checkouts = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def mirror_path(self, login, name):
+        """Returns the path of the mirror for a repository."""
+        return os.path.join(self.cache_dir, login, name + '.git')
+
+    def checkout(self, url, login, name, repo_path):
+        """Makes a working copy of a repository from its mirror.
+
+        The mirror is kept until the working copy is released with
+        :meth:`release`.
+
+        Args:
+            url (str): The url to clone the repository from.
+            login (str): The login of the repository owner.
+            name (str): The name of the repository.
+            repo_path (str): The path to create the working copy at.
+
+        Returns:
+            git.Repo: The repository object for the working copy.
+
+        Raises:
+            git.GitError: If the repository cannot be cloned.
+        """
+        mirror = self.get_mirror(url, login, name)
+        repo = git.Repo.clone_from(mirror, repo_path, shared=True)
+        self._checkouts[repo_path] = mirror
+        return repo
+
+    def release(self, repo_path):
+        """Marks a working copy from :meth:`checkout` as no longer
+        used, so its mirror can be evicted.
+
+        Args:
+            repo_path (str): The path of the working copy.
+        """
+        self._checkouts.pop(repo_path, None)
+
+    def get_mirror(self, url, login, name):
+        """Returns the path to an up to date mirror of a repository.
+
+        Cached mirrors are fetched to update them. If there is no
+        mirror, or the fetch fails, a new mirror is cloned.
+
+        Args:
+            url (str): The url to clone the repository from.
+            login (str): The login of the repository owner.
+            name (str): The name of the repository.
+
+        Returns:
+            str: The path to the mirror.
+
+        Raises:
+            git.GitError: If the repository cannot be cloned.
+        """
+        path = self.mirror_path(login, name)
+        if os.path.isdir(path):
+            try:
+                repo = git.Repo(path)
+                self._fetch_branches(repo)
+                repo.git.remote('update', '--prune')
+                os.utime(path)
+                self.hits += 1
+                self._update_size(path)
+                return path
+
+            except git.GitError as error:
+                print("Mirror update failed:", error)
+                shutil.rmtree(path, ignore_errors=True)
+
+        self.misses += 1
+        self._fetch_branches(git.Repo.clone_from(url, path, bare=True))
+        self._update_size(path)
+        self.evict(keep=path)
+        return path
+
+    def evict(self, keep=None):
+        """Removes the least recently used mirrors until the cache is
+        no larger than max_size.
+
+        Mirrors with working copies that have not been released are
+        kept.
+
+        Args:
+            keep (str): The path of a mirror that should not be removed.
+        """
+        sizes = self._get_sizes()
+        total = sum(sizes.values())
+        by_use = sorted(sizes, key=os.path.getmtime)
+        in_use = set(self._checkouts.values())
+
+        for path in by_use:
+            if total <= self.max_size:
+                break
+            if path == keep or path in in_use:
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            total -= sizes.pop(path)
+
+    def disk_usage(self):
+        """Returns the total size of the cached mirrors in bytes."""
+        return sum(self._get_sizes().values())
+
+    def report(self, write=print):
+        """Writes the hit rate and disk usage of the cache.
+
+        Args:
+            write (func): A function to write the report with. Default
+                is print.
+        """
+        checkouts = self.hits + self.misses
+        rate = (self.hits / checkouts) * 100 if checkouts else 0
+        write("Repo cache hits/checkouts: {}/{} {:.0f}%".format(
+            self.hits, checkouts, rate))
+        write("Repo cache size: {:.1f}MB of {:.1f}MB".format(
+            self.disk_usage() / 2**20, self.max_size / 2**20))
+
+    def _get_sizes(self):
+        """Returns a dict of mirror paths and their sizes in bytes.
+
+        The cache directory is only scanned the first time it is
+        needed.
+        """
+        if self._sizes is None:
+            self._sizes = {}
+            with os.scandir(self.cache_dir) as owners:
+                for owner in owners:
+                    if not owner.is_dir():
+                        continue
+                    with os.scandir(owner.path) as mirrors:
+                        for mirror in mirrors:
+                            if mirror.is_dir():
+                                self._sizes[mirror.path] = dir_size(
+                                    mirror.path)
+        return self._sizes
+
+    def _update_size(self, path):
+        """Records the current size of a mirror."""
+        self._get_sizes()[path] = dir_size(path)
+
+    @staticmethod
+    def _fetch_branches(repo):
+        """Sets a mirror to fetch only the branches of its remote.
+
+        A bare clone has no fetch refspec, so updates would not fetch
+        anything. Mirrors cloned with --mirror fetch every ref.
+        """
+        repo.git.config('remote.origin.fetch', '+refs/heads/*:refs/heads/*')
+
+
+class TempRepoManager:
+    """Manages the temporary directories that projects are cloned into.
+
+    Directories are deleted by a background thread so that removing a
+    large checkout does not hold up the next project. At most backlog
+    directories can be waiting for deletion, after that release blocks
+    until the thread catches up. Before a new directory is handed out
+    the manager waits for pending deletions while the free space on the
+    file system is below min_free.
+
+    Directories are named temp_<pid>_<n>. On start any directories left
+    behind by processes that are no longer running are removed.
+
+    Attributes:
+        base_dir (str): The directory to create temp repos in. Can be
+            placed on a tmpfs to avoid disk writes.
+        backlog (int): The max number of directories waiting to be
+            deleted. If 0 directories are deleted right away.
+        min_free (int): The number of free bytes needed on the file
+            system before a new directory is handed out.
+        deleted (int): The number of directories deleted.
+        wait_time (float): Seconds spent waiting on deletions.
+    """
+
+    def __init__(self, base_dir, backlog=4, min_free=0):
+        self.base_dir = base_dir
+        self.backlog = backlog
+        self.min_free = min_free
+        self.deleted = 0
+        self.wait_time = 0.0
+        self._count = 0
+        self._queue = None
+        self._thread = None
+
+    def start(self, write=print):
+        """Creates the base directory, removes orphaned temp repos and
+        starts the deletion thread.
+
+        Args:
+            write (func): A function to write information with. Default
+                is print.
+        """
+        os.makedirs(self.base_dir, exist_ok=True)
+
+        orphans = self.find_orphans()
+        if orphans:
+            write("Removing {} orphaned temp repos".format(len(orphans)))
+        for path in orphans:
+            shutil.rmtree(path, ignore_errors=True)
+
+        if self.backlog > 0:
+            self._queue = queue.Queue(maxsize=self.backlog)
+            self._thread = threading.Thread(target=self._delete_worker,
+                                            daemon=True)
+            self._thread.start()
+
+    def find_orphans(self):
+        """Returns the paths of temp repos that were left behind by
+        processes that are no longer running."""
+        orphans = []
+        with os.scandir(self.base_dir) as it:
+            for entry in it:
+                if not entry.is_dir() or not entry.name.startswith('temp_'):
+                    continue
+                parts = entry.name.split('_')
+                # temp_<n> dirs are from before pids were added
+                if len(parts) == 2:
+                    orphans.append(entry.path)
+                elif parts[1].isdigit() and not pid_running(int(parts[1])):
+                    orphans.append(entry.path)
+        return orphans
+
+    def new_path(self):
+        """Returns the path for a new temp repo.
+
+        Blocks while deletions are pending and there is less than
+        min_free space available.
+        """
+        start = time.time()
+        while (self._queue is not None and self._queue.unfinished_tasks
+               and shutil.disk_usage(self.base_dir).free < self.min_free):
+            time.sleep(0.5)
+        self.wait_time += time.time() - start
+
+        while True:
+            self._count += 1
+            path = os.path.join(self.base_dir, "temp_{}_{}".format(
+                os.getpid(), self._count))
+            if not os.path.exists(path):
+                return path
+
+    def release(self, path):
+        """Schedules a temp repo for deletion.
+
+        Blocks if backlog directories are already waiting.
+
+        Args:
+            path (str): The path of the temp repo.
+        """
+        if self._queue is None:
+            self._delete(path)
+            return
+
+        start = time.time()
+        self._queue.put(path)
+        self.wait_time += time.time() - start
+
+    def close(self, write=print):
+        """Waits for all pending deletions and stops the deletion thread.
+
+        Args:
+            write (func): A function to write information with. Default
+                is print.
+        """
+        if self._queue is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._queue = None
+            self._thread = None
+
+        write("Temp repos deleted: {}, Waited on deletion: {}".format(
+            self.deleted, common.find_time(self.wait_time)))
+
+    def _delete_worker(self):
+        """Deletes queued directories until None is received."""
+        while True:
+            path = self._queue.get()
+            try:
+                if path is None:
+                    return
+                self._delete(path)
+            finally:
+                self._queue.task_done()
+
+    def _delete(self, path):
+        """Deletes a directory, ignoring errors."""
+        shutil.rmtree(path, ignore_errors=True)
+        self.deleted += 1
+
+
 class SingleAuthorFilter:
     """Helper class to collect file paths for all the single author files
     in a repo.
@@ -678,9 +1937,7 @@ class SingleAuthorFilter:
         Returns:
             bool: True if the filename is valid, otherwise False.
         """
-        if filename in self.validation.exclude_files:
-            return False
-        return has_extensions(filename, self.validation.extensions)
+        return is_candidate_path(filename, self.validation)
 
     def is_excluded_dir(self, dirname):
         """Checks if a directory name is not in the list of excluded
@@ -738,6 +1995,22 @@ def authenticated_session(name=None, passwd=None):
     return common.requests_session(name, passwd, prompt)
 
 
+def api_reset_time(session_time, padding):
+    """Returns the timestamp when the git api rate limit resets.
+
+    Args:
+        session_time (int): The timestamp of the time the api was last
+            reset, or when the program started.
+        padding (int): Extra time to add to make sure it is not too
+            early.
+    """
+    now = time.time()
+    elapsed = now - session_time
+    if elapsed > 3600:
+        elapsed = elapsed % 3600
+    return now + 3600 - elapsed + padding
+
+
 def wait_for_api(session_time, padding, write=print):
     """Sleeps a program until the git api rate limit resets.
 
@@ -750,10 +2023,8 @@ def wait_for_api(session_time, padding, write=print):
             is print.
     """
     now = time.time()
-    elapsed = now - session_time
-    if elapsed > 3600:
-        elapsed = elapsed % 3600
-    sleep_seconds = 3600 - elapsed + padding
+    sleep_seconds = api_reset_time(session_time, padding) - now
+    elapsed = 3600 + padding - sleep_seconds
 
     sleep_time = common.find_time(sleep_seconds)
 
@@ -827,6 +2098,98 @@ def has_extensions(filename, extensions):
     return False
 
 
+def is_candidate_path(path, validation):
+    """Checks if a file path has the right extension and is not an
+    excluded file or inside an excluded directory.
+
+    Args:
+        path (str): A file path relative to the repository root.
+        validation (ValidationData): Information to determine if a file
+            is of the right type and not to be excluded.
+
+    Returns:
+        bool: True if the path is valid, otherwise False.
+    """
+    parts = path.split('/')
+    if parts[-1] in validation.exclude_files:
+        return False
+    for dirname in parts[:-1]:
+        if dirname in validation.exclude_dirs:
+            return False
+    return has_extensions(parts[-1], validation.extensions)
+
+
+def is_binary(data):
+    """Returns True if the start of some raw file contents contains a
+    NUL byte, which text source files never do."""
+    return b'\0' in data[:BINARY_SNIFF_SIZE]
+
+
+def count_lines(data):
+    """Counts the lines in raw file contents without decoding them.
+
+    Counts the same lines as reading the file in text mode and counting
+    newlines, so '\\r\\n' and a lone '\\r' are each one line.
+
+    Args:
+        data (bytes): The contents of a file.
+
+    Returns:
+        int: The number of lines.
+    """
+    lines = data.count(b'\n')
+    if b'\r' in data:
+        lines += data.count(b'\r') - data.count(b'\r\n')
+    return lines
+
+
+def decode_source(data):
+    """Decodes raw file contents and normalises '\\r\\n' and lone '\\r'
+    line endings to '\\n', so a file is stored the same way however it
+    was fetched.
+
+    Raises:
+        UnicodeDecodeError: If the contents are not UTF-8.
+    """
+    return data.decode().replace('\r\n', '\n').replace('\r', '\n')
+
+
+def in_line_range(line_count):
+    """Returns True if a line count is in [MIN_LINES, MAX_LINES]."""
+    return MIN_LINES <= line_count <= MAX_LINES
+
+
+def pid_running(pid):
+    """Returns True if a process with the given pid may be running.
+
+    On Windows there is no safe way to check so it always returns True
+    for pids other than the current process.
+    """
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def dir_size(path):
+    """Returns the total size in bytes of all files in a directory."""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, filename))
+            except OSError:
+                pass
+    return total
+
+
 def get_fullname(login, request_session, session_time):
     """Get a fullname for a github user login.
 
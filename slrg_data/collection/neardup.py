@@ -0,0 +1,274 @@
+"""Near duplicate detection for source code samples with MinHash and
+locality sensitive hashing (LSH).
+
+Each sample is split into tokens and every run of shingle tokens is
+hashed. The MinHash signature of a sample is the minimum of num_perm
+random hash functions over its shingles, computed for many samples at
+once with NumPy. Two samples agree on a signature value with a
+probability equal to the Jaccard similarity of their shingles.
+
+Signatures are split into bands. Samples that match on all of the
+values in any band are candidates, and candidates whose estimated
+similarity is at least the threshold are near duplicates. The
+signatures and band buckets are kept in a SQLite file, so the index
+persists between runs and does not need to fit in memory.
+
+Requires NumPy. Install it with ``pip install slrg_data[neardup]``.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import zlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# Constants ############################################################
+
+# Splits source into identifiers, numbers and single symbols
+TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+
+# Multiplier used to combine token hashes into shingle hashes
+SHINGLE_PRIME = 1099511628211
+
+# Number of hash functions computed at a time. Bounds the memory for a
+# batch to about 8 * block bytes per shingle.
+PERM_BLOCK = 16
+
+
+# Classes ##############################################################
+
+class NearDupIndex:
+    """A MinHash LSH index of samples stored in a SQLite file.
+
+    Attributes:
+        path (str): The SQLite file for the index.
+        num_perm (int): The number of hash functions in a signature.
+        bands (int): The number of LSH bands. Must divide num_perm.
+            More bands find less similar candidates.
+        threshold (float): The min estimated Jaccard similarity for a
+            near duplicate.
+        shingle (int): The number of tokens in a shingle.
+        batch_size (int): The number of samples to add before they are
+            committed to the file.
+    """
+
+    def __init__(self, path, num_perm=128, bands=16, threshold=0.8,
+                 shingle=5, seed=1, batch_size=500):
+        if np is None:
+            raise ImportError("Near duplicate detection needs numpy. "
+                              "Install it with: pip install numpy")
+        if num_perm % bands:
+            raise ValueError("bands must divide num_perm")
+
+        self.path = path
+        self.num_perm = num_perm
+        self.bands = bands
+        self.threshold = threshold
+        self.shingle = shingle
+        self.batch_size = batch_size
+        self._rows = num_perm // bands
+        self._pending = 0
+
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(0, 2**64, num_perm, dtype=np.uint64,
+                               endpoint=False) | np.uint64(1)
+        self._b = rng.integers(0, 2**64, num_perm, dtype=np.uint64,
+                               endpoint=False)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = sqlite3.connect(path)
+        self._db.execute("PRAGMA journal_mode=WAL;")
+        self._db.execute("CREATE TABLE IF NOT EXISTS samples "
+                         "(id INTEGER PRIMARY KEY, key TEXT, sig BLOB);")
+        self._db.execute("CREATE TABLE IF NOT EXISTS buckets "
+                         "(band INTEGER, hash INTEGER, id INTEGER);")
+        self._db.execute("CREATE INDEX IF NOT EXISTS ix_buckets "
+                         "ON buckets (band, hash);")
+
+    def signatures(self, sources):
+        """Computes the MinHash signatures of some samples.
+
+        Args:
+            sources (list of str): The source code of each sample.
+
+        Returns:
+            numpy.ndarray: A (len(sources), num_perm) array of uint32.
+            Samples with no tokens get all 0xffffffff and never match.
+        """
+        hashes = [self.shingles(source) for source in sources]
+        sizes = np.array([len(h) for h in hashes], dtype=np.int64)
+        sigs = np.full((len(sources), self.num_perm), 0xffffffff,
+                       dtype=np.uint32)
+
+        found = sizes > 0
+        if not found.any():
+            return sigs
+
+        values = np.concatenate([h for h in hashes if len(h)])
+        offsets = np.zeros(int(found.sum()), dtype=np.int64)
+        offsets[1:] = np.cumsum(sizes[found])[:-1]
+
+        shift = np.uint64(32)
+        for start in range(0, self.num_perm, PERM_BLOCK):
+            a = self._a[start:start + PERM_BLOCK]
+            b = self._b[start:start + PERM_BLOCK]
+            # Multiply-shift hashing. Overflow wraps around mod 2**64
+            perm = ((values[:, None] * a[None, :] + b[None, :])
+                    >> shift).astype(np.uint32)
+            sigs[found, start:start + PERM_BLOCK] = np.minimum.reduceat(
+                perm, offsets, axis=0)
+        return sigs
+
+    def shingles(self, source):
+        """Returns the hashes of every run of shingle tokens in the
+        source as a uint64 array. Sources with fewer tokens than a
+        shingle get one hash for all of their tokens."""
+        tokens = TOKEN_RE.findall(source)
+        if not tokens:
+            return np.zeros(0, dtype=np.uint64)
+
+        ids = np.fromiter((zlib.crc32(t.encode('utf-8', 'replace'))
+                           for t in tokens), dtype=np.uint64,
+                          count=len(tokens))
+        width = min(self.shingle, len(ids))
+        count = len(ids) - width + 1
+        prime = np.uint64(SHINGLE_PRIME)
+        hashes = np.zeros(count, dtype=np.uint64)
+        for i in range(width):
+            hashes = hashes * prime + ids[i:i + count]
+        return np.unique(hashes)
+
+    def query(self, signature):
+        """Finds the samples in the index that are near duplicates of a
+        signature.
+
+        Args:
+            signature (numpy.ndarray): A signature from
+                :meth:`signatures`.
+
+        Returns:
+            list of tuple: (key, estimated similarity) for each near
+            duplicate, most similar first.
+        """
+        candidates = set()
+        for band, bucket in enumerate(self._buckets(signature)):
+            candidates.update(row[0] for row in self._db.execute(
+                "SELECT id FROM buckets WHERE band=? AND hash=?;",
+                [band, bucket]))
+
+        matches = []
+        for sample_id in candidates:
+            key, sig = self._db.execute(
+                "SELECT key, sig FROM samples WHERE id=?;",
+                [sample_id]).fetchone()
+            other = np.frombuffer(sig, dtype=np.uint32)
+            similarity = float(np.mean(other == signature))
+            if similarity >= self.threshold:
+                matches.append((key, similarity))
+        return sorted(matches, key=lambda m: m[1], reverse=True)
+
+    def add(self, key, signature):
+        """Adds a sample's signature to the index. It is committed with
+        the rest of its batch.
+
+        Args:
+            key (str): The key reported when the sample matches.
+            signature (numpy.ndarray): A signature from
+                :meth:`signatures`.
+        """
+        if np.all(signature == 0xffffffff):
+            return
+        cursor = self._db.execute(
+            "INSERT INTO samples (key, sig) VALUES (?, ?);",
+            [key, signature.astype(np.uint32).tobytes()])
+        sample_id = cursor.lastrowid
+        self._db.executemany(
+            "INSERT INTO buckets (band, hash, id) VALUES (?, ?, ?);",
+            [(band, bucket, sample_id)
+             for band, bucket in enumerate(self._buckets(signature))])
+
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self.commit()
+
+    def find(self, source):
+        """Finds near duplicates of a sample without adding it.
+
+        Args:
+            source (str): The source code of the sample.
+
+        Returns:
+            (list, numpy.ndarray): The matches, see :meth:`check`, and
+            the sample's signature to pass to :meth:`add` later.
+        """
+        signature = self.signatures([source])[0]
+        return self.query(signature), signature
+
+    def check(self, key, source):
+        """Finds near duplicates of a sample and adds it to the index if
+        there are none.
+
+        Args:
+            key (str): The key of the sample.
+            source (str): The source code of the sample.
+
+        Returns:
+            list of tuple: (key, similarity) of the near duplicates.
+            Empty if the sample is new.
+        """
+        matches, signature = self.find(source)
+        if not matches:
+            self.add(key, signature)
+        return matches
+
+    def check_many(self, keys, sources):
+        """Checks a batch of samples in order. Signatures are computed
+        for the whole batch at once. Samples that are near duplicates of
+        earlier samples in the batch are found too.
+
+        Args:
+            keys (list of str): The key of each sample.
+            sources (list of str): The source code of each sample.
+
+        Returns:
+            list: The matches for each sample. See :meth:`check`.
+        """
+        results = []
+        for key, signature in zip(keys, self.signatures(sources)):
+            matches = self.query(signature)
+            if not matches:
+                self.add(key, signature)
+            results.append(matches)
+        self.commit()
+        return results
+
+    def count(self):
+        """Returns the number of samples in the index."""
+        return self._db.execute("SELECT COUNT(*) FROM samples;").fetchone()[0]
+
+    def commit(self):
+        """Writes added samples to the file."""
+        self._db.commit()
+        self._pending = 0
+
+    def close(self):
+        """Commits and closes the index file."""
+        self._db.commit()
+        self._db.close()
+
+    def _buckets(self, signature):
+        """Yields a 63 bit hash of each band of a signature."""
+        rows = self._rows
+        sig = np.ascontiguousarray(signature, dtype=np.uint32)
+        for band in range(self.bands):
+            digest = hashlib.blake2b(
+                sig[band * rows:(band + 1) * rows].tobytes(),
+                digest_size=8).digest()
+            yield int.from_bytes(digest, 'little') >> 1
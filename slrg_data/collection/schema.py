@@ -0,0 +1,348 @@
+"""Table schemas for the collection tables and helpers to create and
+check them in the database.
+
+The column types and keys match the table creation SQL in the database
+documentation. The unique keys are what the collectors rely on to
+reject duplicate samples, and the other keys are for the lookups they
+make while collecting.
+"""
+import datetime
+
+from . import features
+
+
+# Constants ############################################################
+
+_USER_TYPES = {
+    'user_id': 'INT',
+    'user_login': 'TINYTEXT',
+    'user_fullname': 'TINYTEXT',
+    'gender': 'VARCHAR(30)',
+    'gender_probability': 'FLOAT',
+    'user_company': 'TINYTEXT',
+    'user_created': 'TINYTEXT',
+    'user_type': 'TINYTEXT',
+    'user_country_code': 'TINYTEXT',
+    'user_state': 'TINYTEXT',
+    'user_city': 'TINYTEXT',
+    'user_location': 'TINYTEXT',
+    'project_id': 'INT NOT NULL',
+    'project_url': 'TEXT',
+    'project_name': 'TINYTEXT',
+    'project_language': 'TINYTEXT',
+    'project_created': 'TINYTEXT',
+}
+
+# Column types for each kind of table. Feature columns get their type
+# from features.FEATURES. Other columns that are not here are made TEXT.
+COLUMN_TYPES = {
+    'git_projects': dict(_USER_TYPES, **{
+        'file_hash': 'VARCHAR(255) NOT NULL',
+        'file_name': 'TINYTEXT',
+        'file_contents': 'MEDIUMTEXT',
+        'file_lines': 'INT',
+        'content_hash': 'CHAR(32)',
+    }),
+    'git_commits': dict(_USER_TYPES, **{
+        'commit_id': 'INT',
+        'commit_sha': 'TINYTEXT',
+        'commit_created': 'TINYTEXT',
+        'file_sha': 'VARCHAR(200) NOT NULL',
+        'file_name': 'TINYTEXT',
+        'file_contents': 'MEDIUMTEXT',
+        'file_changes': 'INT',
+        'content_hash': 'CHAR(32)',
+    }),
+    'codeforces': {
+        'submission_id': 'INT NOT NULL',
+        'source_code': 'MEDIUMTEXT NOT NULL',
+        'programming_language': 'VARCHAR(50) NOT NULL',
+        'problem_name': 'VARCHAR(255) NOT NULL',
+        'difficulty': 'INT',
+        'participant_type': 'TINYTEXT',
+        'time': 'TINYTEXT',
+        'year': 'SMALLINT',
+        'month': 'SMALLINT',
+        'day': 'SMALLINT',
+        'handle': 'VARCHAR(255) NOT NULL',
+        'first_name': 'TINYTEXT NOT NULL',
+        'last_name': 'TINYTEXT',
+        'gender': 'VARCHAR(30) NOT NULL',
+        'gender_probability': 'FLOAT',
+        'country': 'TINYTEXT NOT NULL',
+        'city': 'TINYTEXT',
+        'organization': 'TINYTEXT',
+        'contribution': 'INT',
+        'user_rank': 'TINYTEXT NOT NULL',
+        'rating': 'INT NOT NULL',
+        'max_rank': 'TINYTEXT',
+        'max_rating': 'INT',
+        'registered': 'TINYTEXT',
+        'content_hash': 'CHAR(32)',
+    },
+    'gender': {
+        'name': 'VARCHAR(255)',
+        'gender': 'VARCHAR(30)',
+        'probability': 'FLOAT',
+    }
+}
+
+# The columns of the gender table. It is not in config.tables.
+GENDER_COLUMNS = ['name', 'gender', 'probability']
+
+# Keys for each kind of table. 'primary' is None for an auto increment
+# id. 'unique' keys reject duplicate samples, including the same content
+# in different samples. 'index' keys are for the lookups made during
+# collection.
+KEYS = {
+    'git_projects': {
+        'primary': None,
+        'unique': [['project_id', 'file_hash'], ['content_hash']],
+        'index': []
+    },
+    'git_commits': {
+        'primary': None,
+        'unique': [['project_id', 'file_sha'], ['content_hash']],
+        'index': []
+    },
+    'codeforces': {
+        'primary': ['submission_id'],
+        # Also serves previously_collected (WHERE handle=)
+        'unique': [['handle', 'problem_name'], ['content_hash']],
+        'index': []
+    },
+    'gender': {
+        'primary': None,
+        # Serves get_gender_from_database (WHERE name=)
+        'unique': [['name']],
+        'index': []
+    }
+}
+
+# Queries the collectors make often, checked with EXPLAIN to make sure
+# they use a key.
+HOT_QUERIES = {
+    'git_projects': "SELECT id FROM {} WHERE project_id=0 AND file_hash=''",
+    'git_commits': "SELECT id FROM {} WHERE project_id=0 AND file_sha=''",
+    'codeforces': "SELECT problem_name FROM {} WHERE handle=''",
+    'gender': "SELECT gender, probability FROM {} WHERE name=''"
+}
+
+# Columns tables can be partitioned by
+PARTITIONS = {
+    'year': 'year',
+    'language': 'programming_language'
+}
+
+
+# Functions ############################################################
+
+def get_tables(config):
+    """Returns the kind, name and columns of every table in the config.
+
+    Args:
+        config (dict): The contents of the config file in a dict.
+
+    Returns:
+        list of tuple: (kind, table name, columns) for each table.
+    """
+    tables = []
+    for kind, info in config['tables'].items():
+        if kind == 'gender':
+            tables.append((kind, info, GENDER_COLUMNS))
+        elif 'name' in info:
+            tables.append((kind, info['name'], table_columns(config, kind)))
+        else:
+            for lang, name in info.items():
+                if lang != 'columns':
+                    tables.append((kind, name, table_columns(config, kind)))
+    return tables
+
+
+def table_columns(config, kind):
+    """Returns the columns samples are inserted into for a kind of
+    table. content_hash is added after the configured columns if it is
+    enabled."""
+    columns = list(config['tables'][kind]['columns'])
+    if config['content_hash']['enabled']:
+        columns.append('content_hash')
+    return columns
+
+
+def get_keys(kind, partition=None, columns=None):
+    """Returns the keys for a kind of table.
+
+    MySQL needs the partition column in every unique key, so it is added
+    to them when the table is partitioned.
+
+    Args:
+        kind (str): The kind of table. ie) git_projects.
+        partition (str): The partition column or None.
+        columns (list): The table's columns. Unique keys on other
+            columns, like content_hash when it is not enabled, are left
+            out. Default is to keep every key.
+
+    Returns:
+        dict: The 'primary', 'unique' and 'index' keys.
+    """
+    keys = KEYS[kind]
+    primary = keys['primary']
+    unique = [list(key) for key in keys['unique']
+              if columns is None or set(key) <= set(columns)]
+    if partition is not None:
+        if primary is not None and partition not in primary:
+            primary = primary + [partition]
+        for key in unique:
+            if partition not in key:
+                key.append(partition)
+    return {'primary': primary, 'unique': unique, 'index': keys['index']}
+
+
+def column_type(kind, name, binary=()):
+    """Returns the type of a column. Text columns in binary are made the
+    same size of BLOB to hold compressed values."""
+    col_type = COLUMN_TYPES[kind].get(name,
+                                      features.FEATURES.get(name, 'TEXT'))
+    if name in binary:
+        col_type = col_type.replace('TEXT', 'BLOB')
+    return col_type
+
+
+def create_table_sql(kind, table, columns, partition=None, binary=(),
+                     indexed=()):
+    """Creates the SQL to create a table.
+
+    Args:
+        kind (str): The kind of table. ie) git_projects.
+        table (str): The name of the table.
+        columns (list): The column names.
+        partition (str): 'year' or 'language' to partition the table on
+            that column. Default is None.
+        binary (list): Columns to make binary for compressed values.
+        indexed (list): Extra columns to index on their own, like the
+            feature columns.
+
+    Returns:
+        str: A CREATE TABLE statement.
+
+    Raises:
+        ValueError: If the table does not have the partition column.
+    """
+    column = None
+    if partition is not None:
+        column = PARTITIONS[partition]
+        if column not in columns:
+            raise ValueError("{} has no {} column to partition by".format(
+                table, column))
+
+    keys = get_keys(kind, column, columns)
+    defs = []
+    if keys['primary'] is None:
+        defs.append("id INT NOT NULL AUTO_INCREMENT")
+    for name in columns:
+        defs.append("{} {}".format(name, column_type(kind, name, binary)))
+
+    if keys['primary'] is None:
+        primary = ['id'] + ([column] if column else [])
+    else:
+        primary = keys['primary']
+    defs.append("PRIMARY KEY ({})".format(", ".join(primary)))
+    for key in keys['unique']:
+        defs.append("UNIQUE KEY {} ({})".format(key_name('uq', key),
+                                               ", ".join(key)))
+    for key in keys['index'] + [[name] for name in indexed]:
+        defs.append("KEY {} ({})".format(key_name('ix', key), ", ".join(key)))
+
+    sql = ("CREATE TABLE IF NOT EXISTS {} (\n    {})\n"
+           "CHARACTER SET utf8mb4\nCOLLATE utf8mb4_unicode_ci").format(
+               table, ",\n    ".join(defs))
+    if partition == 'year':
+        sql += "\n" + year_partitions()
+    elif partition == 'language':
+        sql += "\nPARTITION BY KEY ({}) PARTITIONS 8".format(column)
+    return sql + ";"
+
+
+def year_partitions(first=2010, last=None):
+    """Returns a PARTITION BY RANGE clause with one partition per year.
+
+    Args:
+        first (int): The first year with its own partition.
+        last (int): The last year with its own partition. Default is
+            next year.
+    """
+    if last is None:
+        last = datetime.date.today().year + 1
+    parts = ["PARTITION p{0} VALUES LESS THAN ({1})".format(year, year + 1)
+             for year in range(first, last + 1)]
+    parts.insert(0, "PARTITION p_old VALUES LESS THAN ({})".format(first))
+    parts.append("PARTITION p_max VALUES LESS THAN MAXVALUE")
+    return "PARTITION BY RANGE (year) (\n    {})".format(",\n    ".join(parts))
+
+
+def key_name(prefix, columns):
+    """Returns the name for a key on some columns."""
+    return "{}_{}".format(prefix, "_".join(columns))[:64]
+
+
+def check_table(database, kind, table, columns, binary=(), indexed=()):
+    """Checks an existing table against its schema.
+
+    Args:
+        database (Database): A connected database.
+        kind (str): The kind of table. ie) git_projects.
+        table (str): The name of the table.
+        columns (list): The columns the collector inserts into.
+        binary (list): Columns that must be binary to hold compressed
+            values.
+        indexed (list): Extra columns that must be indexed.
+
+    Returns:
+        list of str: The problems found. Empty if there are none.
+    """
+    problems = []
+    existing = dict(database.execute(
+        "SELECT COLUMN_NAME, DATA_TYPE FROM information_schema.COLUMNS "
+        "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s;", [table]))
+    for name in columns:
+        if name not in existing:
+            problems.append("missing column {}, add it with: ALTER TABLE {} "
+                            "ADD COLUMN {} {};".format(
+                                name, table, name,
+                                column_type(kind, name, binary)))
+        elif name in binary and 'blob' not in existing[name].lower():
+            problems.append("column {} is {}, not a BLOB for compressed "
+                            "values".format(name, existing[name]))
+
+    indexes = {}
+    for name, _, column in database.execute(
+            "SELECT INDEX_NAME, SEQ_IN_INDEX, COLUMN_NAME "
+            "FROM information_schema.STATISTICS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s "
+            "ORDER BY INDEX_NAME, SEQ_IN_INDEX;", [table]):
+        indexes.setdefault(name, []).append(column)
+
+    keys = get_keys(kind, columns=columns)
+    wanted = (keys['unique'] + list(keys['index'])
+              + [[name] for name in indexed])
+    if keys['primary'] is not None:
+        wanted.insert(0, keys['primary'])
+    for key in wanted:
+        # A partitioned table may have the partition column at the end
+        if not any(cols[:len(key)] == key for cols in indexes.values()):
+            problem = "missing key ({})".format(", ".join(key))
+            if key in keys['unique']:
+                problem += ", add it with: ALTER TABLE {} ADD UNIQUE KEY " \
+                    "{} ({});".format(table, key_name('uq', key),
+                                      ", ".join(key))
+            problems.append(problem)
+
+    # A lookup of a missing value on a unique key is answered from the
+    # key before the query runs, so EXPLAIN shows no key but says so in
+    # the Extra column.
+    for row in database.execute("EXPLAIN " + HOT_QUERIES[kind].format(table)):
+        key, extra = row[6], row[-1] or ''
+        if key is None and 'const table' not in extra:
+            problems.append("hot query does not use a key: "
+                            + HOT_QUERIES[kind].format(table))
+    return problems
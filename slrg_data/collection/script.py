@@ -6,6 +6,8 @@ import os
 from . import common
 from . import github
 from . import codeforces
+from . import features
+from . import schema
 
 
 # Make Database ########################################################
@@ -19,8 +21,8 @@ def make_database(db_config, host=None, login=None, passwd=None, name=None):
     the user will be prompted to input a value.
 
     Args:
-        db_config (dict): A dictionary with database information. See
-            slrg_data_collection.config.py
+        db_config (dict): A dictionary with database information and
+            connection pool settings. See slrg_data_collection.config.py
         host (str): The database hostname.
         login (str): The database username.
         passwd (str): The database password.
@@ -34,7 +36,170 @@ def make_database(db_config, host=None, login=None, passwd=None, name=None):
     login = null_arg_str(login, db_config['login'])
     passwd = null_arg_str(passwd, db_config['passwd'])
 
-    return common.Database(host, login, name, passwd)
+    return common.Database(host, login, name, passwd,
+                           pool_size=db_config['pool_size'],
+                           retries=db_config['retries'],
+                           backoff=db_config['backoff'],
+                           max_backoff=db_config['max_backoff'])
+
+
+def make_storage(database, script_name, collection_info, config):
+    """Chooses where collected samples are stored.
+
+    With the 'sqlite' backend a
+    :class:`~slrg_data.collection.common.SqliteDatabase` is made and
+    the collection and gender tables are created in it with the same
+    unique keys as the MySQL tables, so duplicates are rejected the
+    same way. If 'seed_genders' is set the local gender table is seeded
+    from the MySQL one. See :func:`seed_gender_table`. Otherwise the
+    MySQL database is used.
+
+    Args:
+        database (Database): The MySQL database.
+        script_name (str): The name of the script calling it. Names the
+            default SQLite file.
+        collection_info (CollectionInfo): The collection the samples
+            come from.
+        config (dict): The contents of the config file in a dict. See
+            :ref:`Configuration <config_lab>` for more details.
+
+    Returns:
+        Database or SqliteDatabase: The database to store samples in.
+
+    Raises:
+        ScriptInputError: If the backend is unknown.
+    """
+    storage = config['storage']
+    if storage['backend'] == 'mysql':
+        return database
+    if storage['backend'] != 'sqlite':
+        raise ScriptInputError(
+            "Input Error: Unknown storage backend: " + storage['backend'])
+
+    path = storage['path']
+    if path is None:
+        path = os.path.join(common.SLRG_DIR, 'sqlite', script_name + '.db')
+
+    local = common.SqliteDatabase(path, storage['batch_size'])
+    local.connect()
+    for table in collection_info.get_tables():
+        columns = collection_info.sample_columns(table)
+        local.create_table(table.name, columns,
+                           unique=_unique_keys(script_name, columns))
+    local.create_table(config['tables']['gender'],
+                       ['name', 'gender', 'probability'],
+                       unique=_unique_keys('gender', schema.GENDER_COLUMNS))
+    if storage['seed_genders']:
+        seed_gender_table(database, local, config['tables']['gender'])
+    return local
+
+
+def seed_gender_table(database, local, table):
+    """Copies the names in the MySQL gender table that are not in the
+    local one.
+
+    Gender lookups only read the local table, so without this every
+    name would be looked up with the genderize.io API again. If MySQL
+    can't be reached a warning is printed and nothing is copied.
+
+    Args:
+        database (Database): The MySQL database.
+        local (SqliteDatabase): The local database.
+        table (str): The name of the gender table in both.
+    """
+    known = set(row[0] for row in local.stream(['name'], table))
+    added = 0
+    try:
+        database.connect()
+        for row in database.stream(schema.GENDER_COLUMNS, table):
+            if row[0] not in known:
+                local.insert(schema.GENDER_COLUMNS, table, row)
+                added += 1
+    except (common.DatabaseError, ScriptInputError) as error:
+        print("*** Warning: Could not seed genders from the database:",
+              error)
+    local.commit()
+    print("Seeded {} genders from the database".format(added))
+
+
+def make_bulk_loader(database, bulk_config, collection_info):
+    """Wraps a database in a :class:`~slrg_data.collection.common.BulkLoader`
+    if bulk loading is enabled.
+
+    Only inserts into the collection tables are staged. Other tables,
+    like the gender table, are still inserted into right away.
+
+    Args:
+        database (Database): The database to load into.
+        bulk_config (dict): A dict with 'enabled', 'dir', 'chunk_rows'
+            and 'duplicates' keys. If 'dir' is None the files are
+            staged in the slrg directory.
+        collection_info (CollectionInfo): The collection the samples
+            come from.
+
+    Returns:
+        BulkLoader: The bulk loader, or the database if bulk loading is
+        not enabled or the database is not MySQL.
+    """
+    if not bulk_config['enabled'] or not isinstance(database,
+                                                    common.Database):
+        return database
+
+    stage_dir = bulk_config['dir']
+    if stage_dir is None:
+        stage_dir = os.path.join(common.SLRG_DIR, 'bulk')
+
+    tables = [table.name for table in collection_info.get_tables()]
+    return common.BulkLoader(database, stage_dir, tables,
+                             bulk_config['chunk_rows'],
+                             bulk_config['duplicates'])
+
+
+# Make Repo Cache ######################################################
+
+def make_repo_cache(cache_config):
+    """Creates a :class:`~slrg_data.collection.github.RepoCache` for
+    cloning GitHub projects.
+
+    Args:
+        cache_config (dict): A dict with 'enabled', 'dir' and 'max_size'
+            keys. If 'dir' is None the cache is stored in the slrg
+            directory.
+
+    Returns:
+        RepoCache: The repository cache, or None if it is not enabled.
+    """
+    if not cache_config['enabled']:
+        return None
+
+    cache_dir = cache_config['dir']
+    if cache_dir is None:
+        cache_dir = os.path.join(common.SLRG_DIR, 'git', 'repo_cache')
+
+    return github.RepoCache(cache_dir, cache_config['max_size'])
+
+
+def make_temp_repos(temp_config, collection_type='projects'):
+    """Creates a :class:`~slrg_data.collection.github.TempRepoManager`
+    for the directories GitHub projects are cloned into.
+
+    Args:
+        temp_config (dict): A dict with 'dir', 'backlog' and 'min_free'
+            keys. If 'dir' is None the default temp_repos directory in
+            the slrg directory is used.
+        collection_type (str): The kind of collection. projects or
+            commits. Chooses the default directory.
+
+    Returns:
+        TempRepoManager: The temp repo manager.
+    """
+    base_dir = temp_config['dir']
+    if base_dir is None:
+        base_dir = os.path.join(common.SLRG_DIR, 'git', collection_type,
+                                'temp_repos')
+
+    return github.TempRepoManager(base_dir, temp_config['backlog'],
+                                  temp_config['min_free'])
 
 
 # Make Collection Info #################################################
@@ -46,8 +211,13 @@ def make_git_info(lang, filename, git_data, limits, script_name, config):
     If lang or filename are None the user will be asked to input
     values.
 
+    More than one language can be given by separating them with commas
+    (or passing a list). Then files for all of the languages are
+    collected in the same pass and each file is added to the table for
+    its language.
+
     Args:
-        lang (str): The programming language to collect source in.
+        lang (str): The programming language(s) to collect source in.
         filename (str): The file the project data is stored in.
         git_data (github.GitData): Github account data.
         limits (common.LimitData): Limits for the collection.
@@ -58,23 +228,50 @@ def make_git_info(lang, filename, git_data, limits, script_name, config):
     Returns:
         GitCollectionInfo: A CollectionInfo object with
         the necessary information for github source collection.
+
+    Raises:
+        ScriptInputError: If no language is given, or there is no table
+            or extensions for a language in the config.
     """
     if lang is None:
-        lang = input('Language: ')
-    lang = lang.lower()
+        lang = input('Language(s): ')
+    langs = split_languages(lang)
+    if not langs:
+        raise ScriptInputError("Input Error: No language given")
 
     file_path = get_file_path(filename)
     records = common.RecordsData(file_path, config['fields'][script_name])
 
-    table = common.TableData(config['tables'][script_name][lang],
-                             config['tables'][script_name]['columns'])
+    lang_tables = []
+    extensions = []
+    for name in langs:
+        if (name not in config['tables'][script_name]
+                or name not in config['extensions']):
+            raise ScriptInputError("Input Error: Unknown language: " + name)
+
+        table = common.TableData(config['tables'][script_name][name],
+                                 schema.table_columns(config, script_name),
+                                 name)
+        lang_tables.append((config['extensions'][name], table))
+        extensions.extend(config['extensions'][name])
 
-    validation = common.ValidationData(config['extensions'][lang],
+    validation = common.ValidationData(extensions,
                                        config['exclude']['files'],
                                        config['exclude']['dirs'])
 
-    return github.GitCollectionInfo(records, table, validation, limits,
-                                    git_data, lang, config['save_missing'])
+    return github.GitCollectionInfo(records, lang_tables[0][1], validation,
+                                    limits, git_data, "_".join(langs),
+                                    config['save_missing'],
+                                    lang_tables=lang_tables,
+                                    skip=make_skip(config['skip_index']),
+                                    near_dup=make_near_dup(config['near_dup'],
+                                                           script_name),
+                                    compression=make_compression(
+                                        config['compression']),
+                                    features=make_features(
+                                        config['features']),
+                                    content_hash=config['content_hash'][
+                                        'enabled'])
 
 
 def make_cf_info(filename, limits, script_name, config):
@@ -97,12 +294,20 @@ def make_cf_info(filename, limits, script_name, config):
     records = common.RecordsData(file_path, config['fields'][script_name])
 
     table = common.TableData(config['tables'][script_name]['name'],
-                             config['tables'][script_name]['columns'])
+                             schema.table_columns(config, script_name))
 
     validation = common.LanguageData(
         config['cf_languages']['collect'], config['cf_languages']['exclude'])
 
-    return common.CollectionInfo(records, table, validation, limits)
+    return common.CollectionInfo(records, table, validation, limits,
+                                 skip=make_skip(config['skip_index']),
+                                 near_dup=make_near_dup(config['near_dup'],
+                                                        script_name),
+                                 compression=make_compression(
+                                     config['compression']),
+                                 features=make_features(config['features']),
+                                 content_hash=config['content_hash'][
+                                     'enabled'])
 
 
 # Make Info Components #################################################
@@ -158,6 +363,169 @@ def make_cf_limits(start, count, default):
                                   default['max_subs'], default['max_no_source'])
 
 
+def make_commits_limits(start, count, default):
+    """Creates a :class:`~slrg_data.collection.github.CommitsLimitData`
+    object.
+
+    If the start or count are None then the values in the default
+    dict will be used. Default must contain keys for 'start', 'count',
+    'max_commit_files', 'page_workers' and 'page_min_rate'.
+
+    Args:
+        start (int): The index of a starting record.
+        count (int): The maximum number of records to process.
+        default (dict): A dict containing values for all the above
+            required keys.
+
+    Returns:
+        CommitsLimitData: A data object containing all the required
+        limit values for the GitHub commits collection.
+    """
+    start = null_arg_int(start, default['start'], "Starting index: ")
+    count = null_arg_int(count, default['count'], "Entries to process: ")
+
+    return github.CommitsLimitData(start, count, default['max_commit_files'],
+                                   default['page_workers'],
+                                   default['page_min_rate'])
+
+
+def make_projects_limits(start, count, default):
+    """Creates a :class:`~slrg_data.collection.github.ProjectsLimitData`
+    object.
+
+    If the start or count are None then the values in the default
+    dict will be used. Default must contain keys for 'start', 'count',
+    'blob_threshold', 'blob_workers' and 'clone_ahead'.
+
+    Args:
+        start (int): The index of a starting record.
+        count (int): The maximum number of records to process.
+        default (dict): A dict containing values for all the above
+            required keys.
+
+    Returns:
+        ProjectsLimitData: A data object containing all the required
+        limit values for the GitHub projects collection.
+    """
+    start = null_arg_int(start, default['start'], "Starting index: ")
+    count = null_arg_int(count, default['count'], "Entries to process: ")
+
+    return github.ProjectsLimitData(start, count, default['blob_threshold'],
+                                    default['blob_workers'],
+                                    default['clone_ahead'])
+
+
+def make_skip(skip_config):
+    """Creates a :class:`~slrg_data.collection.common.SkipData` object.
+
+    Args:
+        skip_config (dict): A dict with 'enabled', 'error_rate',
+            'max_bytes' and 'extra' keys.
+
+    Returns:
+        SkipData: The skip index information, or None if it is not
+        enabled.
+    """
+    if not skip_config['enabled']:
+        return None
+    return common.SkipData(skip_config['error_rate'], skip_config['max_bytes'],
+                           skip_config['extra'])
+
+
+def make_near_dup(near_config, script_name):
+    """Creates a :class:`~slrg_data.collection.common.NearDupData`
+    object.
+
+    Args:
+        near_config (dict): A dict with 'enabled', 'action', 'dir',
+            'num_perm', 'bands', 'threshold', 'shingle' and 'batch_size'
+            keys. If 'dir' is None the index is kept in the slrg
+            directory.
+        script_name (str): The name of the script. Names the index file.
+
+    Returns:
+        NearDupData: The near duplicate index information, or None if
+        it is not enabled.
+
+    Raises:
+        ScriptInputError: If the action is not 'skip' or 'flag'.
+    """
+    if not near_config['enabled']:
+        return None
+    if near_config['action'] not in ('skip', 'flag'):
+        raise ScriptInputError(
+            "Input Error: Near duplicate action must be skip or flag")
+
+    index_dir = near_config['dir']
+    if index_dir is None:
+        index_dir = os.path.join(common.SLRG_DIR, 'neardup')
+
+    return common.NearDupData(os.path.join(index_dir, script_name + '.db'),
+                              near_config['action'], near_config['num_perm'],
+                              near_config['bands'], near_config['threshold'],
+                              near_config['shingle'],
+                              near_config['batch_size'])
+
+
+def make_compression(comp_config):
+    """Creates a :class:`~slrg_data.collection.common.CompressionData`
+    object.
+
+    Args:
+        comp_config (dict): A dict with 'enabled', 'codec', 'level' and
+            'columns' keys.
+
+    Returns:
+        CompressionData: The compression information, or None if it is
+        not enabled.
+
+    Raises:
+        ScriptInputError: If the codec is not known or not installed.
+    """
+    if not comp_config['enabled']:
+        return None
+
+    codec = comp_config['codec']
+    if codec not in common.CODECS:
+        raise ScriptInputError(
+            "Input Error: Compression codec must be one of "
+            + ", ".join(common.CODECS))
+    if codec == 'zstd' and common.zstandard is None:
+        raise ScriptInputError(
+            "Input Error: The zstd codec needs the zstandard package")
+
+    return common.CompressionData(codec, comp_config['level'],
+                                  comp_config['columns'])
+
+
+def make_features(feature_config):
+    """Creates a :class:`~slrg_data.collection.common.FeatureData`
+    object.
+
+    Args:
+        feature_config (dict): A dict with 'enabled', 'names',
+            'columns' and 'batch_size' keys.
+
+    Returns:
+        FeatureData: The feature information, or None if it is not
+        enabled.
+
+    Raises:
+        ScriptInputError: If a name is not a known feature.
+    """
+    if not feature_config['enabled']:
+        return None
+
+    try:
+        features.check_names(feature_config['names'])
+    except ValueError as err:
+        raise ScriptInputError("Input Error: " + str(err))
+
+    return common.FeatureData(feature_config['names'],
+                              feature_config['columns'],
+                              feature_config['batch_size'])
+
+
 def make_git_data(login, passwd, default):
     """Creates :class:`~slrg_data.collection.github.GithubData` object
     using given information.
@@ -203,6 +571,27 @@ def get_file_path(filename=None):
     raise ScriptInputError("Input Error: No such file: " + file)
 
 
+def split_languages(lang):
+    """Splits a string of comma or space separated languages into a
+    list of lowercase language names.
+
+    Args:
+        lang (str or list of str): One or more language names.
+
+    Returns:
+        list of str: The language names without duplicates.
+    """
+    if isinstance(lang, str):
+        lang = lang.replace(',', ' ').split()
+
+    langs = []
+    for name in lang:
+        name = name.lower()
+        if name not in langs:
+            langs.append(name)
+    return langs
+
+
 def remove_old_logs(log_dir, max_to_keep):
     """Removes old logs until the number of logs is equal to the
     given max.
@@ -249,6 +638,15 @@ def null_arg_int(arg, default, prompt):
     return int(null_arg_str(arg, default, prompt))
 
 
+def _unique_keys(kind, columns):
+    """Returns the primary and unique keys of a kind of table that only
+    use the given columns."""
+    keys = schema.get_keys(kind)
+    found = [keys['primary']] if keys['primary'] else []
+    found += keys['unique']
+    return [key for key in found if set(key) <= set(columns)]
+
+
 # Exceptions ###########################################################
 
 class ScriptInputError(Exception):
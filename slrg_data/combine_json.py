@@ -6,6 +6,24 @@ not already in a list (like BigQuery).
 The combined .data files contain the JSON records in a list. These new
 files can be opened by the python json library as a list of dict.
 
+Records are streamed from the JSON files into the .data files one at a
+time, so memory use does not grow with the number or size of the
+files. A new .data file can be started after a number of records or
+bytes.
+
+The JSON files can be compressed with gzip, bzip2, xz or zstd (.gz,
+.bz2, .xz or .zst) and the .data files can be written compressed.
+
+The files are read in chunks of records that are parsed by a pool of
+processes, so memory use depends on the chunk size and the number of
+processes, not the size of the files.
+Records with the same key as an earlier record are dropped, so rows
+that are in more than one overlapping export are only collected once.
+The keys seen are kept in memory up to a limit and then moved to a
+temporary SQLite file. Records can also be grouped by a field, like
+projects_id, so the collectors handle all of a project's records
+together.
+
 The original JSON files will be moved to a folder rather than being
 deleted. This way if they are needed again for some reason they will
 not have to be downloaded again. There is a command line option that
@@ -19,7 +37,10 @@ you want combined.
 ::
 
     $ slrg-combine-json [-h] [-d] [-o <output file>] [-f <raw json folder> ]
-        [-g <group size> ] [<json files>]
+        [-g <group size> ] [-r <records per file>] [-b <bytes per file>]
+        [-k <key fields>] [-w <workers>] [--group=<field>]
+        [--memory-keys=<keys>] [-z <gz|bz2|xz|zst>] [-t <threads>]
+        [<json files>]
 
 Options
 ~~~~~~~
@@ -46,23 +67,81 @@ Options
     The number of json files to combine for each data file created.
     Default is to combine them into one file (up to 10,000).
 
+**-r <records per file>**
+    The max number of records in each data file. Default is no limit.
+
+**-b <bytes per file>**
+    The max size of each data file. Can end in K, M or G. ie) 500M.
+    Files are started over after the record that reaches the size, so
+    they can be a little bigger. The size is before compression.
+    Default is no limit.
+
+**-k <key fields>**
+    The fields that identify a record, separated by commas. ie) sha or
+    projects_id,sha. Records with the same values as an earlier record
+    are dropped. Use -k none to keep duplicates. Default is the whole
+    record, which only drops exact copies.
+
+**-w <workers>**
+    The number of processes to parse files with. Default is the number
+    of CPUs.
+
+**--group=<field>**
+    Write the records sorted by a field, ie) projects_id or handle, so
+    records with the same value are together. Sorted runs are kept in
+    temporary files next to the output. -g is not used.
+
+**--memory-keys=<keys>**
+    The number of keys to keep in memory before they are moved to
+    disk. Default is 1,000,000.
+
+**-z <gz|bz2|xz|zst>**
+    Compress the .data files, ie) file.data.gz. zst needs the zstandard
+    package. Default is no compression.
+
+**-t <threads>**
+    The number of threads to compress each .data file with. Default is
+    the threads in the compressed_files config.
+
 **<json files>**
     The names of all the json files to combine.
-    Default is to collect all json files in current folder as
-    wildcards are not supported.
+    Default is to collect all json files in current folder, including
+    compressed ones, as wildcards are not supported.
 
 """
 # Standar python modules
 import os
 import json
+import hashlib
+import heapq
 import shutil
 import sys
 import getopt
+import collections
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 
 # Local imports
 from . import collection
 from .help_text import COMBINE_JSON as HELP_TEXT
 
+# Add the directory with the configuration file to the path
+try:
+    sys.path.append(collection.common.SLRG_DIR)
+    import config  # nopep8, pylint: disable=import-error
+except ModuleNotFoundError:
+    print('Config Error: Could not find config.py.',
+          'Try re-installing the slrg_data package.',
+          'If this does not work consult the config section of the documentation.')
+    sys.exit()
+
+
+# Records in each sorted run when grouping
+RUN_RECORDS = 100000
+
+# Records in each chunk parsed by a worker
+CHUNK_RECORDS = 5000
+
 
 # Script and Main Functions ############################################
 
@@ -84,11 +163,20 @@ def _script(argv):
     out_file = None
     raw_folder = None
     group_size = None
+    max_records = None
+    max_bytes = None
+    key = ''
+    workers = None
+    group = None
+    memory_keys = 1000000
+    compress = None
+    threads = None
     delete = False
 
     # Parse command line arguments
     try:
-        opts, filenames = getopt.getopt(argv, "o:f:g:hd")
+        opts, filenames = getopt.getopt(argv, "o:f:g:r:b:k:w:z:t:hd",
+                                        ['group=', 'memory-keys='])
     except getopt.GetoptError:
         print(HELP_TEXT)
         sys.exit()
@@ -100,6 +188,22 @@ def _script(argv):
             raw_folder = arg
         elif opt == '-g':
             group_size = int(arg)
+        elif opt == '-r':
+            max_records = int(arg)
+        elif opt == '-b':
+            max_bytes = _parse_size(arg)
+        elif opt == '-k':
+            key = None if arg == 'none' else arg
+        elif opt == '-w':
+            workers = int(arg)
+        elif opt == '--group':
+            group = arg
+        elif opt == '--memory-keys':
+            memory_keys = int(arg)
+        elif opt == '-z':
+            compress = arg
+        elif opt == '-t':
+            threads = int(arg)
         elif opt == '-d':
             delete = True
         elif opt == '-h':
@@ -113,11 +217,16 @@ def _script(argv):
         raw_folder = 'json_folder'
 
     main(files=filenames, out_file=out_file,
-         raw_folder=raw_folder, group_size=group_size, delete=delete)
+         raw_folder=raw_folder, group_size=group_size, delete=delete,
+         max_records=max_records, max_bytes=max_bytes, key=key,
+         workers=workers, group=group, memory_keys=memory_keys,
+         compress=compress, threads=threads)
 
 
 def main(files=None, out_file=None, raw_folder=None, group_size=None,
-         delete=False):
+         delete=False, max_records=None, max_bytes=None, key='',
+         workers=None, group=None, memory_keys=1000000, compress=None,
+         threads=None):
     """Main for script to combine json files into .data files.
 
     See module documentation for more details.
@@ -137,7 +246,30 @@ def main(files=None, out_file=None, raw_folder=None, group_size=None,
             should result in all .json files being combined into one
             output file.
         delete (bool): If true the raw json files will be deleted after they are combined.
+        max_records (int): The max number of records in each output
+            file. If None there is no limit.
+        max_bytes (int): The size in bytes after which a new output
+            file is started. If None there is no limit.
+        key (str): Comma separated fields that identify a record for
+            removing duplicates. '' uses the whole record and None keeps
+            duplicates.
+        workers (int): The number of processes to parse files with. If
+            None the number of CPUs is used.
+        group (str): A field to sort the records by so records with the
+            same value are together. If None the input order is kept.
+        memory_keys (int): The number of keys kept in memory before
+            they are moved to disk.
+        compress (str): The extension of a format to compress the output
+            files with. One of gz, bz2, xz or zst. If None they are not
+            compressed.
+        threads (int): The number of threads to compress with. If None
+            the compressed_files config is used.
     """
+    if compress is not None and compress.lstrip('.') not in (
+            ext[1:] for ext in collection.common.COMPRESSED_EXTENSIONS):
+        print("*** Unknown compression:", compress)
+        return
+
     if out_file is None:
         out_file = input('Name for output file(s): ')
 
@@ -147,8 +279,9 @@ def main(files=None, out_file=None, raw_folder=None, group_size=None,
     if group_size is None:
         group_size = 10000
 
-    combined = _combine_json(files, group_size)
-    _write_results(out_file, combined)
+    key_fields = None if key is None else [f for f in key.split(',') if f]
+    _combine_json(files, out_file, group_size, max_records, max_bytes,
+                  key_fields, workers, group, memory_keys, compress, threads)
 
     if not delete:
         _move_files(files, raw_folder)
@@ -165,73 +298,274 @@ def _get_all_json_files():
 
     Returns:
         list of str: A list of the names of all .json files in the
-            current directory.
+            current directory, compressed or not.
     """
     json_filenames = []
     for file in os.listdir():
-        if file.endswith(".json"):
+        if collection.common.strip_compression(file).endswith(".json"):
             json_filenames.append(file)
     return json_filenames
 
 
-def _combine_json(json_filenames, group_size):
-    """Combine the records of a JSON file into a list.
+def _combine_json(json_filenames, out_file, group_size, max_records=None,
+                  max_bytes=None, key_fields=None, workers=None, group=None,
+                  memory_keys=1000000, compress=None, threads=None):
+    """Streams the records of JSON files into .data files.
 
     Intended to be used on JSON files in which each line is a new JSON
     record. Will not work on JSON files where records are already in a
     list or are contained inside of another dict.
 
-    The returned list will contain multiple lists of records if group_size
-    is small enough that more than one group is created.
+    The files are parsed in chunks by a pool of processes and their
+    records are written in file order as they are ready, after
+    duplicates are removed. A new output file is started after every group_size input
+    files, and after the record that reaches max_records or max_bytes.
+    If combining fails the file being written is not finished, it is
+    renamed to <name>.partial instead.
 
     Args:
         json_filenames (list of str): A list of JSON filenames to combine.
+        out_file (str): The filename to write the results to. Numbers
+            are added to the names of files after the first.
         group_size (int): The number of files to combine for each group.
+            Not used if group is given.
+        max_records (int): The max records per output file, or None.
+        max_bytes (int): The max bytes per output file, or None.
+        key_fields (list of str): The fields that identify a record. An
+            empty list uses the whole record and None keeps duplicates.
+        workers (int): The number of processes, or None for one per CPU.
+        group (str): A field to sort the output by, or None.
+        memory_keys (int): The keys kept in memory before spilling.
+        compress (str): The extension to compress output files with, or
+            None.
+        threads (int): The threads to compress with, or None for the
+            config value.
 
     Returns:
-        A list containing lists of JSON dicts.
+        list of str: The names of the files created.
     """
-    combined = []
-    contents = []
-
-    for i, file in enumerate(json_filenames):
-        print("Combining", file)
-
-        # Add file contents to results
-        with open(file) as f:
-            records = f.read().splitlines()
-        for record in records:
-            contents.append(json.loads(record))
-
-        # If group is done store the combined results
-        if (i + 1) % group_size == 0 or i == len(json_filenames) - 1:
-            combined.append(contents)
-            contents = []
-
-    return combined
+    output = _Output(out_file, max_records, max_bytes, compress, threads)
+    totals = {'records': 0, 'duplicates': 0}
+    temp_dir = tempfile.mkdtemp(prefix='combine_',
+                                dir=os.path.dirname(out_file) or '.')
+    keys = collection.common.KeySet(os.path.join(temp_dir, 'keys.db'),
+                                    memory_keys)
+    runs = []
+    run = []
+    done = 0
+    counts = {'records': 0, 'duplicates': 0}
+    try:
+        parsed = _parse_files(json_filenames, key_fields, group, workers)
+        for file, records, last in parsed:
+            added = keys.add_many([digest for digest, _, _ in records])
+            counts['records'] += len(records)
+            counts['duplicates'] += added.count(False)
+
+            for (_, sort_key, text), new in zip(records, added):
+                if not new:
+                    continue
+                if group is None:
+                    output.write(text)
+                else:
+                    run.append((sort_key, text))
+                    if len(run) >= RUN_RECORDS:
+                        runs.append(_write_run(run, temp_dir, len(runs)))
+                        run = []
+
+            if not last:
+                continue
+            print("Combined {} ({} records, {} duplicates)".format(
+                file, counts['records'], counts['duplicates']))
+            totals['records'] += counts['records']
+            totals['duplicates'] += counts['duplicates']
+            counts = {'records': 0, 'duplicates': 0}
+
+            # If group is done start a new file
+            done += 1
+            if group is None and done % group_size == 0:
+                output.finish()
+
+        if group is not None:
+            if run:
+                runs.append(_write_run(run, temp_dir, len(runs)))
+            for text in _merge_runs(runs):
+                output.write(text)
+        output.finish()
+
+    except BaseException:
+        output.abort()
+        raise
+
+    finally:
+        keys.close()
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    records = max(totals['records'], 1)
+    print("** Duplicates removed: {} of {} records ({:.1f}%)".format(
+        totals['duplicates'], totals['records'],
+        100 * totals['duplicates'] / records))
+    return output.created
+
+
+def _parse_files(json_filenames, key_fields, group, workers):
+    """Parses files in chunks in a pool of processes.
+
+    Only a few more chunks than there are workers are parsed ahead of
+    the one being written, so memory use is bounded by the chunk size,
+    not the size or number of the files.
+
+    Yields:
+        (str, list, bool): The file name, the parsed records of a chunk
+        in order and whether it is the file's last chunk. See
+        :func:`_parse_lines`.
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    chunks = _read_chunks(json_filenames)
+    if workers <= 1:
+        for file, lines, last in chunks:
+            yield file, _parse_lines(lines, key_fields, group), last
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = collections.deque()
+        for file, lines, last in chunks:
+            pending.append((file, last, pool.submit(_parse_lines, lines,
+                                                    key_fields, group)))
+            if len(pending) > workers * 2:
+                done, done_last, future = pending.popleft()
+                yield done, future.result(), done_last
+        while pending:
+            done, done_last, future = pending.popleft()
+            yield done, future.result(), done_last
+
+
+def _read_chunks(json_filenames):
+    """Reads the lines of JSON lines files, which may be compressed, in
+    chunks of CHUNK_RECORDS.
+
+    Yields:
+        (str, list, bool): The file name, the lines of a chunk and
+        whether it is the file's last chunk. Every file has a last
+        chunk, which may be empty.
+    """
+    for file in json_filenames:
+        lines = []
+        with collection.common.open_file(file) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                if len(lines) >= CHUNK_RECORDS:
+                    yield file, lines, False
+                    lines = []
+                lines.append(line)
+        yield file, lines, True
+
+
+def _parse_lines(lines, key_fields, group):
+    """Parses a chunk of JSON lines. Runs in a worker process.
 
+    Args:
+        lines (list of str): The lines, one record each.
+        key_fields (list of str): The fields to hash for a record's key.
+            Empty hashes the whole record. None gives no key.
+        group (str): The field to sort on, or None.
 
-def _write_results(out_file, combined):
-    """Write the lists of combined json records to .data files.
+    Returns:
+        list of tuple: (key digest, sort key, JSON text) for each record.
+    """
+    records = []
+    for line in lines:
+        record = json.loads(line)
+        text = json.dumps(record)
+
+        digest = None
+        if key_fields is not None:
+            if key_fields:
+                value = json.dumps([record.get(k) for k in key_fields])
+            else:
+                value = json.dumps(record, sort_keys=True)
+            digest = hashlib.blake2b(value.encode(),
+                                     digest_size=16).digest()
+
+        sort_key = None
+        if group is not None:
+            sort_key = _sort_key(record.get(group))
+        records.append((digest, sort_key, text))
+    return records
+
+
+def _sort_key(value):
+    """Returns a key that orders any JSON value. Numbers come before
+    strings and None is last."""
+    if isinstance(value, bool) or value is None:
+        return (2, str(value))
+    if isinstance(value, (int, float)):
+        return (0, value)
+    return (1, str(value))
+
+
+def _write_run(run, temp_dir, number):
+    """Sorts a run of records and writes it to a temporary file.
+    Returns the file's path."""
+    run.sort(key=lambda item: item[0])
+    path = os.path.join(temp_dir, "run_{}.jsonl".format(number))
+    with open(path, 'w') as file:
+        for sort_key, text in run:
+            # JSON text has no raw tabs or newlines
+            file.write(json.dumps(sort_key) + '\t' + text + '\n')
+    return path
+
+
+def _merge_runs(runs):
+    """Merges sorted run files. Yields the JSON text of each record in
+    order."""
+    def read(path):
+        with open(path) as file:
+            for line in file:
+                sort_key, text = line.rstrip('\n').split('\t', 1)
+                yield tuple(json.loads(sort_key)), text
+
+    for _, text in heapq.merge(*[read(path) for path in runs],
+                               key=lambda item: item[0]):
+        yield text
+
+
+def _new_output(out_file, created, compress=None, threads=1):
+    """Opens the next output file and adds its name to created.
 
     If more than one file is created numbers will be appended to the
-    out_file name.
-
-    Args:
-        out_file (str): The filename to write the results to.
-        combined (list of lists of JSON dicts): A list containing one
-            or more lists of JSON records.
+    out_file name. If compress is given it is added as an extension and
+    the file is compressed with that format.
     """
     ext = "data"
-    for i, contents in enumerate(combined):
-        if i == 0:
-            name = "{}.{}".format(out_file, ext)
-        else:
-            name = "{}{}.{}".format(out_file, i + 1, ext)
+    if compress is not None:
+        ext += "." + compress.lstrip('.')
+    if not created:
+        name = "{}.{}".format(out_file, ext)
+    else:
+        name = "{}{}.{}".format(out_file, len(created) + 1, ext)
+    created.append(name)
+    settings = config.compressed_files
+    return collection.common.JsonListWriter(name, threads,
+                                            settings['level'])
 
-        with open(name, 'w') as f:
-            json.dump(contents, f)
-        print("** Created", name)
+
+def _finish_output(writer):
+    """Closes an output file. Returns None for the next writer."""
+    writer.close()
+    print("** Created {} ({} records)".format(writer.path, writer.count))
+    return None
+
+
+def _parse_size(text):
+    """Converts a size like 500M to bytes. K, M and G are powers of
+    1024."""
+    units = {'K': 2**10, 'M': 2**20, 'G': 2**30}
+    text = text.strip().upper().rstrip('B')
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
 
 
 def _move_files(filenames, folder):
@@ -257,3 +591,52 @@ def _move_files(filenames, folder):
         for file in filenames:
             print("Deleting", file)
             os.remove(file)
+
+
+# Classes ##############################################################
+
+class _Output:
+    """The .data files being written, started over at the limits.
+
+    Attributes:
+        created (list of str): The names of the files created.
+    """
+
+    def __init__(self, out_file, max_records=None, max_bytes=None,
+                 compress=None, threads=None):
+        self.out_file = out_file
+        self.max_records = max_records
+        self.max_bytes = max_bytes
+        self.compress = compress
+        if threads is None:
+            threads = config.compressed_files['threads']
+        self.threads = threads
+        self.created = []
+        self._writer = None
+
+    def write(self, text):
+        """Writes the JSON text of a record."""
+        if self._writer is None:
+            self._writer = _new_output(self.out_file, self.created,
+                                       self.compress, self.threads)
+        self._writer.write_json(text)
+        if ((self.max_records and self._writer.count >= self.max_records)
+                or (self.max_bytes and self._writer.size >= self.max_bytes)):
+            self.finish()
+
+    def finish(self):
+        """Closes the current file. The next write starts a new one."""
+        if self._writer is not None:
+            self._writer = _finish_output(self._writer)
+
+    def abort(self):
+        """Closes the current file without ending it and renames it to
+        <name>.partial, so an incomplete file is never left with the
+        name of a finished one."""
+        if self._writer is not None:
+            self._writer.abort()
+            os.replace(self._writer.path, self._writer.path + '.partial')
+            print("*** Incomplete output moved to",
+                  self._writer.path + '.partial')
+            self.created.remove(self._writer.path)
+            self._writer = None
@@ -29,10 +29,12 @@ specified.
 
 **-o <output file>**
     The file to write the results to. Default is filtered.data.
+    Ending the name in .gz, .bz2, .xz or .zst compresses it.
 
 **-i <codeforces user file>**
     The file containing a list of codeforces user records. If left blank
-    it will be prompted for.
+    it will be prompted for. It can be compressed with gzip, bzip2, xz
+    or zstd.
 
 **--country=<country(s)>**
     One or more countries to look for.
@@ -65,6 +67,16 @@ import getopt
 from . import collection
 from .help_text import FILTER_CODEFORCES as HELP_TEXT
 
+# Add the directory with the configuration file to the path
+try:
+    sys.path.append(collection.common.SLRG_DIR)
+    import config  # nopep8, pylint: disable=import-error
+except ModuleNotFoundError:
+    print('Config Error: Could not find config.py.',
+          'Try re-installing the slrg_data package.',
+          'If this does not work consult the config section of the documentation.')
+    sys.exit()
+
 
 # Script and Main Functions ############################################
 
@@ -179,7 +191,10 @@ def main(users_file=None, out_file=None, countries=[], genders=[],
         print('\n***', err)
 
     finally:
-        collection.common.write_json_data(out_file, users)
+        settings = config.compressed_files
+        collection.common.write_json_data(out_file, users,
+                                          settings['threads'],
+                                          settings['level'])
 
 
 # Helpers ##############################################################
@@ -23,10 +23,12 @@ Options
 
 **-i <codeforces user file>**
     The file containing a list of codeforces user records. If left blank
-    it will be prompted for.
+    it will be prompted for. It can be compressed with gzip, bzip2, xz
+    or zstd.
 
 **-o <output file>**
-    The file to write the gendered results to.
+    The file to write the gendered results to. Ending the name in .gz,
+    .bz2, .xz or .zst compresses it.
     Default is gendered.data
 
 **-m <missing gender file>**
@@ -221,8 +223,13 @@ def _add_gender(user_list, database, gender_table, gender_file, miss_file):
                     missing.append(user)
 
     finally:
-        collection.common.write_json_data(gender_file, gendered)
-        collection.common.write_json_data(miss_file, missing)
+        settings = config.compressed_files
+        collection.common.write_json_data(gender_file, gendered,
+                                          settings['threads'],
+                                          settings['level'])
+        collection.common.write_json_data(miss_file, missing,
+                                          settings['threads'],
+                                          settings['level'])
 
 
 def _has_first_name(user_data):
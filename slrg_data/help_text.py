@@ -13,7 +13,9 @@ input values.
 -l <programming language>
     The programming language that source is being collected from.
     Determines the table to use and the file extensions. See config.py
-    for more info.
+    for more info. Several languages can be given separated by commas,
+    ie) 'c++,python,java'. Each project or commit is then processed once
+    and files are added to the table for their language.
     * Default is to ask for it.
 
 -i <input data file>
@@ -53,8 +55,12 @@ $ slrg-git-commits [-h] [-l <programming language>]
     [-i <input data file>] [-s <start index>]
     [-c <records to process>] [-u <database username>]
     [-p <database password>] [--git=<github username>]
-    [--gitpass=<github password>]
-""" + _git_options
+    [--gitpass=<github password>] [--clone]
+""" + _git_options + """
+--clone
+    Clone each project once and read the files added by its commits
+    from the clone instead of the GitHub API.
+"""
 
 
 # Codeforces ###########################################################
@@ -190,7 +196,9 @@ All category options default to accepting all values unless otherwise
 SELECT = """
 $ slrg-select [-h] [-j | -c] [-n] [-o <output file>]
     [-i <input sql file>] [-u <database username>]
-    [-p <database password>]
+    [-p <database password>] [--stream] [--gzip]
+    [--partition=<column>] [--shards=<number of shards>] [--quantiles]
+    [--columnar]
 
 Options
 ~~~~~~~
@@ -223,12 +231,154 @@ Options
     The database password.
     * Defaults to value in config file. If the value in config is None
       it will be asked for.
+
+--stream
+    Fetch the results with a server side cursor and write each row as
+    it arrives so memory use stays small. JSON output is written as
+    JSON Lines (one object per line). Shows progress in rows per second.
+
+--gzip
+    Compress the output file with gzip as it is written.
+    * Output files named .gz, .bz2, .xz or .zst are always compressed
+      with that format.
+
+--partition=<column>
+    Split the query into ranges of a selected column (ie. project_id)
+    and stream each range to its own shard file on its own database
+    connection at the same time. A manifest of the shards is written to
+    <output file>.manifest.json. Implies --stream.
+
+--shards=<number of shards>
+    The number of ranges to split the query into.
+    * Default is 4.
+
+--quantiles
+    Choose the ranges from a sample of the column's values so shards
+    are about the same size. Needed if the column is not a number.
+
+--columnar
+    Write a columnar dataset directory named by the output file
+    instead of a JSON or CSV file. It can be opened with mmap and read
+    without parsing. Needs numpy.
+    * The directory must be new or empty.
+"""
+
+
+NEAR_DUPS = """
+$ slrg-near-dups [-h] [-i <export file>] [-o <report file>]
+    [--key=<column>] [--content=<column>] [--index=<index file>]
+    [--batch=<samples per batch>]
+
+Options
+~~~~~~~
+
+-h
+    Print help text.
+
+-i <export file>
+    A file from slrg-select. JSON Lines, a JSON list or CSV with a
+    header row. May be compressed (.gz, .bz2, .xz or .zst).
+    * Default is to ask for it.
+
+-o <report file>
+    The file to write the near duplicates to as JSON Lines.
+    * Default is near_dups.jsonl
+
+--key=<column>
+    The column that identifies a sample in the report.
+    * Default is content_hash if it was exported, otherwise the row
+      number.
+
+--content=<column>
+    The column with the source code.
+    * Default is file_contents or source_code.
+
+--index=<index file>
+    A SQLite file to keep the index in. Samples already in it are
+    matched too.
+    * Default is to keep the index in memory.
+
+--batch=<samples per batch>
+    The number of samples to compute signatures for at once.
+    * Default is 1000.
+"""
+
+
+INIT_DB = """
+$ slrg-init-db [-h] [-u <database username>] [-p <database password>]
+    [--partition=<year | language>] [--check] [--sql]
+
+Options
+~~~~~~~
+
+-h
+    Print help text.
+
+-u <database username>
+    The database username. Needs CREATE privileges.
+    * Defaults to value in config file, if the value in config is None
+      it will be asked for.
+
+-p <database password>
+    The database password.
+    * Defaults to value in config file. If the value in config is None
+      it will be asked for.
+
+--partition=<year | language>
+    Partition new tables that have a year or programming_language column
+    by that column. The column is added to the unique keys.
+
+--check
+    Only check the existing tables for missing columns and keys. Do not
+    create any tables.
+
+--sql
+    Print the CREATE TABLE statements without connecting.
+"""
+
+
+SYNC_SQLITE = """
+$ slrg-sync-sqlite [-h] [-u <database username>]
+    [-p <database password>] [-c <rows per chunk>] [--replace]
+    [<sqlite files>]
+
+Options
+~~~~~~~
+
+-h
+    Print help text.
+
+-u <database username>
+    The database username.
+    * Defaults to value in config file, if the value in config is None
+      it will be asked for.
+
+-p <database password>
+    The database password.
+    * Defaults to value in config file. If the value in config is None
+      it will be asked for.
+
+-c <rows per chunk>
+    The number of rows to load at a time.
+    * Defaults to chunk_rows in the bulk_load config.
+
+--replace
+    Replace rows that are already in the database instead of skipping
+    them.
+
+<sqlite files>
+    The SQLite files to push. Only rows added since the last push are
+    sent.
+    * Default is all .db files in slrg/sqlite.
 """
 
 
 COMBINE_JSON = """
 slrg-combine-json [-h] [-o <output file>] [-f < raw json folder> ]
-        [-g < group size > ] [<json files>]
+        [-g < group size > ] [-r <records per file>] [-b <bytes per file>]
+        [-k <key fields>] [-w <workers>] [--group=<field>]
+        [--memory-keys=<keys>] [-z <gz|bz2|xz|zst>] [-t <threads>]
+        [<json files>]
 
 Options
 ~~~~~~~
@@ -255,8 +405,43 @@ Options
     The number of json files to combine for each data file created.
     * Default is to combine them into one file (up to 10,000).
 
+-r <records per file>
+    The max number of records in each data file.
+    * Default is no limit.
+
+-b <bytes per file>
+    The max size of each data file. Can end in K, M or G. ie) 500M
+    * The size is before compression.
+    * Default is no limit.
+
+-k <key fields>
+    The fields that identify a record, separated by commas. ie) sha
+    Records with the same values as an earlier record are dropped.
+    * Default is the whole record. Use -k none to keep duplicates.
+
+-w <workers>
+    The number of processes to parse files with.
+    * Default is the number of CPUs.
+
+--group=<field>
+    Sort the records by a field, ie) projects_id, so records with the
+    same value are together. -g is not used.
+
+--memory-keys=<keys>
+    The number of keys to keep in memory before moving them to disk.
+    * Default is 1,000,000.
+
+-z <gz|bz2|xz|zst>
+    Compress the data files, ie) file.data.gz. zst needs zstandard.
+    * Default is no compression.
+
+-t <threads>
+    The number of threads to compress each data file with.
+    * Default is the threads in the compressed_files config.
+
 <json files>
-    The names of all the json files to combine.
+    The names of all the json files to combine. They can be compressed
+    (.json.gz, .json.bz2, .json.xz or .json.zst).
     * Default is to collect all json files in current folder.
      wildcards and other regex are not supported.
 """
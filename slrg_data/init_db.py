@@ -0,0 +1,207 @@
+"""Script to create the collection tables in the database and check
+the ones that already exist.
+
+Creates every table named in the config tables field, and the gender
+table, with the column types, keys and indexes the collection scripts
+need. If compression is enabled in the config the compressed columns
+are made BLOBs, and if features are enabled a column and index is added
+for each feature. Tables that already exist are not changed. Instead they are
+checked for missing columns and keys, and the queries the collectors
+make most are checked with EXPLAIN to make sure they use a key.
+
+Usage
+=====
+
+Run::
+
+    $ slrg-init-db [-h] [-u <database username>] [-p <database password>]
+        [--partition=<year | language>] [--check] [--sql]
+
+Options
+~~~~~~~
+
+**-h**
+    Print help text.
+
+**-u <database username>**
+    The database username. Defaults to value in config file, if config
+    value is None it will be asked for. Needs CREATE privileges.
+
+**-p <database password>**
+    The database password. Defaults to value in config file. If config
+    value is None it will be asked for.
+
+**--partition=<year | language>**
+    Partition new tables with a year or programming_language column by
+    that column. The column is added to the table's unique keys, as
+    MySQL requires. The GitHub tables are already split by language and
+    are not partitioned.
+
+**--check**
+    Only check the existing tables. Do not create any.
+
+**--sql**
+    Print the CREATE TABLE statements without connecting to the
+    database.
+"""
+# Standard python modules
+import getopt
+import sys
+
+# Local imports
+from . import collection
+from .help_text import INIT_DB as HELP_TEXT
+
+# Add the directory with the configuration file to the path
+try:
+    sys.path.append(collection.common.SLRG_DIR)
+    import config  # nopep8, pylint: disable=import-error
+except ModuleNotFoundError:
+    print('Config Error: Could not find config.py.',
+          'Try re-installing the slrg_data package.',
+          'If this does not work consult the config section of the documentation.')
+    sys.exit()
+
+
+# Script and Main Functions ############################################
+
+def _entry():
+    """Entry point for the script."""
+    _script(sys.argv[1:])
+
+
+def _script(argv):
+    """Processes command line arguments and calls main with their values.
+
+    See module details for more info on command line options.
+
+    Args:
+        argv (list of str): The list of command line options and args
+            not containing the script name.
+    """
+    login = None
+    passwd = None
+    partition = None
+    check = False
+    sql = False
+
+    try:
+        opts, _ = getopt.getopt(argv, "u:p:h", ['partition=', 'check', 'sql'])
+    except getopt.GetoptError:
+        print(HELP_TEXT)
+        sys.exit()
+
+    for opt, arg in opts:
+        if opt == '-u':
+            login = arg
+        elif opt == '-p':
+            passwd = arg
+        elif opt == '--partition':
+            partition = arg
+        elif opt == '--check':
+            check = True
+        elif opt == '--sql':
+            sql = True
+        elif opt == '-h':
+            print(HELP_TEXT)
+            return
+
+    main(db_login=login, db_passwd=passwd, partition=partition, check=check,
+         sql=sql)
+
+
+def main(db_login=None, db_passwd=None, partition=None, check=False,
+         sql=False):
+    """Creates the collection tables that do not exist and checks the
+    ones that do.
+
+    Args:
+        db_login (str): The username for the database.
+        db_passwd (str): The database users password.
+        partition (str): 'year' or 'language' to partition new tables
+            that have that column. Default is None.
+        check (bool): Wether to only check the existing tables.
+        sql (bool): Wether to only print the CREATE TABLE statements.
+
+    Returns:
+        int: The number of problems found in existing tables.
+    """
+    if partition not in (None, 'year', 'language'):
+        print("\n*** Input Error: Partition must be year or language")
+        return 0
+
+    tables = collection.schema.get_tables(config.config)
+    binary = []
+    if config.compression['enabled']:
+        binary = config.compression['columns']
+    indexed = []
+    if config.features['enabled']:
+        indexed = config.features['names']
+        tables = [(kind, table, columns + indexed if kind != 'gender'
+                   else columns) for kind, table, columns in tables]
+
+    if sql:
+        for kind, table, columns in tables:
+            print(_create_sql(kind, table, columns, partition, binary,
+                              _indexed(kind, indexed)), end='\n\n')
+        return 0
+
+    database = collection.script.make_database(config.database,
+                                               login=db_login,
+                                               passwd=db_passwd)
+    problems = 0
+    try:
+        database.connect()
+        existing = {row[0] for row in database.execute(
+            "SELECT TABLE_NAME FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = DATABASE();")}
+
+        for kind, table, columns in tables:
+            if table not in existing:
+                if check:
+                    print("{}: missing".format(table))
+                    problems += 1
+                    continue
+                database.execute(_create_sql(kind, table, columns, partition,
+                                             binary, _indexed(kind, indexed)))
+                print("{}: created".format(table))
+
+            found = collection.schema.check_table(
+                database, kind, table, columns, binary,
+                _indexed(kind, indexed))
+            problems += len(found)
+            if found:
+                print("{}: {} problem(s)".format(table, len(found)))
+                for problem in found:
+                    print("    -", problem)
+            else:
+                print("{}: ok".format(table))
+
+    except collection.script.ScriptInputError as err:
+        print('\n***', err)
+
+    except collection.common.DatabaseError as err:
+        print('\n***', err)
+
+    finally:
+        database.close()
+
+    return problems
+
+
+# Helper Functions #####################################################
+
+def _create_sql(kind, table, columns, partition, binary=(), indexed=()):
+    """Returns the CREATE TABLE statement for a table, only partitioning
+    it if it has the partition column."""
+    column = collection.schema.PARTITIONS.get(partition)
+    if column not in columns:
+        partition = None
+    return collection.schema.create_table_sql(kind, table, columns, partition,
+                                              binary, indexed)
+
+
+def _indexed(kind, indexed):
+    """Returns the feature columns to index for a kind of table. The
+    gender table has none."""
+    return [] if kind == 'gender' else indexed
@@ -0,0 +1,253 @@
+"""Script to find near duplicate samples in an exported table.
+
+Reads samples exported with slrg-select and checks each one against the
+samples before it with a MinHash LSH index. See
+:mod:`slrg_data.collection.neardup`. Every sample that is a near
+duplicate of an earlier one is written to a report as a JSON Lines
+record with its key, the key of the sample it matches and their
+estimated similarity.
+
+Requires NumPy.
+
+Usage
+=====
+
+Run::
+
+    $ slrg-near-dups [-h] [-i <export file>] [-o <report file>]
+        [--key=<column>] [--content=<column>] [--index=<index file>]
+        [--batch=<samples per batch>]
+
+Options
+~~~~~~~
+
+**-h**
+    Print help text.
+
+**-i <export file>**
+    A file from slrg-select. JSON Lines (--stream -j), a JSON list (-j)
+    or CSV with a header row (-c -n). May be compressed with gzip,
+    bzip2, xz or zstd. If not given it will be asked for.
+
+**-o <report file>**
+    The file to write the near duplicates to.
+    Default is near_dups.jsonl
+
+**--key=<column>**
+    The column that identifies a sample in the report. Default is
+    content_hash if it was exported, otherwise the row number.
+
+**--content=<column>**
+    The column with the source code. Default is file_contents or
+    source_code, whichever was exported.
+
+**--index=<index file>**
+    A SQLite file to keep the index in. Samples already in it are
+    matched too, and the new samples are added to it. Default is to
+    keep the index in memory.
+
+**--batch=<samples per batch>**
+    The number of samples to compute signatures for at once.
+    Default is 1000.
+"""
+# Standard python modules
+import csv
+import getopt
+import json
+import sys
+import time
+
+# Local imports
+from . import collection
+from .help_text import NEAR_DUPS as HELP_TEXT
+
+# Add the directory with the configuration file to the path
+try:
+    sys.path.append(collection.common.SLRG_DIR)
+    import config  # nopep8, pylint: disable=import-error
+except ModuleNotFoundError:
+    print('Config Error: Could not find config.py.',
+          'Try re-installing the slrg_data package.',
+          'If this does not work consult the config section of the documentation.')
+    sys.exit()
+
+
+# Script and Main Functions ############################################
+
+def _entry():
+    """Entry point for the script."""
+    _script(sys.argv[1:])
+
+
+def _script(argv):
+    """Processes command line arguments and calls main with their values.
+
+    See module details for more info on command line options.
+
+    Args:
+        argv (list of str): The list of command line options and args
+            not containing the script name.
+    """
+    input_file = None
+    output_file = None
+    key = None
+    content = None
+    index = None
+    batch = 1000
+
+    try:
+        opts, _ = getopt.getopt(argv, "i:o:h", ['key=', 'content=',
+                                                'index=', 'batch='])
+    except getopt.GetoptError:
+        print(HELP_TEXT)
+        sys.exit()
+
+    for opt, arg in opts:
+        if opt == '-i':
+            input_file = arg
+        elif opt == '-o':
+            output_file = arg
+        elif opt == '--key':
+            key = arg
+        elif opt == '--content':
+            content = arg
+        elif opt == '--index':
+            index = arg
+        elif opt == '--batch':
+            batch = int(arg)
+        elif opt == '-h':
+            print(HELP_TEXT)
+            return
+
+    main(input_file=input_file, output_file=output_file, key=key,
+         content=content, index=index, batch=batch)
+
+
+def main(input_file=None, output_file=None, key=None, content=None,
+         index=None, batch=1000):
+    """Finds the near duplicate samples in an exported table.
+
+    Args:
+        input_file (str): A file exported with slrg-select.
+        output_file (str): The file to write the report to. Default is
+            near_dups.jsonl.
+        key (str): The column that identifies a sample.
+        content (str): The column with the source code.
+        index (str): A SQLite file to keep the index in. Default is to
+            keep it in memory.
+        batch (int): The number of samples to compute signatures for at
+            once.
+
+    Returns:
+        int: The number of near duplicates found.
+    """
+    try:
+        input_file = collection.script.get_file_path(input_file)
+        if output_file is None:
+            output_file = 'near_dups.jsonl'
+
+        settings = config.near_dup
+        near_dup = collection.neardup.NearDupIndex(
+            index if index is not None else ':memory:',
+            settings['num_perm'], settings['bands'], settings['threshold'],
+            settings['shingle'])
+
+    except collection.script.ScriptInputError as err:
+        print('\n***', err)
+        return 0
+
+    except ImportError as err:
+        print('\n***', err)
+        return 0
+
+    start = time.time()
+    total = 0
+    found = 0
+    try:
+        with collection.common.open_file(output_file, 'w') as out:
+            for keys, sources in _iter_batches(input_file, key, content,
+                                               batch):
+                results = near_dup.check_many(keys, sources)
+                for sample_key, matches in zip(keys, results):
+                    if matches:
+                        found += 1
+                        match_key, similarity = matches[0]
+                        out.write(json.dumps({
+                            'key': sample_key, 'near_dup_of': match_key,
+                            'similarity': round(similarity, 3)}) + '\n')
+                total += len(keys)
+                print("Samples: {:,}, near duplicates: {:,} "
+                      "({:,.0f} samples/s)".format(
+                          total, found, total / (time.time() - start)),
+                      end='\r', flush=True)
+
+    except collection.script.ScriptInputError as err:
+        print('\n***', err)
+
+    finally:
+        near_dup.close()
+
+    print()
+    if total:
+        print("Found {} near duplicates in {} samples ({:.1f}%). "
+              "See {}".format(found, total, 100 * found / total,
+                              output_file))
+    return found
+
+
+# Helper Functions #####################################################
+
+def _iter_batches(path, key, content, size):
+    """Reads samples from an export file in batches.
+
+    Yields:
+        (list, list): The keys and sources of a batch of samples.
+
+    Raises:
+        ScriptInputError: If the content or key column is not in the
+            file.
+    """
+    keys, sources = [], []
+    for i, row in enumerate(_iter_rows(path)):
+        if content is None:
+            content = next((c for c in ('file_contents', 'source_code')
+                            if c in row), None)
+        if key is None:
+            key = 'content_hash' if 'content_hash' in row else ''
+        if content not in row or (key and key not in row):
+            raise collection.script.ScriptInputError(
+                "Input Error: Missing key or content column in " + path)
+
+        keys.append(str(row[key]) if key else str(i))
+        sources.append(row[content] or '')
+        if len(keys) >= size:
+            yield keys, sources
+            keys, sources = [], []
+
+    if keys:
+        yield keys, sources
+
+
+def _iter_rows(path):
+    """Yields each row of a JSON Lines, JSON list or CSV file as a dict.
+    Compressed files are decompressed, see
+    :func:`slrg_data.collection.common.open_file`."""
+    open_file = collection.common.open_file
+    if collection.common.strip_compression(path).endswith('.csv'):
+        with open_file(path, newline='') as file:
+            yield from csv.DictReader(file)
+        return
+
+    with open_file(path) as file:
+        first = file.read(1)
+        while first.isspace():
+            first = file.read(1)
+
+    if first == '[':
+        yield from collection.common.iter_json_list(path)
+        return
+
+    with open_file(path) as file:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
@@ -2,7 +2,8 @@
 a CSV or JSON file.
 
 Can be run as a command line script or imported as a module and run with
-select.main().
+select.main(). Source columns that were compressed when they were
+collected are decompressed in worker threads before they are written.
 
 Usage
 =====
@@ -12,7 +13,9 @@ Run::
 
     $ slrg-select [-h] [-j | -c] [-n] [-o <output file>]
         [-i <input sql file>] [-u <database username>]
-        [-p <database password>]
+        [-p <database password>] [--stream] [--gzip]
+        [--partition=<column>] [--shards=<number of shards>]
+        [--quantiles] [--columnar]
 
 Options
 ~~~~~~~
@@ -43,6 +46,45 @@ Options
 **-p <database password>**
     The database password. Defaults to value in config file. If config
     value is None it will be asked for.
+
+**--stream**
+    Fetch the results with an unbuffered server side cursor and write
+    each row as it arrives, so memory use does not grow with the size
+    of the results. JSON output is written as JSON Lines (one object
+    per line) instead of a single list. Progress is shown in rows per
+    second.
+
+**--gzip**
+    Compress the output file with gzip as it is written. An output file
+    named .gz, .bz2, .xz or .zst is always compressed with that format,
+    using the threads and level in the compressed_files config.
+
+**--partition=<column>**
+    Split the query into ranges of a column (ie. project_id or
+    submission_id) and stream each range to its own shard file on its
+    own database connection at the same time. The column must be one
+    of the selected columns. A manifest listing the shards is written
+    next to them. Implies --stream.
+
+**--shards=<number of shards>**
+    The number of ranges to split the query into. Up to the database
+    pool_size ranges are exported at once.
+    * Default is 4.
+
+**--quantiles**
+    Choose the ranges from a sample of the column's values so each
+    shard has about the same number of rows. Needed if the column is
+    not a number. Default is to split MIN to MAX into equal ranges.
+
+**--columnar**
+    Stream the results into a columnar dataset directory named by the
+    output file instead of a JSON or CSV file. Each column is a NumPy
+    file and the source of every sample is in one blob file, so the
+    results can be opened with mmap and read without parsing them. See
+    :mod:`slrg_data.collection.columnar`. Needs numpy. -j, -c, -n and
+    --gzip are not used. The directory must be new or empty. If the
+    export fails no meta.json is written, so the directory does not
+    open as a dataset.
 """
 # Standar modules
 import getopt
@@ -50,6 +92,11 @@ import sys
 import os
 import json
 import csv
+import gzip
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 # Local imports
 from . import collection
@@ -89,10 +136,18 @@ def _script(argv):
     login = None
     passwd = None
     names = False
+    stream = False
+    compress = False
+    partition = None
+    shards = 4
+    quantiles = False
+    columnar = False
 
     # Parse command line options
     try:
-        opts, _ = getopt.getopt(argv, "o:i:u:p:cjhn")
+        opts, _ = getopt.getopt(argv, "o:i:u:p:cjhn",
+                                ['stream', 'gzip', 'partition=', 'shards=',
+                                 'quantiles', 'columnar'])
     except getopt.GetoptError:
         print(HELP_TEXT)
         sys.exit()
@@ -111,16 +166,31 @@ def _script(argv):
             passwd = arg
         elif opt == '-n':
             names = True
+        elif opt == '--stream':
+            stream = True
+        elif opt == '--gzip':
+            compress = True
+        elif opt == '--partition':
+            partition = arg
+        elif opt == '--shards':
+            shards = int(arg)
+        elif opt == '--quantiles':
+            quantiles = True
+        elif opt == '--columnar':
+            columnar = True
         elif opt == '-h':
             print(HELP_TEXT)
             return
 
     main(output_file=output_file, sql_file=sql_file,
-         output_format=output_format, db_login=login, db_passwd=passwd, names=names)
+         output_format=output_format, db_login=login, db_passwd=passwd,
+         names=names, stream=stream, compress=compress, partition=partition,
+         shards=shards, quantiles=quantiles, columnar=columnar)
 
 
 def main(output_file=None, sql_file=None, output_format=None, db_login=None,
-         db_passwd=None, names=False):
+         db_passwd=None, names=False, stream=False, compress=False,
+         partition=None, shards=4, quantiles=False, columnar=False):
     """Collects results of an sql SELECT query and writes the results to
     a JSON or CSV file.
 
@@ -137,9 +207,23 @@ def main(output_file=None, sql_file=None, output_format=None, db_login=None,
         db_password (str): The database users password.
         names (bool): Wether to add a row with column names at the top
             of a CSV file.
+        stream (bool): Wether to stream the results to the file with a
+            server side cursor. JSON results are written as JSON Lines.
+        compress (bool): Wether to gzip the output file.
+        partition (str): A selected column to split the query on. Each
+            range of the column is streamed to its own file in
+            parallel. Default is None.
+        shards (int): The number of ranges to split the query into.
+        quantiles (bool): Wether to choose the ranges from sampled
+            quantiles of the column instead of splitting MIN to MAX.
+        columnar (bool): Wether to stream the results into a columnar
+            dataset directory instead of a JSON or CSV file.
     """
     try:
         # Set some variables
+        if columnar and output_format is None:
+            # The format is not used for columnar output
+            output_format = 'j'
         output_file, output_format = _get_file_and_format(output_file,
                                                           output_format)
         sql = _get_query(sql_file)
@@ -153,7 +237,18 @@ def main(output_file=None, sql_file=None, output_format=None, db_login=None,
         database = collection.script.make_database(config.database,
                                                    login=db_login,
                                                    passwd=db_passwd)
-        print(_query_and_output(database, sql, output_file, output_format, names))
+        if columnar:
+            print(_columnar_and_output(database, sql, output_file))
+        elif partition is not None:
+            print(_partition_and_output(database, sql, output_file,
+                                        output_format, partition, shards,
+                                        quantiles, names, compress))
+        elif stream:
+            print(_stream_and_output(database, sql, output_file,
+                                     output_format, names, compress))
+        else:
+            print(_query_and_output(database, sql, output_file,
+                                    output_format, names, compress))
 
     except collection.script.ScriptInputError as err:
         print("\n***", err)
@@ -161,9 +256,15 @@ def main(output_file=None, sql_file=None, output_format=None, db_login=None,
     except FileNotFoundError as err:
         print('\n*** Input Error: Bad file path', output_file)
 
+    except FileExistsError as err:
+        print('\n*** Input Error:', err)
+
     except collection.common.DatabaseError as err:
         print("\n***", err)
 
+    except ImportError as err:
+        print("\n***", err)
+
 
 # Helper Functions #####################################################
 
@@ -228,7 +329,8 @@ def _get_query(sql_file=None):
             "Input Error: No Sql file: " + sql_file)
 
 
-def _query_and_output(database, sql, out_file, _format, names=False):
+def _query_and_output(database, sql, out_file, _format, names=False,
+                      compress=False):
     """Queries the database and writes the results to a file.
 
     Writes results to the file in the given _format.
@@ -239,6 +341,7 @@ def _query_and_output(database, sql, out_file, _format, names=False):
         _format (str): j for JSON output or c for CSV output.
         names (bool): Weather or not to place column names in the first
             row of a CSV
+        compress (bool): Weather or not to gzip the file.
 
     Returns
         str: A message about the success or failure of the query and
@@ -246,10 +349,10 @@ def _query_and_output(database, sql, out_file, _format, names=False):
     """
     try:
         database.connect(_format='j')
-        results = database.query(sql)
+        results = list(_decompress(database.query(sql)))
 
         if _format == 'j':
-            with open(out_file, 'w') as file:
+            with _open_output(out_file, compress) as file:
                 json.dump(results, file)
 
         elif _format == 'c':
@@ -263,7 +366,7 @@ def _query_and_output(database, sql, out_file, _format, names=False):
                 new_results.append(row)
             results = new_results
 
-            with open(out_file, 'w', newline='') as csvfile:
+            with _open_output(out_file, compress) as csvfile:
                 wr = csv.writer(csvfile, delimiter=',')
                 if names:
                     wr.writerow(header)
@@ -276,3 +379,354 @@ def _query_and_output(database, sql, out_file, _format, names=False):
 
     finally:
         database.close()
+
+
+def _stream_and_output(database, sql, out_file, _format, names=False,
+                       compress=False):
+    """Streams the results of a query to a file.
+
+    Rows are fetched with a server side cursor and written as they
+    arrive, so only a small batch of rows is in memory at a time.
+
+    Args:
+        database (common.Database): A database object
+        sql (str): The query to run. Should be a SELECT query only.
+        _format (str): j for JSON Lines output or c for CSV output.
+        names (bool): Weather or not to place column names in the first
+            row of a CSV
+        compress (bool): Weather or not to gzip the file.
+
+    Returns
+        str: A message about the success or failure of the query and
+            file output.
+    """
+    try:
+        database.connect(_format='j')
+        progress = Progress()
+        with _open_output(out_file, compress) as file:
+            rows = _decompress(database.stream_query(sql))
+            count = _write_rows(rows, file, _format, names, progress)
+        progress.finish()
+        return "Successfully wrote {} rows to {}".format(count, out_file)
+
+    except collection.common.DatabaseError as error:
+        raise collection.common.DatabaseError(str(error))
+
+    finally:
+        database.close()
+
+
+def _columnar_and_output(database, sql, out_dir):
+    """Streams the results of a query into a columnar dataset.
+
+    Args:
+        database (common.Database): A database object
+        sql (str): The query to run. Should be a SELECT query only.
+        out_dir (str): The dataset directory to create.
+
+    Returns
+        str: A message about the success or failure of the query and
+            file output.
+    """
+    writer = collection.columnar.ColumnarWriter(out_dir)
+    try:
+        database.connect(_format='j')
+        progress = Progress()
+        with writer:
+            for row in _decompress(database.stream_query(sql)):
+                writer.add(row)
+                progress.update()
+        progress.finish()
+        return "Successfully wrote {} rows to {}".format(writer.rows, out_dir)
+
+    except collection.common.DatabaseError as error:
+        raise collection.common.DatabaseError(str(error))
+
+    finally:
+        database.close()
+
+
+def _partition_and_output(database, sql, out_file, _format, column, shards,
+                          quantiles=False, names=False, compress=False):
+    """Splits a query into ranges of a column and streams each range to
+    its own shard file in parallel.
+
+    Each range runs on its own connection from the database pool. A
+    manifest with the query, ranges, files and row counts is written to
+    <out_file>.manifest.json.
+
+    Args:
+        database (common.Database): A database object
+        sql (str): The query to run. Should be a SELECT query only.
+        out_file (str): The output file. Shard numbers are added to the
+            name of each shard file.
+        _format (str): j for JSON Lines output or c for CSV output.
+        column (str): A selected column to split the ranges on.
+        shards (int): The number of ranges.
+        quantiles (bool): Wether to choose ranges from sampled
+            quantiles instead of equal splits of MIN to MAX.
+        names (bool): Weather or not to place column names in the first
+            row of each CSV shard.
+        compress (bool): Weather or not to gzip the shards.
+
+    Returns
+        str: A message about the success or failure of the query and
+            file output.
+
+    Raises:
+        ScriptInputError: If the column is not a valid name or cannot
+            be split into equal ranges.
+    """
+    if not re.match(r'^[A-Za-z_][A-Za-z0-9_]*$', column):
+        raise collection.script.ScriptInputError(
+            "Input Error: Not a valid partition column: " + column)
+    if shards < 1:
+        raise collection.script.ScriptInputError(
+            "Input Error: Shards must be at least 1")
+
+    sql = sql.strip().rstrip(';')
+    try:
+        database.connect(_format='j')
+        start = time.time()
+        if quantiles:
+            bounds = _quantile_bounds(database, sql, column, shards)
+        else:
+            bounds = _range_bounds(database, sql, column, shards)
+
+        progress = Progress()
+        jobs = []
+        for i, where, args in _shard_conditions(column, bounds):
+            shard_sql = "SELECT * FROM ({}) AS q WHERE {}".format(
+                sql.replace('%', '%%'), where)
+            jobs.append((i, _shard_path(out_file, i), shard_sql, where, args))
+
+        workers = max(1, min(len(jobs), database.pool_size))
+        threads = max(1, config.compression['threads'] // workers)
+
+        def export(job):
+            i, path, shard_sql, where, args = job
+            with _open_output(path, compress) as file:
+                rows = _decompress(database.stream_query(shard_sql, args=args),
+                                   threads)
+                count = _write_rows(rows, file, _format, names, progress)
+            return {'shard': i, 'file': os.path.basename(path),
+                    'where': where, 'args': args, 'rows': count}
+
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(export, jobs))
+        progress.finish()
+
+        manifest = {
+            'query': sql,
+            'partition': column,
+            'quantiles': quantiles,
+            'format': 'jsonl' if _format == 'j' else 'csv',
+            'compressed': compress,
+            'bounds': bounds,
+            'rows': sum(r['rows'] for r in results),
+            'seconds': round(time.time() - start, 3),
+            'shards': results
+        }
+        manifest_path = out_file + '.manifest.json'
+        with open(manifest_path, 'w') as file:
+            json.dump(manifest, file, indent=2, default=str)
+
+        return "Successfully wrote {} rows to {} shards. See {}".format(
+            manifest['rows'], len(results), manifest_path)
+
+    except collection.common.DatabaseError as error:
+        raise collection.common.DatabaseError(str(error))
+
+    finally:
+        database.close()
+
+
+def _range_bounds(database, sql, column, shards):
+    """Splits MIN to MAX of a numeric column into equal ranges.
+
+    Returns:
+        list: The lower bound of each range after the first, in order.
+        Empty if the query has no rows.
+
+    Raises:
+        ScriptInputError: If the column is not a number.
+    """
+    result = database.query(
+        "SELECT MIN({0}) AS lo, MAX({0}) AS hi FROM ({1}) AS q".format(
+            column, sql))[0]
+    low, high = result['lo'], result['hi']
+    if low is None:
+        return []
+
+    if not all(isinstance(v, (int, float)) for v in (low, high)):
+        raise collection.script.ScriptInputError(
+            "Input Error: Partition column is not a number: " + column
+            + ". Use --quantiles.")
+
+    step = (high - low) / shards
+    bounds = []
+    for i in range(1, shards):
+        bound = low + step * i
+        if isinstance(low, int):
+            bound = int(bound)
+        if not bounds or bound > bounds[-1]:
+            bounds.append(bound)
+    return [b for b in bounds if low < b <= high]
+
+
+def _quantile_bounds(database, sql, column, shards, sample_size=10000):
+    """Chooses range bounds from quantiles of a random sample of a
+    column's values, so the ranges have about the same number of rows.
+
+    Returns:
+        list: The lower bound of each range after the first, in order.
+    """
+    total = database.query(
+        "SELECT COUNT(*) AS n FROM ({}) AS q".format(sql))[0]['n']
+    if not total:
+        return []
+
+    rate = min(1.0, sample_size / total)
+    rows = database.stream_query(
+        "SELECT {0} AS k FROM ({1}) AS q WHERE {0} IS NOT NULL "
+        "AND RAND() < {2}".format(column, sql, rate))
+    sample = sorted(row['k'] for row in rows)
+    if not sample:
+        return []
+
+    bounds = []
+    for i in range(1, shards):
+        bound = sample[len(sample) * i // shards]
+        if bound > sample[0] and (not bounds or bound > bounds[-1]):
+            bounds.append(bound)
+    return bounds
+
+
+def _shard_conditions(column, bounds):
+    """Yields the shard number, WHERE clause and its args for each range
+    between bounds. The first range also gets the rows where the column
+    is NULL so no rows are missed."""
+    if not bounds:
+        yield 0, "1 = 1", None
+        return
+
+    yield 0, "({0} < %s OR {0} IS NULL)".format(column), [bounds[0]]
+    for i in range(1, len(bounds)):
+        yield (i, "{0} >= %s AND {0} < %s".format(column),
+               [bounds[i - 1], bounds[i]])
+    yield len(bounds), "{0} >= %s".format(column), [bounds[-1]]
+
+
+def _shard_path(out_file, shard):
+    """Adds a shard number to a file name before its extensions.
+    ie) export.csv.gz -> export_003.csv.gz"""
+    directory, name = os.path.split(out_file)
+    base, dot, ext = name.partition('.')
+    return os.path.join(directory,
+                        "{}_{:03d}{}{}".format(base, shard, dot, ext))
+
+
+def _write_rows(rows, file, _format, names=False, progress=None):
+    """Writes dict rows to a file one at a time as CSV or JSON Lines.
+
+    Args:
+        rows (iterable of dict): The rows to write.
+        file (file): A text file open for writing.
+        _format (str): j for JSON Lines or c for CSV.
+        names (bool): Weather or not to place column names in the first
+            row of a CSV
+        progress (Progress): Counts the rows written. Default is None.
+
+    Returns:
+        int: The number of rows written.
+    """
+    count = 0
+    if _format == 'j':
+        for row in rows:
+            file.write(json.dumps(row, default=str))
+            file.write('\n')
+            count += 1
+            if progress is not None:
+                progress.update()
+
+    else:
+        writer = csv.writer(file, delimiter=',')
+        header = None
+        for row in rows:
+            if header is None:
+                header = list(row)
+                if names:
+                    writer.writerow(header)
+            writer.writerow([row[h] for h in header])
+            count += 1
+            if progress is not None:
+                progress.update()
+
+    return count
+
+
+def _decompress(rows, threads=None):
+    """Decompresses the compressed source columns of rows in worker
+    threads. Columns that are not compressed are passed through.
+
+    Args:
+        rows (iterable of dict): The rows of a query.
+        threads (int): The number of threads. Default is threads in the
+            compression config.
+    """
+    if threads is None:
+        threads = config.compression['threads']
+    return collection.common.decompress_rows(
+        rows, config.compression['columns'], threads)
+
+
+def _open_output(out_file, compress=False):
+    """Opens an output file for writing text, gzipped if compress is
+    True. Files whose names end in .gz, .bz2, .xz or .zst are always
+    compressed, see :func:`collection.common.open_file`."""
+    if compress and (collection.common.strip_compression(out_file)
+                     == out_file):
+        return gzip.open(out_file, 'wt', newline='', compresslevel=6)
+    settings = config.compressed_files
+    return collection.common.open_file(out_file, 'w', settings['threads'],
+                                       settings['level'], newline='')
+
+
+# Classes ##############################################################
+
+class Progress:
+    """Prints the number of rows written and the rows per second.
+
+    Can be shared by threads.
+
+    Attributes:
+        count (int): The number of rows written so far.
+        interval (float): The min seconds between printing progress.
+    """
+
+    def __init__(self, interval=1.0):
+        self.count = 0
+        self.interval = interval
+        self._start = time.time()
+        self._last = self._start
+        self._lock = threading.Lock()
+
+    def update(self, rows=1):
+        """Adds to the count and prints the progress if it has not been
+        printed for interval seconds."""
+        with self._lock:
+            self.count += rows
+            now = time.time()
+            if now - self._last < self.interval:
+                return
+            self._last = now
+        self._print(now, end='\r')
+
+    def finish(self):
+        """Prints the final count and rate."""
+        self._print(time.time())
+
+    def _print(self, now, end='\n'):
+        elapsed = max(now - self._start, 1e-6)
+        print("Rows: {:,} ({:,.0f} rows/s)".format(
+            self.count, self.count / elapsed), end=end, flush=True)
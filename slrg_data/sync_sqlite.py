@@ -0,0 +1,216 @@
+"""Script to push the samples in local SQLite files to the MySQL
+database.
+
+Used when collection is run with the 'sqlite' storage backend. Each
+table in a SQLite file is loaded into the table with the same name in
+the database in large chunks with LOAD DATA LOCAL INFILE. The last row
+pushed from each table is remembered in the SQLite file, so running
+the script again only pushes new rows.
+
+Usage
+=====
+
+Run::
+
+    $ slrg-sync-sqlite [-h] [-u <database username>]
+        [-p <database password>] [-c <rows per chunk>] [--replace]
+        [<sqlite files>]
+
+Options
+~~~~~~~
+
+**-h**
+    Print help text.
+
+**-u <database username>**
+    The database username. Defaults to value in config file, if config
+    value is None it will be asked for.
+
+**-p <database password>**
+    The database password. Defaults to value in config file. If config
+    value is None it will be asked for.
+
+**-c <rows per chunk>**
+    The number of rows to load at a time. Defaults to chunk_rows in the
+    bulk_load config.
+
+**--replace**
+    Replace rows that are already in the database. Default is to skip
+    them.
+
+**<sqlite files>**
+    The SQLite files to push. Default is all .db files in slrg/sqlite.
+"""
+# Standard python modules
+import getopt
+import os
+import sqlite3
+import sys
+
+# Local imports
+from . import collection
+from .help_text import SYNC_SQLITE as HELP_TEXT
+
+# Add the directory with the configuration file to the path
+try:
+    sys.path.append(collection.common.SLRG_DIR)
+    import config  # nopep8, pylint: disable=import-error
+except ModuleNotFoundError:
+    print('Config Error: Could not find config.py.',
+          'Try re-installing the slrg_data package.',
+          'If this does not work consult the config section of the documentation.')
+    sys.exit()
+
+
+# Table in each SQLite file with the last rowid pushed for each table
+SYNC_TABLE = '_slrg_sync'
+
+
+# Script and Main Functions ############################################
+
+def _entry():
+    """Entry point for the script."""
+    _script(sys.argv[1:])
+
+
+def _script(argv):
+    """Processes command line arguments and calls main with their values.
+
+    See module details for more info on command line options.
+
+    Args:
+        argv (list of str): The list of command line options and args
+            not containing the script name.
+    """
+    login = None
+    passwd = None
+    chunk_rows = None
+    replace = False
+
+    try:
+        opts, args = getopt.getopt(argv, "u:p:c:h", ['replace'])
+    except getopt.GetoptError:
+        print(HELP_TEXT)
+        sys.exit()
+
+    for opt, arg in opts:
+        if opt == '-u':
+            login = arg
+        elif opt == '-p':
+            passwd = arg
+        elif opt == '-c':
+            chunk_rows = int(arg)
+        elif opt == '--replace':
+            replace = True
+        elif opt == '-h':
+            print(HELP_TEXT)
+            return
+
+    main(files=args if args else None, db_login=login, db_passwd=passwd,
+         chunk_rows=chunk_rows, replace=replace)
+
+
+def main(files=None, db_login=None, db_passwd=None, chunk_rows=None,
+         replace=False):
+    """Pushes the rows in SQLite files to the MySQL database.
+
+    Args:
+        files (list of str): The SQLite files. Default is all .db files
+            in slrg/sqlite.
+        db_login (str): The username for the database.
+        db_passwd (str): The database users password.
+        chunk_rows (int): The number of rows to load at a time.
+        replace (bool): Wether to replace rows that are already in the
+            database instead of skipping them.
+    """
+    if files is None:
+        sqlite_dir = os.path.join(collection.common.SLRG_DIR, 'sqlite')
+        files = sorted(os.path.join(sqlite_dir, name)
+                       for name in os.listdir(sqlite_dir)
+                       if name.endswith('.db'))
+
+    if chunk_rows is None:
+        chunk_rows = config.bulk_load['chunk_rows']
+    stage_dir = config.bulk_load['dir']
+    if stage_dir is None:
+        stage_dir = os.path.join(collection.common.SLRG_DIR, 'bulk')
+
+    database = collection.script.make_database(config.database,
+                                               login=db_login,
+                                               passwd=db_passwd)
+    loader = collection.common.BulkLoader(
+        database, stage_dir, chunk_rows=chunk_rows,
+        duplicates='replace' if replace else 'ignore')
+
+    try:
+        database.connect()
+        for path in files:
+            print("---", path)
+            _sync_file(path, loader)
+        loader.report()
+
+    except collection.script.ScriptInputError as err:
+        print('\n***', err)
+
+    except collection.common.DatabaseError as err:
+        print('\n***', err)
+
+    finally:
+        database.close()
+
+
+# Helper Functions #####################################################
+
+def _sync_file(path, loader):
+    """Pushes the new rows of every table in a SQLite file.
+
+    Args:
+        path (str): The SQLite file.
+        loader (BulkLoader): The bulk loader for the database.
+    """
+    local = sqlite3.connect(path)
+    try:
+        local.execute("CREATE TABLE IF NOT EXISTS {} "
+                      "(name PRIMARY KEY, last_rowid);".format(SYNC_TABLE))
+        tables = [row[0] for row in local.execute(
+            "SELECT name FROM sqlite_master WHERE type='table' "
+            "AND name NOT LIKE 'sqlite_%' AND name != ?;", [SYNC_TABLE])]
+
+        for table in tables:
+            _sync_table(local, table, loader)
+    finally:
+        local.close()
+
+
+def _sync_table(local, table, loader):
+    """Pushes the rows of a SQLite table added since the last sync.
+
+    The last rowid is only saved once all of the rows have been loaded,
+    so a failed sync pushes the same rows again next time.
+
+    Args:
+        local (sqlite3.Connection): The SQLite file.
+        table (str): The table to push.
+        loader (BulkLoader): The bulk loader for the database.
+    """
+    row = local.execute("SELECT last_rowid FROM {} WHERE name=?;".format(
+        SYNC_TABLE), [table]).fetchone()
+    last = row[0] if row else 0
+
+    columns = [info[1] for info in local.execute(
+        "PRAGMA table_info({});".format(table))]
+    cursor = local.execute(
+        "SELECT rowid, {} FROM {} WHERE rowid > ? ORDER BY rowid;".format(
+            ", ".join(columns), table), [last])
+
+    count = 0
+    for values in cursor:
+        loader.insert(columns, table, values[1:])
+        last = values[0]
+        count += 1
+    loader.flush()
+
+    local.execute("INSERT OR REPLACE INTO {} VALUES (?, ?);".format(
+        SYNC_TABLE), [table, last])
+    local.commit()
+    print("{}: {} new rows".format(table, count))